@@ -0,0 +1,180 @@
+"""
+Executor that supervises command line tools from an asyncio event loop.
+Needs Python 3.8 or later, import it only when it is used.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import subprocess
+
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from rabix.cli import CommandLineTool
+from rabix.cli.cli_app import process_usage
+from rabix.executor import Executor
+from rabix.scatter import Chunk
+
+log = logging.getLogger(__name__)
+
+
+async def wait_with_usage(pid):
+    """
+    (status, rusage) of child process pid once it exits. Waits on a pidfd
+    where there is one, otherwise polls, never with a thread per child.
+    """
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+
+    if fd is not None:
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+        _, status, rusage = os.wait4(pid, 0)
+        return status, rusage
+
+    delay = 0.01
+    while True:
+        waited, status, rusage = os.wait4(pid, os.WNOHANG)
+        if waited:
+            return status, rusage
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+class AsyncExecutor(Executor):
+    """
+    Command line tools that don't run in a container are started and
+    awaited on a single event loop thread, so any number of them can be
+    in flight without holding a pool worker each. Other jobs run on the
+    worker pool as usual.
+
+    What blocks around a tool's process, preparing its work dir and
+    command line, starting it, collecting outputs, the call cache and
+    the history, runs on a pool of prepare_workers threads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        prepare_workers = kwargs.pop('prepare_workers', 4)
+        super(AsyncExecutor, self).__init__(*args, **kwargs)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self.prepare_pool = ThreadPoolExecutor(max_workers=prepare_workers)
+
+    @property
+    def loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                t = threading.Thread(target=self._loop.run_forever,
+                                     name='rabix-event-loop')
+                t.daemon = True
+                t.start()
+        return self._loop
+
+    def blocking(self, fn, *args):
+        """
+        Awaitable result of fn(*args), called on the prepare pool.
+        """
+        return self.loop.run_in_executor(self.prepare_pool,
+                                         partial(fn, *args))
+
+    @staticmethod
+    def is_async(job):
+        return isinstance(job.app, CommandLineTool) and not job.app.container
+
+    def submit(self, job, granted, future):
+        if not self.is_async(job):
+            return super(AsyncExecutor, self).submit(job, granted, future)
+        asyncio.run_coroutine_threadsafe(
+            self.run_admitted_async(job, granted, future), self.loop)
+
+    async def run_admitted_async(self, job, granted, future):
+        try:
+            if future.set_running_or_notify_cancel():
+                job.allocated_resources = granted
+                try:
+                    future.set_result(await self.run_leaf_async(job))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self.resources.release(granted)
+            self.dispatch()
+
+    async def run_chunk_async(self, chunk):
+        results, pending, keys = await self.blocking(self.split_chunk,
+                                                     chunk)
+        if pending is None:
+            return results
+        started = time.time()
+        succeeded = False
+        try:
+            outputs = await self.run_process(pending)
+            succeeded = True
+        finally:
+            await self.blocking(self.record_chunk, pending, started,
+                                succeeded)
+        return await self.blocking(self.merge_chunk, results, pending, keys,
+                                   outputs)
+
+    async def run_leaf_async(self, job):
+        if isinstance(job, Chunk):
+            return await self.run_chunk_async(job)
+        if self.resume:
+            await self.blocking(self.clear_stale, job)
+        cache = self.cache
+        if cache is None or not cache.cacheable(job):
+            return await self.run_tool(job)
+
+        key = await self.blocking(cache.key, job)
+        outputs = await self.blocking(cache.get, job, key)
+        if outputs is not None:
+            log.info('Job %s: using cached outputs (%s)', job.id, key)
+            return outputs
+        outputs = await self.run_tool(job)
+        await self.blocking(cache.put, job, key, outputs)
+        return outputs
+
+    async def run_tool(self, job):
+        started = time.time()
+        succeeded = False
+        try:
+            outputs = await self.run_process(job)
+            succeeded = True
+            return outputs
+        finally:
+            await self.blocking(self.record_run, job, started, succeeded)
+
+    async def run_process(self, job):
+        """
+        Run a job or Chunk of a command line tool without a container.
+        """
+        app = job.app
+        chunk = isinstance(job, Chunk)
+        if chunk:
+            prepared = await self.blocking(app.prepare_chunk, job)
+        else:
+            prepared = await self.blocking(app.prepare, job)
+        # started on the prepare pool, forking blocks; reaped here rather
+        # than by asyncio, to get its cpu time and RSS
+        proc = await self.blocking(
+            partial(subprocess.Popen, cwd=prepared.job_dir),
+            ['bash', '-c', prepared.cmd_line])
+        job.usage.update(process_usage(*await wait_with_usage(proc.pid)))
+        proc.returncode = job.usage['exit_status']
+        if chunk:
+            app.share_usage(job.jobs, job.usage)
+        app.check_exit_status(job.usage['exit_status'])
+        if chunk:
+            return await self.blocking(app.collect_chunk, prepared)
+        return await self.blocking(app.collect, prepared)
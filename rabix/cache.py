@@ -0,0 +1,134 @@
+import os
+import json
+import errno
+import logging
+import tempfile
+import threading
+
+from rabix.cli import CommandLineTool
+from rabix.common.models import File
+from rabix.common.ref_resolver import loader
+from rabix.common.util import checksum, map_rec_collection
+from rabix.expressions import ExpressionTool
+
+log = logging.getLogger(__name__)
+
+OUTPUT_FILE = 'cwl.output.json'
+
+
+def collect_files(val):
+    files = []
+
+    def append_file(f):
+        if isinstance(f, File):
+            files.append(f)
+            files.extend(collect_files(f.secondary_files))
+
+    map_rec_collection(append_file, val)
+    return files
+
+
+class CallCache(object):
+    """
+    Persistent cache of tool outputs, stored under
+    <path>/<key[:2]>/<key>/cwl.output.json.
+
+    The key is a hash of the process document, the resolved inputs, the
+    checksums of all input files and the docker image ID.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(job):
+        return isinstance(job.app, (CommandLineTool, ExpressionTool))
+
+    def file_checksum(self, f):
+        if f.checksum:
+            return f.checksum
+        if not f.url.islocal() or not os.path.exists(f.path):
+            return None
+
+        st = os.stat(f.path)
+        stamp = (f.path, st.st_size, st.st_mtime)
+        with self._lock:
+            cached = self._checksums.get(stamp)
+        if cached is None:
+            cached = 'sha1$' + checksum(f.path)
+            with self._lock:
+                self._checksums[stamp] = cached
+        return cached
+
+    def key(self, job):
+        app = job.app
+        # installing resolves the image ID the tool will actually run in
+        app.install(job=job)
+        container = getattr(app, 'container', None)
+        document = {
+            'app': loader.checksum(job.context.to_primitive(app)),
+            'inputs': job.context.to_primitive(job.inputs),
+            'files': {
+                f.path: self.file_checksum(f)
+                for f in collect_files(job.inputs)
+            },
+            'image': getattr(container, 'image_id', None)
+        }
+        return loader.checksum(document)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key, OUTPUT_FILE)
+
+    def get(self, job, key):
+        path = self.entry_path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            outputs = job.context.from_dict(json.load(f))
+
+        for out in collect_files(outputs):
+            if not os.path.exists(out.path):
+                log.info('Cached output %s is gone, ignoring cache entry %s',
+                         out.path, key)
+                return None
+        return outputs
+
+    def put(self, job, key, outputs):
+        path = self.entry_path(key)
+        entry_dir = os.path.dirname(path)
+        try:
+            os.makedirs(entry_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # write to a temp file and rename, readers never see partial entries
+        fd, tmp = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job.context.to_primitive(outputs), f)
+        os.rename(tmp, path)
+
+    def run(self, job, run_job=None):
+        """
+        Return cached outputs of job, or run it with run_job (job.run by
+        default) and store the outputs.
+        """
+        run_job = run_job or (lambda j: j.run())
+        if not self.cacheable(job):
+            return run_job(job)
+
+        key = self.key(job)
+        outputs = self.get(job, key)
+        if outputs is not None:
+            log.info('Job %s: using cached outputs (%s)', job.id, key)
+            return outputs
+
+        outputs = run_job(job)
+        self.put(job, key, outputs)
+        return outputs
+
+    def __repr__(self):
+        return 'CallCache(%s)' % self.path
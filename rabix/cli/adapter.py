@@ -202,7 +202,26 @@ class CLIJob(object):
 
         return [six.text_type(arg) for arg in base_cmd + args]
 
+    def expressions(self):
+        """
+        (expression or value, context) of everything cmd_line()
+        resolves, but expressions in fields and items of input values.
+        """
+        requests = [(self._stdin, None), (self._stdout, None)]
+        requests.extend((item, None) for item in self.base_cmd)
+        requests.extend((a.get('valueFrom'), a.get('valueFrom'))
+                        for a in self.args)
+        for inp in self.app.inputs:
+            binding = inp.input_binding or {}
+            if inp.id in self.job.inputs and 'valueFrom' in binding:
+                value = self.job.inputs[inp.id]
+                requests.append((
+                    binding['valueFrom'],
+                    value.to_dict() if hasattr(value, 'to_dict') else value))
+        return requests
+
     def cmd_line(self):
+        self.eval.prefetch(self.expressions())
         a = self.make_arg_list()
 
         if self._stdin:
@@ -230,19 +249,23 @@ class CLIJob(object):
     def get_outputs(self, job_dir, job):
         result, outs = {}, self.app.outputs
         eval = ValueResolver(job)
+        eval.prefetch(
+            [((out.output_binding or {}).get(k), None) for out in outs
+             for k in ('glob', 'secondaryFiles')])
         for out in outs:
             out_binding = out.output_binding
-            ret = os.getcwd()
-            os.chdir(job_dir)
             pattern = eval.resolve(out_binding.get('glob')) or ""
             patterns = chain(*[self.glob_or(p) for p in wrap_in_list(pattern)])
-            files = chain(*[glob.glob(p) for p in patterns])
+            # glob relative to job_dir without chdir, jobs may run in threads
+            files = chain(*[glob.glob(os.path.join(job_dir, p))
+                            for p in patterns])
             res = [File({
                    'class': 'File',
                    'path': os.path.abspath(p),
                    'size': os.stat(p).st_size,
                    'checksum': 'sha1$' + checksum(os.path.abspath(p)),
-                   'metadata': meta(p, job.inputs, eval, out_binding),
+                   'metadata': meta(os.path.relpath(p, job_dir),
+                                    job.inputs, eval, out_binding),
                    'secondaryFiles': secondary_files(p, out_binding, eval)
                    }) for p in files]
             if out_binding.get('outputEval'):
@@ -253,7 +276,6 @@ class CLIJob(object):
                 )
             else:
                 result[out.id] = res
-            os.chdir(ret)
             if out.depth == 0:
                 res = result[out.id]
                 result[out.id] = res[0] if res and isinstance(res, list) else res
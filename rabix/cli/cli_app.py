@@ -6,8 +6,11 @@ import stat
 import copy
 import logging
 import shutil
+import threading
 
+from collections import namedtuple
 from avro.schema import NamedSchema
+from six.moves import shlex_quote
 
 from rabix.cli.adapter import CLIJob
 from rabix.common.errors import RabixError
@@ -17,10 +20,47 @@ from rabix.common.models import (
 from rabix.common.io import InputCollector
 from rabix.common.util import map_or_apply, map_rec_collection
 from rabix.expressions import ValueResolver
+from rabix.workdirs import make_dirs
 
 
 log = logging.getLogger(__name__)
 
+PreparedJob = namedtuple('PreparedJob', [
+    'job', 'job_dir', 'cmd_line', 'container', 'env', 'mappings', 'cli_job',
+    'abspath_job'
+])
+
+PreparedChunk = namedtuple('PreparedChunk', [
+    'jobs', 'job_dir', 'cmd_line', 'container'
+])
+
+
+def process_usage(status, rusage):
+    """
+    Exit status, CPU time (user + system) and max RSS in KB of a process,
+    from what os.wait4 returned for it.
+    """
+    if os.WIFSIGNALED(status):
+        exit_status = -os.WTERMSIG(status)
+    else:
+        exit_status = os.WEXITSTATUS(status)
+    return {
+        'exit_status': exit_status,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss
+    }
+
+
+def call_with_usage(args, cwd=None):
+    """
+    Run command and return its usage, see process_usage.
+    """
+    proc = subprocess.Popen(args, cwd=cwd)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    usage = process_usage(status, rusage)
+    proc.returncode = usage['exit_status']
+    return usage
+
 
 def flatten_files(files):
     flattened = []
@@ -145,26 +185,33 @@ class CommandLineTool(Process):
                           for a in (arguments or [])]
         self.stdin = stdin
         self.stdout = stdout
-        self.mappings = {}
-        self.cli_job = None
-        self._command_line = None
+        self._install_lock = threading.Lock()
         self.container = next(
             (r for r in self.requirements if hasattr(r, 'run')),
             next((r for r in self.hints if hasattr(r, 'run')), None)
         )
 
-    def run(self, job, job_dir=None):
+    @staticmethod
+    def abs_dir(job_dir):
+        job_dir = os.path.abspath(job_dir)
+        return job_dir if job_dir.endswith('/') else job_dir + '/'
+
+    def stage(self, job, job_dir, container):
+        """
+        Copy of job with inputs loaded and downloaded, and its work dir
+        set up. Returns (job, environment).
+        """
+        # input values may be shared with other jobs, e.g. scatter shards,
+        # Files are copied when they are loaded or remapped
+        job = Job(job.id, job.app, dict(job.inputs),
+                  job.allocated_resources, job.context)
         self.load_input_content(job)
-        job_dir = os.path.abspath(job_dir or job.id)
-        if not job_dir.endswith('/'):
-            job_dir += '/'
 
-        if not os.path.exists(job_dir):
-            os.mkdir(job_dir)
+        # shards of large scatters are nested in dirs of their own
+        make_dirs(job_dir)
 
         os.chmod(job_dir, os.stat(job_dir).st_mode | stat.S_IROTH |
                  stat.S_IWOTH)
-        self.cli_job = CLIJob(job)
 
         eval = ValueResolver(job)
 
@@ -177,36 +224,92 @@ class CommandLineTool(Process):
         if evr:
             env = evr.var_map(eval)
 
-        self.ensure_files(job, job_dir)
-        self.install(job=job)
-
-        abspath_job = Job(
-            job.id, job.app, copy.deepcopy(job.inputs),
-            job.allocated_resources, job.context
-        )
+        self.ensure_files(job, job_dir, container)
+        return job, env
 
-        cmd_line = self.command_line(job, job_dir)
+    def prepare_command(self, job, job_dir, container, env, mappings):
+        abspath_job = Job(job.id, job.app, job.inputs,
+                          job.allocated_resources, job.context)
+        job.inputs = self.remap(job.inputs, mappings)
+        cli_job = CLIJob(job)
+        cmd_line = cli_job.cmd_line()
         log.info("Running: %s" % cmd_line)
-        self.job_dump(job, job_dir)
+        return PreparedJob(job, job_dir, cmd_line, container, env, mappings,
+                           cli_job, abspath_job)
 
-        if self.container:
-            self.container.run(cmd_line, job_dir, env)
-        else:
-            ret = subprocess.call(['bash', '-c', cmd_line], cwd=job_dir)
-            if ret != 0:
-                raise RabixError("Command failed with exit status %s" % ret)
+    def prepare(self, job, job_dir=None):
+        """
+        Set up the work dir and build the command line of job, everything
+        run() does before starting the tool.
+        """
+        job_dir = self.abs_dir(job_dir or job.id)
+        self.install(job=job)
+
+        # shards of a scatter run this tool concurrently, so per-run
+        # container state (downloads, volume binds) lives on a copy
+        container = copy.copy(self.container)
+        job, env = self.stage(job, job_dir, container)
+        mappings = self.get_mappings([job.inputs], job_dir, container)
+        prepared = self.prepare_command(job, job_dir, container, env,
+                                        mappings)
+        self.job_dump(job, job_dir)
+        return prepared
 
+    def prepare_chunk(self, chunk):
+        """
+        Set up the jobs of a scatter.Chunk to run back to back in one
+        process or container, with one command line. Each job works in
+        a dir of its own in the chunk's work dir, named as its id's base
+        name.
+        """
+        chunk_dir = self.abs_dir(chunk.id)
+        jobs = list(chunk.shards())
+        self.install(job=jobs[0])
+        container = copy.copy(self.container)
+
+        staged = []
+        for job in jobs:
+            name = os.path.basename(six.text_type(job.id).rstrip('/'))
+            job_dir = os.path.join(chunk_dir, name) + '/'
+            staged.append((name, job_dir) + self.stage(job, job_dir,
+                                                       container))
+
+        mappings = self.get_mappings([job.inputs for _, _, job, _ in staged],
+                                     chunk_dir, container)
+        prepared, commands = [], []
+        for name, job_dir, job, env in staged:
+            p = self.prepare_command(job, job_dir, container, env, mappings)
+            exports = ''.join('export %s && ' % shlex_quote(e)
+                              for e in env or [])
+            commands.append('(cd %s && %s%s)' % (
+                shlex_quote(name), exports, p.cmd_line))
+            prepared.append(p)
+        self.job_dump(chunk, chunk_dir)
+        return PreparedChunk(prepared, chunk_dir, '\n'.join(
+            '%s || exit $?' % c for c in commands), container)
+
+    @staticmethod
+    def check_exit_status(ret):
+        if ret != 0:
+            raise RabixError("Command failed with exit status %s" % ret)
+
+    def collect(self, prepared):
+        """
+        Outputs of a finished tool run, everything run() does after the
+        tool exits.
+        """
+        job, job_dir = prepared.job, prepared.job_dir
         result_path = os.path.abspath(job_dir) + '/cwl.output.json'
         if os.path.exists(result_path):
             with open(result_path, 'r') as res:
                 outputs = json.load(res)
         else:
             with open(result_path, 'w') as res:
-                outputs = self.cli_job.get_outputs(
-                    os.path.abspath(job_dir), abspath_job)
+                outputs = prepared.cli_job.get_outputs(
+                    os.path.abspath(job_dir), prepared.abspath_job)
                 json.dump(job.context.to_primitive(outputs), res)
 
-        self.unmap_paths(outputs)
+        self.unmap_paths(outputs, prepared.mappings)
 
         def write_rbx(f):
             if isinstance(f, File):
@@ -217,33 +320,92 @@ class CommandLineTool(Process):
 
         return outputs
 
+    def collect_chunk(self, prepared):
+        return [self.collect(p) for p in prepared.jobs]
+
+    @staticmethod
+    def share_usage(jobs, usage):
+        """
+        Split usage of a chunk evenly among its jobs.
+        """
+        for job in jobs:
+            job.usage.update(usage)
+            if usage.get('cpu_time') is not None:
+                job.usage['cpu_time'] = usage['cpu_time'] / len(jobs)
+
+    def run(self, job, job_dir=None):
+        prepared = self.prepare(job, job_dir)
+        if prepared.container:
+            prepared.container.run(prepared.cmd_line, prepared.job_dir,
+                                   prepared.env)
+        else:
+            job.usage.update(call_with_usage(
+                ['bash', '-c', prepared.cmd_line], cwd=prepared.job_dir))
+            self.check_exit_status(job.usage['exit_status'])
+        return self.collect(prepared)
+
+    def run_chunk(self, chunk):
+        """
+        Run the jobs of chunk back to back in one process or container,
+        see prepare_chunk, and return their outputs. Each job gets an
+        even share of the chunk's usage.
+        """
+        prepared = self.prepare_chunk(chunk)
+        if prepared.container:
+            prepared.container.run(prepared.cmd_line, prepared.job_dir)
+        else:
+            chunk.usage.update(call_with_usage(
+                ['bash', '-c', prepared.cmd_line], cwd=prepared.job_dir))
+            self.share_usage(chunk.jobs, chunk.usage)
+            self.check_exit_status(chunk.usage['exit_status'])
+        return self.collect_chunk(prepared)
+
     def command_line(self, job, job_dir=None):
-        self.remap_paths(job.inputs, job_dir)
-        self._command_line = self.cli_job.cmd_line()
-        return self._command_line
+        container = copy.copy(self.container)
+        job.inputs = self.remap(job.inputs, self.get_mappings(
+            [job.inputs], job_dir, container))
+        return CLIJob(job).cmd_line()
 
     def install(self, *args, **kwargs):
         if self.container:
-            self.container.install(*args, **kwargs)
+            with self._install_lock:
+                self.container.install(*args, **kwargs)
 
-    def ensure_files(self, job, job_dir):
-        if self.container:
-            self.container.ensure_files(job, job_dir)
+    def ensure_files(self, job, job_dir, container=None):
+        container = container or self.container
+        if container:
+            container.ensure_files(job, job_dir)
 
-    def remap_paths(self, inputs, job_dir):
-        if self.container:
-            files = collect_files(inputs)
-            flatened = flatten_files(files)
-            paths = [os.path.dirname(f.path) for f in flatened] + [job_dir]
-            prefixes = collect_prefixes(paths)
-            self.mappings = self.container.get_mapping(prefixes)
-            for file in files:
-                file.remap(self.mappings)
-
-    def unmap_paths(self, outputs):
+    def get_mappings(self, inputs, job_dir, container=None):
+        """
+        Mappings of paths to where the container sees them, for files in
+        each of inputs and job_dir.
+        """
+        container = container or self.container
+        if not container:
+            return {}
+        files = [f for values in inputs for f in collect_files(values)]
+        flatened = flatten_files(files)
+        paths = [os.path.dirname(f.path) for f in flatened] + [job_dir]
+        prefixes = collect_prefixes(paths)
+        return container.get_mapping(prefixes)
+
+    @staticmethod
+    def remap(inputs, mappings):
+        """
+        inputs with paths of Files remapped. Remapped Files are copies,
+        inputs are left unchanged.
+        """
+        if not mappings:
+            return inputs
+        return map_rec_collection(
+            lambda v: v.copy().remap(mappings) if isinstance(v, File) else v,
+            inputs)
+
+    def unmap_paths(self, outputs, mappings):
         files = collect_files(outputs)
         for file in files:
-            file.remap({v: k for k, v in six.iteritems(self.mappings)})
+            file.remap({v: k for k, v in six.iteritems(mappings)})
 
     def to_dict(self, context=None):
         d = super(CommandLineTool, self).to_dict(context)
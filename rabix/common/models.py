@@ -1,15 +1,16 @@
 import os
+import re
 import json
 import logging
-import time
-import datetime
+import threading
 from slugify import slugify
 from uuid import uuid4
 
 import six
 
 # noinspection PyUnresolvedReferences
-from six.moves.urllib.parse import urlparse, urlunparse, unquote, urljoin
+from six.moves.urllib.parse import urlparse, urlunparse, unquote, \
+    urljoin, ParseResult
 from base64 import b64decode
 from os.path import isabs
 from avro.schema import Names, UnionSchema, ArraySchema, Schema, VALID_TYPES
@@ -24,10 +25,15 @@ else:
 
 from rabix.common.errors import ValidationError, RabixError
 from rabix.common.util import wrap_in_list, map_rec_list, map_rec_collection
+from rabix.workdirs import WorkDirs
 
 log = logging.getLogger(__name__)
 MAX_CONTENT_SIZE = 64 * 1024
 
+# strings urlparse could read as more than a path: anything with a scheme,
+# netloc, params, query or fragment, or with characters it strips
+NOT_PLAIN_PATH = re.compile(r'[:;?#\t\r\n]|^//|^[\x00-\x20]')
+
 
 def process_builder(context, d):
     if not isinstance(d, dict):
@@ -55,23 +61,253 @@ def process_builder(context, d):
 
 
 def construct_files(val, schema):
-    if schema.type == 'array':
-        return [construct_files(e, schema.items) for e in val]
+    return compile_schema(schema).construct(val)
+
+
+class CompiledSchema(object):
+    """
+    Validator and File constructor for values of an avro schema,
+    specialized for the schema once instead of walking it for every
+    value. validate(value) behaves like avro's validate, construct(value)
+    turns File records in value into Files.
+
+    Unions pick the branches a value can match by its Python type, and
+    arrays of a union whose elements all have the same type check the
+    single branch they can match directly.
+    """
+
+    __slots__ = ('schema', 'types', 'validate', 'construct', 'branches',
+                 '_candidates')
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.branches = None
+        self._candidates = {}
+
+    def candidates(self, datum_type):
+        """
+        Union branches a value of datum_type can match, in order.
+        """
+        found = self._candidates.get(datum_type)
+        if found is None:
+            found = self._candidates[datum_type] = [
+                b for b in self.branches if issubclass(datum_type, b.types)]
+        return found
+
+
+# compiled schemas by id of the schema, which they keep alive
+_compiled = {}
+_compile_lock = threading.RLock()
+
+
+def compile_schema(schema):
+    compiled = _compiled.get(id(schema))
+    if compiled is not None and compiled.schema is schema:
+        return compiled
+    with _compile_lock:
+        pending = {}
+        compiled = _compile(schema, pending)
+        # published only when complete, recursive schemas refer to
+        # themselves while compiling
+        _compiled.update(pending)
+    return compiled
+
+
+def _compile(schema, pending):
+    key = id(schema)
+    compiled = _compiled.get(key) or pending.get(key)
+    if compiled is not None and compiled.schema is schema:
+        return compiled
+    compiled = pending[key] = CompiledSchema(schema)
+    compiled.types = _python_types(schema)
+    compiler = _COMPILERS.get(schema.type, _compile_generic)
+    compiled.validate, compiled.construct = compiler(
+        schema, compiled, pending)
+    return compiled
+
+
+def _python_types(schema):
+    """
+    Python types values of schema can have.
+    """
+    if schema.type in ('union', 'error_union'):
+        return tuple(set(t for s in schema.schemas
+                         for t in _python_types(s)))
+    return _PYTHON_TYPES.get(schema.type, (object,))
+
+
+def _identity(val):
+    return val
+
+
+def _compile_type_check(check=None):
+    def compiler(schema, compiled, pending):
+        types = compiled.types
+        if check:
+            return lambda d: isinstance(d, types) and check(
+                schema, d), _identity
+        return lambda d: isinstance(d, types), _identity
+    return compiler
+
+
+def _compile_null(schema, compiled, pending):
+    return lambda d: d is None, _identity
+
+
+def _compile_generic(schema, compiled, pending):
+    return lambda d: validate(schema, d), _identity
+
+
+def _compile_array(schema, compiled, pending):
+    items = _compile(schema.items, pending)
+
+    def validate_array(d):
+        if not isinstance(d, list):
+            return False
+        if items.branches is not None and d:
+            branch = _homogeneous_branch(items, d)
+            if branch is not None:
+                branch_validate = branch.validate
+                return all(branch_validate(e) for e in d)
+        item_validate = items.validate
+        return all(item_validate(e) for e in d)
+
+    def construct_array(val):
+        if items.branches is not None and val:
+            branch = _homogeneous_branch(items, val)
+            if branch is not None:
+                branch_validate = branch.validate
+                branch_construct = branch.construct
+                return [branch_construct(e) if branch_validate(e) else e
+                        for e in val]
+        item_construct = items.construct
+        return [item_construct(e) for e in val]
+
+    return validate_array, construct_array
+
+
+def _homogeneous_branch(union, values):
+    """
+    The only branch of union values can match, if they all have the
+    same type and there is one.
+    """
+    datum_type = type(values[0])
+    candidates = union.candidates(datum_type)
+    if len(candidates) != 1:
+        return None
+    for e in values:
+        if type(e) is not datum_type:
+            return None
+    return candidates[0]
+
+
+def _compile_map(schema, compiled, pending):
+    values = _compile(schema.values, pending)
+
+    def validate_map(d):
+        if not isinstance(d, dict):
+            return False
+        value_validate = values.validate
+        return all(isinstance(k, six.string_types) for k in d) and \
+            all(value_validate(v) for v in six.itervalues(d))
 
-    if schema.type == 'record':
-        if schema.name == 'File':
+    return validate_map, _identity
+
+
+def _avro_ignores_extra_fields():
+    """
+    Whether the installed avro validates records with keys that aren't
+    fields: avro 1.7.7 does, newer avro-python3 doesn't.
+    """
+    record = make_avsc_object(
+        {'type': 'record', 'name': 'Probe', 'fields': []}, Names())
+    return validate(record, {'class': 'Probe'})
+
+
+AVRO_IGNORES_EXTRA_FIELDS = _avro_ignores_extra_fields()
+
+
+def _compile_record(schema, compiled, pending):
+    fields = [(f.name, _compile(f.type, pending)) for f in schema.fields]
+    names = frozenset(name for name, _ in fields)
+
+    def validate_record(d):
+        if not isinstance(d, dict):
+            return False
+        for name, field in fields:
+            if not field.validate(d.get(name)):
+                return False
+        return AVRO_IGNORES_EXTRA_FIELDS or names.issuperset(d)
+
+    if schema.name == 'File':
+        def construct_record(val):
             return map_rec_list(File, val) if val else val
-        else:
-            ret = {}
-            for fld in schema.fields:
-                ret[fld.name] = construct_files(val.get(fld.name), fld.type)
-            return ret
-
-    if schema.type == 'union':
-        for s in schema.schemas:
-            if validate(s, val):
-                return construct_files(val, s)
-    return val
+    else:
+        def construct_record(val):
+            return {name: field.construct(val.get(name))
+                    for name, field in fields}
+
+    return validate_record, construct_record
+
+
+def _compile_union(schema, compiled, pending):
+    compiled.branches = [_compile(s, pending) for s in schema.schemas]
+    candidates = compiled.candidates
+
+    def validate_union(d):
+        for branch in candidates(type(d)):
+            if branch.validate(d):
+                return True
+        return False
+
+    def construct_union(val):
+        for branch in candidates(type(val)):
+            if branch.validate(val):
+                return branch.construct(val)
+        return val
+
+    return validate_union, construct_union
+
+
+def _in_range(low, high):
+    return lambda s, d: low <= d <= high
+
+
+_PYTHON_TYPES = {
+    'null': (type(None),),
+    'boolean': (bool,),
+    'string': six.string_types,
+    'bytes': (six.binary_type,),
+    'int': six.integer_types,
+    'long': six.integer_types,
+    'float': six.integer_types + (float,),
+    'double': six.integer_types + (float,),
+    'fixed': (six.binary_type,),
+    'array': (list,),
+    'map': (dict,),
+    'record': (dict,),
+    'error': (dict,),
+    'request': (dict,),
+}
+
+_COMPILERS = {
+    'null': _compile_null,
+    'boolean': _compile_type_check(),
+    'string': _compile_type_check(),
+    'bytes': _compile_type_check(),
+    'int': _compile_type_check(_in_range(-(1 << 31), (1 << 31) - 1)),
+    'long': _compile_type_check(_in_range(-(1 << 63), (1 << 63) - 1)),
+    'float': _compile_type_check(),
+    'double': _compile_type_check(),
+    'fixed': _compile_type_check(lambda s, d: len(d) == s.size),
+    'array': _compile_array,
+    'map': _compile_map,
+    'record': _compile_record,
+    'error': _compile_record,
+    'request': _compile_record,
+    'union': _compile_union,
+    'error_union': _compile_union,
+}
 
 
 def rebase_path(val, base):
@@ -86,10 +322,11 @@ def get_inputs(args, inputs, basedir=None):
     constructed = {}
     for i in inputs:
         val = args.get(i.id)
+        construct = compile_schema(i.validator).construct
         if i.depth == 0:
-            cons = construct_files(val, i.validator)
+            cons = construct(val)
         else:
-            cons = [construct_files(e, i.validator) for e in val] if val else []
+            cons = [construct(e) for e in val] if val else []
         if cons:
             constructed[i.id] = cons
     return map_rec_collection(
@@ -122,11 +359,23 @@ class Process(object):
             "Method 'run' is not implemented in the App class"
         )
 
+    def run_chunk(self, chunk):
+        """
+        Outputs of the jobs of a scatter.Chunk, run one after another.
+        Apps that can run them together, sparing per-job overhead,
+        override this.
+        """
+        return [job.run() for job in chunk.shards()]
+
     def load_input_content(self, job):
         for i in self.inputs:
-            val = job.inputs.get(i.id)
             binding = i.input_binding
-            self.load_file_content(binding, val)
+            if binding and binding.get('loadContents') and \
+                    i.id in job.inputs:
+                # input values may be shared with other jobs
+                job.inputs[i.id] = copy_files(job.inputs[i.id])
+                self.load_file_content(binding, job.inputs[i.id])
+        job.invalidate()
 
     def load_output_content(self, result):
         for o in self.outputs:
@@ -197,24 +446,62 @@ class Process(object):
         }
 
 
+def url_part(name):
+    def get(self):
+        return getattr(self.parts, name)
+
+    def set(self, value):
+        self._parts = self.parts._replace(**{name: value})
+
+    return property(get, set)
+
+
 class URL(object):
+    """
+    URL or local path. Plain local paths, by far the most common, are
+    kept as given and never run through urlparse, other URLs are parsed
+    on first use.
+    """
+
+    __slots__ = ('_url', '_parts')
 
     def __init__(self, url):
-        (self.scheme, self.netloc, self.path,
-         self.params, self.query, self.fragment) = urlparse(url, 'file')
-
-        self.content_type = None
-        self.charset = None
-        self.data = None
-        if self.scheme == 'data':
-            meta, data = self.path.split(',')
-            meta_parts = meta.split(';')
-            self.content_type = meta_parts[0]
-            b64 = 'base64' in meta_parts
-            if b64:
-                self.data = b64decode(data)
-            else:
-                self.data = unquote(data)
+        self._url = url
+        self._parts = None
+
+    @property
+    def parts(self):
+        if self._parts is not None:
+            return self._parts
+        if not NOT_PLAIN_PATH.search(self._url):
+            return ParseResult('file', '', self._url, '', '', '')
+        self._parts = urlparse(self._url, 'file')
+        return self._parts
+
+    scheme = url_part('scheme')
+    netloc = url_part('netloc')
+    path = url_part('path')
+    params = url_part('params')
+    query = url_part('query')
+    fragment = url_part('fragment')
+
+    @property
+    def content_type(self):
+        if self.isdata():
+            return self.path.split(',')[0].split(';')[0]
+
+    @property
+    def charset(self):
+        return None
+
+    @property
+    def data(self):
+        if not self.isdata():
+            return None
+        meta, data = self.path.split(',')
+        if 'base64' in meta.split(';'):
+            return b64decode(data)
+        return unquote(data)
 
     def islocal(self):
         return self.scheme == 'file'
@@ -229,6 +516,10 @@ class URL(object):
         return self.scheme == 'data'
 
     def join(self, base):
+        if self._parts is None and self._url.startswith('/') and \
+                '/.' not in self._url and not NOT_PLAIN_PATH.search(self._url):
+            # absolute plain path, urljoin would return it unchanged
+            return URL(self._url)
         base += '' if base.endswith('/') else '/'
         return URL(urljoin(base, str(self)))
 
@@ -256,6 +547,9 @@ class URL(object):
 
 class File(object):
 
+    __slots__ = ('size', 'meta', 'secondary_files', 'url', 'checksum',
+                 'contents')
+
     name = 'File'
 
     def __init__(self, path, size=None, meta=None, secondary_files=None,
@@ -340,6 +634,15 @@ class File(object):
             sf.remap(mappings)
         return self
 
+    def copy(self):
+        """
+        Copy that can be remapped or loaded without changing this file.
+        """
+        copied = File(self)
+        copied.checksum, copied.contents = self.checksum, self.contents
+        copied.secondary_files = [sf.copy() for sf in self.secondary_files]
+        return copied
+
     def __str__(self):
         return self.path
 
@@ -350,6 +653,15 @@ class File(object):
     def path(self, val):
         self.url = URL(val) if isinstance(val, six.string_types) else val
 
+
+def copy_files(value):
+    """
+    value with the Files in it copied, other values are shared.
+    """
+    return map_rec_collection(
+        lambda v: v.copy() if isinstance(v, File) else v, value)
+
+
 FILE_SCHEMA = {
     'type': 'record',
     'name': 'File',
@@ -379,27 +691,60 @@ def fix_file_type(d):
             return [fix_file_type(e) for e in d]
         if not isinstance(d, dict):
             return d
-        if 'type' in d and d['type'] not in VALID_TYPES:
+        if isinstance(d.get('type'), six.string_types) and \
+                d['type'] not in VALID_TYPES:
             return d['type']
         return {k: fix_file_type(v) for k, v in six.iteritems(d)}
 
 
+# compiled schemas by canonical JSON of the type and the named defs
+_avro_cache = {}
+
+
 def make_avro(schema, named_defs):
+    """
+    Compiles schema against File and named_defs. Compiled schemas are
+    shared by every call with the same type and named defs, so they must
+    not be modified.
+    """
+    try:
+        key = json.dumps([schema, named_defs], sort_keys=True)
+    except TypeError:
+        key = None
+    avsc = _avro_cache.get(key) if key else None
+    if avsc is not None:
+        return avsc
+
     names = Names()
     make_avsc_object(FILE_SCHEMA, names)
     for d in named_defs:
         make_avsc_object(d, names)
 
     avsc = make_avsc_object(fix_file_type(wrap_in_list(schema)), names)
+    if key:
+        _avro_cache[key] = avsc
     return avsc
 
 
+def schema_to_json(schema):
+    """
+    JSON of an avro schema that refers to File by name, so it can be
+    passed to make_avro again.
+    """
+    names = Names()
+    make_avsc_object(FILE_SCHEMA, names)
+    return schema.to_json(names)
+
+
 class Expression(object):
     pass
 
 
 class Parameter(object):
 
+    __slots__ = ('id', 'validator', 'required', 'label', 'description',
+                 'depth')
+
     def __init__(
             self, id, validator=None, required=False, label=None,
             description=None, depth=0
@@ -412,12 +757,22 @@ class Parameter(object):
         self.depth = depth
 
     def validate(self, value):
-        return self.validator.validate(value)
+        if value is None:
+            return not self.required
+        return self._validate(value, self.depth,
+                              compile_schema(self.validator).validate)
+
+    @staticmethod
+    def _validate(value, depth, validate_item):
+        if not depth:
+            return validate_item(value)
+        return isinstance(value, list) and all(
+            Parameter._validate(e, depth - 1, validate_item) for e in value)
 
     def to_dict(self, ctx=None):
         avro_schema = None
         if self.validator:
-            avro_schema = self.validator.to_json()
+            avro_schema = schema_to_json(self.validator)
             for d in range(0, self.depth):
                 avro_schema = {'type': 'array', 'items': avro_schema}
             avro_schema = [avro_schema]
@@ -461,11 +816,17 @@ class Parameter(object):
                    depth=depth)
 
     def __repr__(self):
-        return "Parameter(%s)" % vars(self)
+        fields = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                fields[name] = getattr(self, name, None)
+        return "Parameter(%s)" % fields
 
 
 class InputParameter(Parameter):
 
+    __slots__ = ('input_binding',)
+
     def __init__(self, id, validator=None, required=False, label=None,
                  description=None, depth=0, input_binding=None):
         super(InputParameter, self).__init__(
@@ -487,6 +848,9 @@ class InputParameter(Parameter):
 
 
 class OutputParameter(Parameter):
+
+    __slots__ = ('output_binding',)
+
     def __init__(self, id, validator=None, required=False, label=None,
                  description=None, depth=0, output_binding=None):
         super(OutputParameter, self).__init__(
@@ -513,43 +877,76 @@ def parameter_name(parameter_id):
 
 class Job(object):
 
-    def __init__(self, job_id, app, inputs, allocated_resources, context):
+    __slots__ = ('id', 'app', 'inputs', 'allocated_resources', 'context',
+                 'scatter', 'scatter_method', 'scatter_chunk_size',
+                 'priority', 'usage', '_serialized')
+
+    # allocates work dirs of jobs created without an id
+    work_dirs = WorkDirs()
+
+    def __init__(self, job_id, app, inputs, allocated_resources, context,
+                 scatter=None, scatter_method=None, scatter_chunk_size=None):
         self.id = job_id or self.mk_work_dir(app)
         self.app = app
         self.inputs = {parameter_name(k): v for k, v in six.iteritems(inputs)}
         self.allocated_resources = allocated_resources
         self.context = context
-        pass
+        self.scatter = [parameter_name(s) for s in scatter or []]
+        self.scatter_method = scatter_method
+        # number of shards run one after another as a single job
+        self.scatter_chunk_size = scatter_chunk_size
+        # jobs with higher priority are admitted first
+        self.priority = 0
+        # resources used by the job's process, filled in by the app
+        self.usage = {}
+        # (inputs, allocated_resources, to_dict()) cached by serialized()
+        self._serialized = None
 
     def run(self):
         return self.app.run(self)
 
     def to_dict(self, context=None):
         ctx = context or self.context
-        return {
+        d = {
             'id': self.id,
             'class': 'Job',
             'app': ctx.to_primitive(self.app),
             'inputs': ctx.to_primitive(self.inputs),
             'allocatedResources': ctx.to_primitive(self.allocated_resources)
         }
+        if self.scatter:
+            d['scatter'] = self.scatter
+        if self.scatter_method:
+            d['scatterMethod'] = self.scatter_method
+        if self.scatter_chunk_size:
+            d['scatterChunkSize'] = self.scatter_chunk_size
+        return d
+
+    def serialized(self):
+        """
+        to_dict() computed once and shared by every caller, who must not
+        modify it. Recomputed when inputs or allocated resources are
+        replaced, call invalidate() after changing them in place, e.g.
+        remapping their paths.
+        """
+        cached = self._serialized
+        if cached is None or cached[0] is not self.inputs or \
+                cached[1] is not self.allocated_resources:
+            cached = self._serialized = (self.inputs,
+                                         self.allocated_resources,
+                                         self.to_dict())
+        return cached[2]
+
+    def invalidate(self):
+        self._serialized = None
 
     @staticmethod
     def mk_work_dir(app):
-        ts = time.time()
         if app.label:
             name = slugify(app.label)
         else:
             name = slugify(app.id)
-        path = '_'.join([name, datetime.datetime.fromtimestamp(ts).strftime('%H%M%S')])
-        try_path = path
-        if os.path.exists(path):
-            num = 0
-            try_path = path
-            while os.path.exists(try_path):
-                try_path = '_'.join([path, six.text_type(num)])
-                num += 1
-        return try_path
+        return Job.work_dirs.allocate(name)
 
     def __repr__(self):
         return "Job(%s)" % self.to_dict()
@@ -562,7 +959,10 @@ class Job(object):
             app,
             context.from_dict(d['inputs']),
             d.get('allocatedResources'),
-            context
+            context,
+            d.get('scatter'),
+            d.get('scatterMethod'),
+            d.get('scatterChunkSize')
         )
 
 
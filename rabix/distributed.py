@@ -0,0 +1,372 @@
+"""
+Running jobs on worker daemons.
+
+Workers listen on a TCP socket for messages from the coordinator (the
+rabix process running a workflow). Each message is a JSON object
+preceded by its length as a 4 byte big-endian integer:
+
+{"type": "info"} -> {"cpu": <cores>, "mem": <MB>}
+{"type": "run", "job": <Job.to_dict>} -> {"outputs": ...} or {"error": ...}
+
+While it handles a message, the worker sends {"type": "alive"} every
+HEARTBEAT seconds, so the coordinator can tell a long running job from
+a worker that hung or went away.
+
+A worker runs whatever command lines it is sent, so every message must
+carry the token the worker was started with, {"token": ...}, taken from
+the RABIX_WORKER_TOKEN environment variable on both ends. Messages are
+not encrypted: anyone who can read the traffic learns the token, so
+workers should only be reachable on a trusted network, e.g. through an
+SSH tunnel. They listen on 127.0.0.1 unless told otherwise.
+
+The coordinator and workers must see the same file system: jobs are
+sent with absolute work dir paths and outputs refer to files by path.
+"""
+
+import os
+import sys
+import hmac
+import json
+import socket
+import struct
+import logging
+import threading
+
+import six
+import docopt
+
+from six.moves import socketserver
+
+from rabix.common.errors import RabixError
+from rabix.common.models import Job
+from rabix.common.util import log_level
+from rabix.executor import Executor
+from rabix.resources import ResourceManager
+from rabix.scatter import Chunk
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5740
+
+TOKEN_VARIABLE = 'RABIX_WORKER_TOKEN'
+
+# seconds between alive messages of a worker
+HEARTBEAT = 5
+
+# seconds the coordinator waits for any message before it gives up
+DEFAULT_TIMEOUT = 60
+
+HEADER = struct.Struct('!I')
+
+
+class ConnectionClosed(RabixError):
+    pass
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionClosed('Connection closed by peer')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return json.loads(recv_exactly(sock, size).decode('utf-8'))
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    if not host:
+        return address, DEFAULT_PORT
+    return host, int(port)
+
+
+def get_token(token=None):
+    token = token or os.environ.get(TOKEN_VARIABLE)
+    if not token:
+        raise RabixError('Set %s to the token of the workers' %
+                         TOKEN_VARIABLE)
+    return token
+
+
+def call(address, message, token, timeout=None):
+    """
+    Send a message to the worker at (host, port) and wait for the reply.
+    With timeout, fails with socket.timeout if the worker is silent, sends
+    neither the reply nor alive messages, for that many seconds.
+    """
+    sock = socket.create_connection(address, timeout)
+    try:
+        send_message(sock, dict(message, token=token))
+        while True:
+            reply = recv_message(sock)
+            if reply.get('type') != 'alive':
+                return reply
+    finally:
+        sock.close()
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                message = recv_message(self.request)
+            except ConnectionClosed:
+                return
+            if not self.server.worker.authorized(message):
+                log.warning('Rejected message from %s:%s, wrong token',
+                            *self.client_address[:2])
+                send_message(self.request, {'error': 'Wrong token'})
+                return
+
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self.heartbeat,
+                                         args=(done,))
+            heartbeat.daemon = True
+            heartbeat.start()
+            try:
+                reply = self.server.worker.handle(message)
+            finally:
+                done.set()
+                heartbeat.join()
+            send_message(self.request, reply)
+
+    def heartbeat(self, done):
+        while not done.wait(HEARTBEAT):
+            try:
+                send_message(self.request, {'type': 'alive'})
+            except socket.error:
+                return
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Worker(object):
+    """
+    Runs jobs sent by a coordinator, each connection on its own thread.
+    How many jobs run at once is up to the coordinator, which admits
+    them against cpu and mem the worker reports. Messages without the
+    token, by default from RABIX_WORKER_TOKEN, are rejected.
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, cpu=None,
+                 mem=None, token=None):
+        self.token = get_token(token).encode('utf-8')
+        self.resources = ResourceManager(cpu, mem)
+        self.server = WorkerServer((host, port), WorkerHandler)
+        self.server.worker = self
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def authorized(self, message):
+        token = message.get('token')
+        if not isinstance(token, six.string_types):
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.token)
+
+    def handle(self, message):
+        kind = message.get('type')
+        if kind == 'info':
+            return {'cpu': self.resources.cpu, 'mem': self.resources.mem}
+        if kind == 'run':
+            job = None
+            try:
+                job = self.load(message['job'])
+                return {'outputs': self.run(job), 'usage': job.usage}
+            except BaseException as e:
+                log.exception('Job %s failed', message['job'].get('id'))
+                return {'error': getattr(e, 'message', None) or
+                        six.text_type(e) or e.__class__.__name__,
+                        'usage': job.usage if job else {}}
+        return {'error': "Unknown message type '%s'" % kind}
+
+    def load(self, job_dict):
+        # main imports this module
+        from rabix.main import init_context
+        context = init_context(job_dict)
+        return Job.from_dict(context, job_dict)
+
+    def run(self, job):
+        log.info('Running job %s', job.id)
+        return job.context.to_primitive(job.run())
+
+    def serve_forever(self):
+        log.info('Worker listening on %s:%s', *self.address)
+        self.server.serve_forever()
+
+    def start(self):
+        """
+        Serve on a background thread, until stop() is called.
+        """
+        t = threading.Thread(target=self.serve_forever,
+                             name='rabix-worker-%s' % self.address[1])
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Allocation(dict):
+    """
+    Resources granted to a job, on the given worker.
+    """
+
+    def __init__(self, granted, worker):
+        super(Allocation, self).__init__(granted)
+        self.worker = worker
+
+
+class Cluster(object):
+    """
+    Keeps track of cores and memory free on each worker. Has the same
+    interface as ResourceManager, a job is admitted if it fits on any
+    single worker.
+    """
+
+    def __init__(self, workers, token, timeout=None):
+        self.workers = []
+        for address in workers:
+            info = call(address, {'type': 'info'}, token, timeout)
+            if 'error' in info:
+                raise RabixError('Worker %s:%s: %s' %
+                                 (address[0], address[1], info['error']))
+            log.info('Worker %s:%s has %s cores, %s MB', address[0],
+                     address[1], info['cpu'], info['mem'])
+            self.workers.append(
+                (address, ResourceManager(info['cpu'], info['mem'])))
+        if not self.workers:
+            raise RabixError('No workers given')
+
+    @property
+    def cpu(self):
+        return sum(manager.cpu for _, manager in self.workers)
+
+    def request(self, job):
+        return self.workers[0][1].request(job)
+
+    def check(self, job_id, requested):
+        errors = []
+        for _, manager in self.workers:
+            try:
+                manager.check(job_id, requested)
+                return
+            except RabixError as e:
+                errors.append(e.message)
+        raise RabixError('No worker can run job: %s' % '; '.join(errors))
+
+    def try_allocate(self, requested):
+        for address, manager in self.workers:
+            granted = manager.try_allocate(requested)
+            if granted is not None:
+                return Allocation(granted, address)
+        return None
+
+    def release(self, granted):
+        for address, manager in self.workers:
+            if address == granted.worker:
+                manager.release(granted)
+
+    def __repr__(self):
+        return 'Cluster(%s)' % ', '.join(
+            '%s:%s %r' % (a[0], a[1], m) for a, m in self.workers)
+
+
+class RemoteExecutor(Executor):
+    """
+    Executor that runs tools and expressions on workers. Workflows and
+    scatters are still coordinated in this process. A job fails if its
+    worker is silent for timeout seconds.
+    """
+
+    def __init__(self, workers, max_in_flight=None, cache=None,
+                 resume=False, timeout=DEFAULT_TIMEOUT, token=None):
+        self.token = get_token(token)
+        self.timeout = timeout
+        cluster = Cluster(workers, self.token, timeout)
+        super(RemoteExecutor, self).__init__(
+            max_workers=cluster.cpu, max_in_flight=max_in_flight,
+            resources=cluster, cache=cache, resume=resume
+        )
+
+    def run_job(self, job):
+        if isinstance(job, Chunk):
+            # shards of a chunk are sent one by one, to the chunk's worker
+            return [self.run_job(shard) for shard in job.shards()]
+        worker = job.allocated_resources.worker
+        job_dict = job.to_dict()
+        job_dict['id'] = os.path.abspath(job.id)
+        log.debug('Sending job %s to %s:%s', job.id, *worker)
+        try:
+            reply = call(worker, {'type': 'run', 'job': job_dict},
+                         self.token, self.timeout)
+        except (socket.error, ConnectionClosed) as e:
+            raise RabixError('Lost worker %s:%s running job %s: %s' %
+                             (worker[0], worker[1], job.id, e))
+        job.usage.update(reply.get('usage') or {})
+        if 'error' in reply:
+            raise RabixError('Job %s failed on worker %s:%s: %s' %
+                             (job.id, worker[0], worker[1], reply['error']))
+        return job.context.from_dict(reply['outputs'])
+
+
+USAGE = """
+Usage:
+    rabix-worker [-v...] [--host=<host>] [--port=<port>] [--cpu=<cpu>] [--mem=<mem>]
+
+Options:
+  --host=<host>     Address to listen on [default: 127.0.0.1]. Anyone
+                    who can reach it and knows the token can run
+                    commands as this user.
+  --port=<port>     Port to listen on [default: {port}].
+  --cpu=<cpu>       Cores offered to the coordinator (default: all).
+  --mem=<mem>       Memory offered to the coordinator, in MB (default: all).
+  -v --verbose      Verbosity. More Vs more output.
+
+The token coordinators must send is read from the {token} environment
+variable.
+"""
+
+
+def main():
+    logging.basicConfig(level=logging.WARN)
+    args = docopt.docopt(USAGE.format(port=DEFAULT_PORT,
+                                      token=TOKEN_VARIABLE))
+    logging.root.setLevel(log_level(args['--verbose']))
+
+    cpu = args['--cpu']
+    mem = args['--mem']
+    try:
+        worker = Worker(args['--host'], int(args['--port']),
+                        int(cpu) if cpu else None,
+                        int(mem) if mem else None)
+    except RabixError as e:
+        print(e.message)
+        sys.exit(1)
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,49 @@
-import copy
+import os
 import six
+import time
+import bisect
+import shutil
 import logging
+import itertools
+import threading
+
+from functools import partial
+
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from rabix.common.errors import RabixError
-from rabix.common.models import Job
+from rabix.resources import ResourceManager
+from rabix.scatter import Scatter, Chunk, combine
 
 log = logging.getLogger(__name__)
 
 
 class Executor(object):
 
-    def __init__(self):
-        pass
+    def __init__(self, max_workers=1, max_in_flight=None, resources=None,
+                 cache=None, resume=False, history=None, policy=None,
+                 gc=None):
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers
+        self.resources = resources or ResourceManager()
+        self.cache = cache
+        self.resume = resume
+        self.history = history
+        self.policy = policy
+        self.gc = gc
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # (-priority, sequence no., job, requested, future), sorted
+        self._pending = []
+        self._pending_seq = itertools.count()
+        self._pending_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._pool
 
     @staticmethod
     def depth(val):
@@ -27,6 +59,22 @@ class Executor(object):
 
     @staticmethod
     def split_job(job):
+        """
+        Return a Scatter if job has to be split into shards, job itself
+        otherwise. Without an explicit scatter, a job is split over the
+        single input whose value is one level deeper than its type.
+        """
+        if job.scatter:
+            for input_name in job.scatter:
+                io = job.app.get_input(input_name)
+                val_d = Executor.depth(job.inputs.get(input_name))
+                if io is not None and val_d != io.depth + 1:
+                    raise RabixError(
+                        "Can't scatter over input '%s' of depth %s" %
+                        (input_name, val_d))
+            return Scatter(job, job.scatter, job.scatter_method,
+                           job.scatter_chunk_size)
+
         parallel_input = None
         for input_name, input_val in six.iteritems(job.inputs):
             io = job.app.get_input(input_name)
@@ -43,32 +91,254 @@ class Executor(object):
             parallel_input = input_name
 
         if parallel_input:
-            jobs = []
-            for i, val in enumerate(job.inputs[parallel_input]):
-                inputs = copy.deepcopy(job.inputs)
-                inputs[parallel_input] = val
-                jobs.append(Job(job.id+"_"+six.text_type(i), job.app, inputs, {}, job.context))
-            return jobs
+            return Scatter(job, [parallel_input],
+                           chunk_size=job.scatter_chunk_size)
         else:
             return job
 
+    @staticmethod
+    def is_composite(job):
+        """
+        Composite jobs (workflows) only coordinate other jobs and must not
+        hold a pool worker while waiting for them.
+        """
+        from rabix.workflows import Workflow
+        return isinstance(job.app, Workflow)
+
+    @staticmethod
+    def in_thread(name, fn, *args):
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        t = threading.Thread(target=run, name=name)
+        t.daemon = True
+        t.start()
+        return future
+
+    def spawn(self, job):
+        if self.is_composite(job):
+            return self.in_thread('rabix-%s' % job.id, job.run)
+
+        requested = self.resources.request(job)
+        self.resources.check(job.id, requested)
+        future = Future()
+        with self._pending_lock:
+            bisect.insort(self._pending, (-job.priority,
+                                          next(self._pending_seq),
+                                          job, requested, future))
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        """
+        Hand pending jobs whose resource requests fit into what is free on
+        the host over to the pool, highest priority first. Jobs that don't
+        fit yet stay pending and smaller jobs behind them may go first.
+        """
+        admitted = []
+        with self._pending_lock:
+            pending = []
+            for entry in self._pending:
+                job, requested, future = entry[2:]
+                granted = self.resources.try_allocate(requested)
+                if granted is None:
+                    pending.append(entry)
+                else:
+                    admitted.append((job, granted, future))
+            self._pending = pending
+
+        for job, granted, future in admitted:
+            log.debug('job(%s) granted %s', job.id, granted)
+            self.submit(job, granted, future)
+
+    def submit(self, job, granted, future):
+        self.pool.submit(self.run_admitted, job, granted, future)
+
+    def clear_stale(self, job):
+        """
+        When resuming, a leaf job that still has to run may have left a
+        half-finished work dir behind.
+        """
+        job_dir = six.text_type(job.id)
+        if os.path.exists(os.path.join(job_dir, 'job.cwl.json')):
+            log.info('Removing work dir of interrupted job: %s', job_dir)
+            shutil.rmtree(job_dir)
+
+    def run_job(self, job):
+        return job.run()
+
+    def record_run(self, job, started, succeeded):
+        if self.history is None:
+            return
+        usage = dict(job.usage)
+        if succeeded:
+            usage.setdefault('exit_status', 0)
+        self.history.record(job, started, usage)
+
+    def timed_run(self, job):
+        started = time.time()
+        succeeded = False
+        try:
+            outputs = self.run_job(job)
+            succeeded = True
+            return outputs
+        finally:
+            self.record_run(job, started, succeeded)
+
+    def split_chunk(self, chunk):
+        """
+        (results, pending, keys) of a Chunk: results are the cached
+        outputs of its shards, None for the others, pending a Chunk of
+        those that still have to run, None if there are none, and keys
+        their cache keys.
+        """
+        shards = list(chunk.shards())
+        results = [None] * len(shards)
+        jobs, keys = [], []
+        for index, shard in enumerate(shards):
+            key = None
+            if self.cache and self.cache.cacheable(shard):
+                key = self.cache.key(shard)
+                results[index] = self.cache.get(shard, key)
+            if results[index] is None:
+                jobs.append(shard)
+                keys.append((index, key))
+            else:
+                log.info('Job %s: using cached outputs (%s)', shard.id, key)
+        pending = None
+        if jobs:
+            pending = Chunk(chunk.id, jobs)
+            pending.allocated_resources = chunk.allocated_resources
+            if self.resume:
+                self.clear_stale(pending)
+        return results, pending, keys
+
+    def record_chunk(self, chunk, started, succeeded):
+        """
+        Record each shard of chunk with an even share of its wall time.
+        """
+        elapsed = time.time() - started
+        for shard in chunk.jobs:
+            self.record_run(shard, time.time() - elapsed / len(chunk.jobs),
+                            succeeded)
+
+    def merge_chunk(self, results, pending, keys, outputs):
+        for shard, (index, key), result in six.moves.zip(
+                pending.jobs, keys, outputs):
+            if key:
+                self.cache.put(shard, key, result)
+            results[index] = result
+        return results
+
+    def run_chunk(self, chunk):
+        results, pending, keys = self.split_chunk(chunk)
+        if pending is None:
+            return results
+        started = time.time()
+        succeeded = False
+        try:
+            outputs = self.run_job(pending)
+            succeeded = True
+        finally:
+            self.record_chunk(pending, started, succeeded)
+        return self.merge_chunk(results, pending, keys, outputs)
+
+    def run_leaf(self, job):
+        if isinstance(job, Chunk):
+            return self.run_chunk(job)
+        if self.resume:
+            self.clear_stale(job)
+        if self.cache:
+            return self.cache.run(job, self.timed_run)
+        return self.timed_run(job)
+
+    def run_admitted(self, job, granted, future):
+        try:
+            if future.set_running_or_notify_cancel():
+                job.allocated_resources = granted
+                try:
+                    future.set_result(self.run_leaf(job))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self.resources.release(granted)
+            self.dispatch()
+
+    @staticmethod
+    def combine(results):
+        return combine(results)
+
+    def run_scatter(self, scatter, on_shard=None, done_shards=None):
+        """
+        Submit shards keeping at most max_in_flight of them queued or
+        running, and combine their results in the original order.
+
+        on_shard(index, result) is called as each shard finishes, always
+        before the combined result is returned. Shards with results in
+        done_shards are not run again.
+        """
+        done_shards = done_shards or {}
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        notified = threading.Semaphore(0)
+        failed = threading.Event()
+
+        def shard_results(job, future):
+            result = future.result()
+            return result if isinstance(job, Chunk) else [result]
+
+        def unit_done(indexes, job, future):
+            try:
+                if future.exception():
+                    failed.set()
+                elif on_shard:
+                    for index, result in six.moves.zip(
+                            indexes, shard_results(job, future)):
+                        on_shard(index, result)
+            finally:
+                in_flight.release()
+                notified.release()
+
+        futures = []
+        for indexes, job in scatter.units(done_shards):
+            in_flight.acquire()
+            if failed.is_set():
+                break
+            future = self.spawn(job)
+            future.add_done_callback(partial(unit_done, indexes, job))
+            futures.append((indexes, job, future))
+
+        results = dict(done_shards)
+        for indexes, job, future in futures:
+            results.update(six.moves.zip(indexes,
+                                         shard_results(job, future)))
+        for _ in futures:
+            notified.acquire()
+        return scatter.combine([results[i] for i in range(len(results))])
+
+    def scatter_async(self, scatter, on_shard=None, done_shards=None):
+        return self.in_thread('rabix-scatter-%s' % scatter.job.id,
+                              self.run_scatter, scatter, on_shard, done_shards)
+
+    def execute_async(self, job, on_shard=None, done_shards=None):
+        """
+        Schedule job on the worker pool and return a future of its outputs.
+        """
+        log.debug('submitting job(%s)', job.id)
+        split = self.split_job(job)
+        if isinstance(split, Scatter):
+            return self.scatter_async(split, on_shard, done_shards)
+        return self.spawn(job)
+
     def execute(self, job, callback=None, callback_id=None):
-        # TODO: resources, instances, scheduling, yada yada...
         log.debug('executing job(%s), callback(%s)', job.id, callback_id)
-        jobs = self.split_job(job)
-        result = None
-        if isinstance(jobs, list):
-            results = [job.run() for job in jobs]
-
-            combined = {}
-            for result in results:
-                for k, v in six.iteritems(result):
-                    acc = combined.get(k, [])
-                    acc.append(v)
-                    combined[k] = acc
-            result = combined
-        else:
-            result = jobs.run()
+        result = self.execute_async(job).result()
 
         if callback:
             callback(callback_id, result)
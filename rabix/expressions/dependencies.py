@@ -0,0 +1,88 @@
+"""
+Finds what parts of $job and $self a JavaScript expression reads, so
+that only those are sent to the engine.
+
+A reference is the variable followed by property accesses with static
+names, $job.inputs.reads or $job['inputs']['reads']. Its path is the
+names up to the first dynamic access, or up to the object a method is
+called on. The value at the end of a path is sent whole, objects on the
+way only with keys some path goes through. Any other use of the
+variable, on its own or with a dynamic access right after it, needs
+its whole value.
+
+Mentions of the variables in strings and comments count as references
+too, which only sends more than needed.
+"""
+
+import re
+
+import six
+
+ACCESS = re.compile(r'''\s*(?:
+      \.\s*(?P<name>[A-Za-z_$][\w$]*)
+    | \[\s*(?:"(?P<dq>[^"\\]*)"|'(?P<sq>[^'\\]*)')\s*\]
+    )''', re.VERBOSE)
+
+CALL = re.compile(r'\s*\(')
+
+_references = {}
+
+
+def references(script, variable):
+    """
+    Paths, tuples of keys, script reads below variable. An empty path
+    means the whole value. Cached by script and variable.
+    """
+    key = (script, variable)
+    found = _references.get(key)
+    if found is not None:
+        return found
+
+    found = []
+    start = re.compile(r'(?<![\w$.])' + re.escape(variable) + r'(?![\w$])')
+    for m in start.finditer(script):
+        path, pos = [], m.end()
+        while True:
+            access = ACCESS.match(script, pos)
+            if not access or CALL.match(script, access.end()):
+                break
+            path.append(access.group('name') or access.group('dq') or
+                        access.group('sq') or '')
+            pos = access.end()
+        found.append(tuple(path))
+    _references[key] = found
+    return found
+
+
+def prune(value, paths):
+    """
+    Copy of value with only what paths reach, see references.
+    """
+    whole = object()
+    tree = {}
+    for path in paths:
+        if not path:
+            return value
+        node = tree
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+            if node is whole:
+                break
+        else:
+            node[path[-1]] = whole
+    return _prune(value, tree, whole)
+
+
+def _prune(value, tree, whole):
+    if tree is whole or not isinstance(value, dict):
+        return value
+    return {k: _prune(value[k], sub, whole)
+            for k, sub in six.iteritems(tree) if k in value}
+
+
+def narrow(code, job, context):
+    """
+    (job, context) pruned to what code reads of $job and $self.
+    """
+    return (prune(job, references(code, '$job')),
+            prune(context, references(code, '$self')))
@@ -1,33 +1,160 @@
+import re
+import copy
 import json
 import execjs
+import hashlib
 import logging
+import threading
+from functools import partial
+from collections import defaultdict, OrderedDict
+
+import six
+
 from rabix.common.errors import RabixError
 from rabix.common.util import wrap_in_list
 
 from rabix.common.ref_resolver import resolve_pointer
+from rabix.expressions.node_pool import pool, ExpressionError
+from rabix.expressions.native import evaluate_native
+from rabix.expressions.dependencies import references, prune, narrow
 
 log = logging.getLogger(__name__)
 
+# results of expressions an Evaluator remembers
+DEFAULT_MEMO_SIZE = 4096
+
+# digests of jobs a Memo remembers, one per job evaluated concurrently
+JOB_DIGESTS = 256
+
+# scripts using these may return another result each time
+NONDETERMINISTIC = re.compile(r'(?<![\w$.])(?:Date|Math\s*\.\s*random)'
+                              r'(?![\w$])')
+
 
 class ExpressionEngine(object):
 
-    def __init__(self, image, ids, f, engine_config=None):
+    def __init__(self, image, ids, f, engine_config=None, batch=None,
+                 narrow=None):
         super(ExpressionEngine, self).__init__()
         self.image = image
         self.ids = ids
         self.f = f
         self.engine_config = engine_config
+        self.batch = batch
+        # (job, context) as much as the expression reads of them
+        self.narrow = narrow
 
     def evaluate(self, expression, job, context=None, outdir=None, tmpdir=None):
         return self.f(expression, job, context, self.engine_config, outdir, tmpdir)
 
+    def evaluate_batch(self, requests, job):
+        """
+        Results of (expression, context) pairs, evaluated together, or
+        None if the engine can't batch them.
+        """
+        if not self.batch:
+            return None
+        return self.batch(requests, job, self.engine_config)
+
+
+def payload_digest(payload):
+    return hashlib.sha1(
+        json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Memo(object):
+    """
+    Results of the most recently used expressions, by engine, script and
+    digest of the job and context they were evaluated with. Counts hits
+    and misses.
+
+    Expressions are assumed to return the same result for the same job
+    and context. Scripts that mention Date or Math.random are never
+    remembered, use size 0 to evaluate every other expression each time.
+    """
+
+    def __init__(self, size=DEFAULT_MEMO_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # jobs are shared dicts, Job.serialized(), digested once: by id,
+        # (job, digest), holding the job so that its id isn't reused
+        self.job_digests = OrderedDict()
+
+    def key(self, engine, script, job, context):
+        """
+        Key of an evaluation, None if it isn't remembered or job or
+        context isn't JSON.
+        """
+        if not self.size or NONDETERMINISTIC.search(script):
+            return None
+        whole_job = job
+        if engine.narrow:
+            job, context = engine.narrow(script, job, context,
+                                         engine.engine_config)
+        try:
+            if job is whole_job:
+                job_digest = self.job_digest(job)
+            else:
+                job_digest = payload_digest(job)
+            return (engine.f, tuple(engine.engine_config or ()), script,
+                    job_digest, payload_digest(context))
+        except TypeError:
+            return None
+
+    def job_digest(self, job):
+        with self.lock:
+            cached = self.job_digests.get(id(job))
+        if cached is not None and cached[0] is job:
+            return cached[1]
+        digest = payload_digest(job)
+        with self.lock:
+            self.job_digests[id(job)] = (job, digest)
+            while len(self.job_digests) > JOB_DIGESTS:
+                self.job_digests.popitem(last=False)
+        return digest
+
+    def get(self, key):
+        """
+        (True, copy of the result) if there is one for key, else
+        (False, None).
+        """
+        if key is None or not self.size:
+            return False, None
+        with self.lock:
+            if key not in self.results:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            result = self.results.pop(key)
+            self.results[key] = result
+        return True, copy.deepcopy(result)
+
+    def put(self, key, result):
+        if key is None or not self.size:
+            return
+        result = copy.deepcopy(result)
+        with self.lock:
+            self.results.pop(key, None)
+            self.results[key] = result
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.results)}
+
 
 class Evaluator(object):
 
-    def __init__(self, ctx=None, engines=None, default=None):
+    def __init__(self, ctx=None, engines=None, default=None,
+                 memo_size=DEFAULT_MEMO_SIZE):
         self.ctx = ctx
         self.engines = engines or []
         self.default = default
+        self.memo = Memo(memo_size)
 
     def get_engine_by_id(self, id):
         return next((e for e in self.engines if id in e.ids), self.default)
@@ -39,16 +166,65 @@ class Evaluator(object):
         pl = self.get_engine_by_id(engine)
         if not pl:
             raise Exception('No expression evaluator %s' % id)
-        res = pl.evaluate(expression, job, context)
+        key = self.memo.key(pl, expression, job, context)
+        found, res = self.memo.get(key)
+        if not found:
+            res = pl.evaluate(expression, job, context)
+            self.memo.put(key, res)
         if self.ctx:
             return self.ctx.from_dict(res)
         else:
             return res
 
+    def evaluate_batch(self, engine, requests, job):
+        """
+        Like evaluate for each of (expression, context) requests, in one
+        round trip to the engine. Expressions that failed get an
+        ExpressionError. None if the engine can't batch.
+        """
+        pl = self.get_engine_by_id(engine)
+        if not pl:
+            raise Exception('No expression evaluator %s' % engine)
+        if not pl.batch:
+            return None
+
+        keys = [self.memo.key(pl, script, job, context)
+                for script, context in requests]
+        results, missing = [], []
+        for i, key in enumerate(keys):
+            found, res = self.memo.get(key)
+            results.append(res)
+            if not found:
+                missing.append(i)
+        if missing:
+            evaluated = pl.evaluate_batch([requests[i] for i in missing], job)
+            if evaluated is None:
+                return None
+            for i, res in zip(missing, evaluated):
+                results[i] = res
+                if not isinstance(res, ExpressionError):
+                    self.memo.put(keys[i], res)
+
+        if not self.ctx:
+            return results
+        return [r if isinstance(r, ExpressionError) else self.ctx.from_dict(r)
+                for r in results]
+
 
 def evaluate_rabix_js(expression, job, context=None,
                       engine_config=None, outdir=None, tmpdir=None):
     # log.debug("expression: %s" % expression)
+    native, result = evaluate_native(expression, job, context)
+    if native:
+        return result
+
+    job, context = narrow(expression, job, context)
+    if pool.node:
+        # node globals, as execjs below has
+        result = pool.evaluate(expression, job, context, node_globals=True)
+        log.debug("Expression result: %s" % result)
+        return result
+
     if expression.startswith('{'):
         exp_tpl = '''function () {
         $job = %s;
@@ -68,6 +244,63 @@ def evaluate_rabix_js(expression, job, context=None,
     return result
 
 
+def narrow_rabix_js(expression, job, context, engine_config=None):
+    return narrow(expression, job, context)
+
+
+def evaluate_batch_native(requests, job, evaluate_rest, config=None):
+    """
+    Results of (expression, context) requests. Those evaluate_native
+    can't evaluate go to evaluate_rest(rest, job), with the job and
+    contexts narrowed to what the expressions, and config, read.
+    """
+    results, rest = [], []
+    for i, (expression, context) in enumerate(requests):
+        native, result = evaluate_native(expression, job, context)
+        results.append(result)
+        if not native:
+            rest.append(i)
+    if not rest:
+        return results
+
+    codes = [with_config(requests[i][0], config) for i in rest]
+    job = prune(job, [path for code in codes
+                      for path in references(code, '$job')])
+    evaluated = evaluate_rest(
+        [(requests[i][0], prune(requests[i][1], references(code, '$self')))
+         for i, code in zip(rest, codes)], job)
+    for i, result in zip(rest, evaluated):
+        results[i] = result
+    return results
+
+
+def evaluate_rabix_js_batch(requests, job, engine_config=None):
+    if not pool.node:
+        return None
+    return evaluate_batch_native(
+        requests, job, partial(pool.evaluate_batch, node_globals=True))
+
+
+def with_config(expression, engine_config):
+    """
+    Code an expression runs: engine config can define functions the
+    expression calls.
+    """
+    return '\n'.join(list(engine_config or []) + [expression])
+
+
+def narrow_cwl_js(expression, job, context, engine_config=None):
+    return narrow(with_config(expression, engine_config), cwl_job(job),
+                  context)
+
+
+def cwl_job(job):
+    j = {}
+    j.update(job['inputs'])
+    j['allocatedResources'] = job['allocatedResources']
+    return j
+
+
 def evaluate_cwl_js(expression, job, context=None,
                     engine_config=None, outdir=None, tmpdir=None):
     # log.debug("expression: %s" % expression)
@@ -91,9 +324,18 @@ def evaluate_cwl_js(expression, job, context=None,
     if engine_config:
         config = '\n'.join(engine_config)
 
-    j = {}
-    j.update(job['inputs'])
-    j['allocatedResources'] = job['allocatedResources']
+    j = cwl_job(job)
+    native, result = evaluate_native(expression, j, context)
+    if native:
+        return result
+
+    j, context = narrow(with_config(expression, engine_config), j, context)
+
+    if pool.node:
+        result = pool.evaluate(expression, j, context, engine_config)
+        log.debug("Expression result: %s" % result)
+        return result
+
     exp = exp_tpl.format(
         config=config,
         job=json.dumps(j),
@@ -106,6 +348,15 @@ def evaluate_cwl_js(expression, job, context=None,
     return result
 
 
+def evaluate_cwl_js_batch(requests, job, engine_config=None):
+    if not pool.node:
+        return None
+    return evaluate_batch_native(
+        requests, cwl_job(job),
+        lambda rest, j: pool.evaluate_batch(rest, j, engine_config),
+        engine_config)
+
+
 def evaluate_json_ptr(expression, job, context=None,
                       engine_config=None, outdir=None, tmpdir=None):
     doc = {
@@ -118,10 +369,12 @@ ExpressionEvaluator = Evaluator()
 ExpressionEvaluator.engines.extend([
     ExpressionEngine(
         'rabix/js-engine',
-        {'#cwl-js-engine', 'javascript', 'cwl-js-engine'}, evaluate_rabix_js, []),
+        {'#cwl-js-engine', 'javascript', 'cwl-js-engine'}, evaluate_rabix_js, [],
+        evaluate_rabix_js_batch, narrow_rabix_js),
     ExpressionEngine(
         'commonworkflowlanguage/nodejs-engine',
-        {'node-engine.cwl'}, evaluate_cwl_js, []),
+        {'node-engine.cwl'}, evaluate_cwl_js, [], evaluate_cwl_js_batch,
+        narrow_cwl_js),
     ExpressionEngine(
         None,
         {'cwl:JsonPointer'}, evaluate_json_ptr, [])
@@ -163,16 +416,64 @@ class ExpressionEngineRequirement(object):
         return cls(id, docker_image, engine_config)
 
 
+def is_expression(val):
+    return isinstance(val, dict) and ('engine' in val or 'script' in val)
+
+
+def expression_key(val, context):
+    try:
+        return val['engine'], val['script'], json.dumps(context,
+                                                        sort_keys=True)
+    except (KeyError, TypeError):
+        return None
+
+
 class ValueResolver(object):
     def __init__(self, job):
         self.job = job
+        # prefetched results, for the job as serialized into results_job
+        self.results = {}
+        self.results_job = None
 
     def resolve(self, expr_or_value, context=None):
         val = expr_or_value
-        if not isinstance(val, dict) or ('engine' not in val and 'script' not in val):
+        if not is_expression(val):
             return val
         engine, script = val['engine'], val['script']
-        return ExpressionEvaluator.evaluate(engine, script, self.job.to_dict(), context)
+        job = self.job.serialized()
+        if self.results and self.results_job is job:
+            key = expression_key(val, context)
+            if key in self.results:
+                result = self.results[key]
+                if isinstance(result, ExpressionError):
+                    raise result
+                return result
+        return ExpressionEvaluator.evaluate(engine, script, job, context)
+
+    def prefetch(self, requests):
+        """
+        Evaluates expressions of (expression or value, context) requests
+        in one round trip per engine, so that resolving them later
+        doesn't need one. Expressions that failed raise when resolved,
+        those of engines that can't batch are evaluated then.
+        """
+        job = self.job.serialized()
+        if self.results_job is not job:
+            self.results, self.results_job = {}, job
+
+        by_engine = defaultdict(dict)
+        for val, context in requests:
+            if not is_expression(val):
+                continue
+            key = expression_key(val, context)
+            if key is not None and key not in self.results:
+                by_engine[val['engine']][key] = (val['script'], context)
+
+        for engine, batch in six.iteritems(by_engine):
+            keys = list(batch)
+            results = ExpressionEvaluator.evaluate_batch(
+                engine, [batch[k] for k in keys], job)
+            self.results.update(zip(keys, results or []))
 
 
 def update_engines(process):
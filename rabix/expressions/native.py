@@ -0,0 +1,294 @@
+"""
+Evaluates simple JavaScript expressions in Python: property access on
+$job and $self, string, number and boolean literals, and + - * / % on
+them, optionally as a block that only returns one, {return ...;}.
+
+compile_expression returns a function of (job, context) for scripts of
+that subset, or None for others. The function raises NotNative when
+JavaScript would behave in a way it doesn't follow, e.g. arithmetic on
+undefined, so the script should be evaluated by the engine instead.
+Results are what the engine would return, as read from JSON.
+"""
+
+import re
+import math
+
+import six
+
+# JavaScript numbers are doubles, integers beyond this lose precision
+MAX_SAFE_INTEGER = 2 ** 53
+
+TOKEN = re.compile(r'''
+    \s*(?:
+      (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<string>"(?:[^"\\\n]|\\["'\\nt])*"|'(?:[^'\\\n]|\\["'\\nt])*')
+    | (?P<name>[A-Za-z_$][\w$]*)
+    | (?P<op>[-+*/%.()\[\]{};])
+    )''', re.VERBOSE)
+
+ESCAPES = {'n': '\n', 't': '\t', '"': '"', "'": "'", '\\': '\\'}
+
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+_compiled = {}
+
+
+class NotNative(Exception):
+    pass
+
+
+class Undefined(object):
+    def __repr__(self):
+        return 'undefined'
+
+
+UNDEFINED = Undefined()
+
+
+def compile_expression(script):
+    """
+    Function of (job, context) evaluating script, None if script isn't
+    in the supported subset. Cached by script.
+    """
+    try:
+        return _compiled[script]
+    except KeyError:
+        pass
+    try:
+        fn = Parser(tokenize(script)).script(script.startswith('{'))
+    except (SyntaxError, NotNative):
+        fn = None
+    _compiled[script] = fn
+    return fn
+
+
+def evaluate_native(script, job, context):
+    """
+    (True, result) of script if it could be evaluated in Python, else
+    (False, None).
+    """
+    fn = compile_expression(script)
+    if not fn:
+        return False, None
+    try:
+        result = fn(job, context)
+    except NotNative:
+        return False, None
+    if result is UNDEFINED:
+        return True, None
+    return True, json_value(result)
+
+
+def tokenize(script):
+    tokens = []
+    pos = 0
+    script = script.rstrip()
+    while pos < len(script):
+        m = TOKEN.match(script, pos)
+        if not m:
+            raise SyntaxError(script)
+        pos = m.end()
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+    return tokens
+
+
+def unquote(literal):
+    return re.sub(r'\\(.)', lambda m: ESCAPES[m.group(1)], literal[1:-1])
+
+
+def number(value):
+    """
+    value as read back from JSON: integral numbers as int.
+    """
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            raise NotNative()
+        if value.is_integer():
+            value = int(value)
+    if isinstance(value, six.integer_types) and \
+            abs(value) > MAX_SAFE_INTEGER:
+        raise NotNative()
+    return value
+
+
+def json_value(value):
+    """
+    Copy of value as it would be read back from JSON.
+    """
+    if isinstance(value, dict):
+        return {k: json_value(v) for k, v in six.iteritems(value)
+                if v is not UNDEFINED}
+    if isinstance(value, list):
+        return [None if v is UNDEFINED else json_value(v) for v in value]
+    if is_number(value):
+        return number(value)
+    return value
+
+
+def is_number(value):
+    return isinstance(value, (float,) + six.integer_types) and \
+        not isinstance(value, bool)
+
+
+def to_string(value):
+    if isinstance(value, six.string_types):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if value is None:
+        return 'null'
+    if is_number(value):
+        value = number(value)
+        if isinstance(value, float) and not 1e-4 <= abs(value) < 1e16:
+            # exponent notation differs
+            raise NotNative()
+        return repr(value)
+    raise NotNative()
+
+
+def add(a, b):
+    if isinstance(a, six.string_types) or isinstance(b, six.string_types):
+        return to_string(a) + to_string(b)
+    return arithmetic(lambda x, y: x + y)(a, b)
+
+
+def arithmetic(op):
+    def apply(a, b):
+        if not is_number(a) or not is_number(b):
+            raise NotNative()
+        try:
+            return number(op(a, b))
+        except (ZeroDivisionError, OverflowError, ValueError):
+            raise NotNative()
+    return apply
+
+
+BINARY = {
+    '+': add,
+    '-': arithmetic(lambda x, y: x - y),
+    '*': arithmetic(lambda x, y: x * y),
+    '/': arithmetic(lambda x, y: float(x) / y),
+    '%': arithmetic(math.fmod),
+}
+
+
+def member(obj, key):
+    if isinstance(obj, dict) and isinstance(key, six.string_types):
+        return obj.get(key, UNDEFINED)
+    if isinstance(obj, (list, six.string_types)):
+        if key == 'length':
+            return len(obj)
+        if is_number(key) and number(key) == int(key) and \
+                0 <= key < len(obj):
+            return obj[int(key)]
+    raise NotNative()
+
+
+class Parser(object):
+    """
+    Recursive descent parser of the supported subset, building closures
+    of (job, context) as it goes.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise SyntaxError(value)
+        self.pos += 1
+        return kind, text
+
+    def accept(self, value):
+        if self.peek() == ('op', value) or self.peek() == ('name', value):
+            self.pos += 1
+            return True
+        return False
+
+    def script(self, block):
+        if block:
+            self.take('{')
+            self.take('return')
+            fn = self.expression()
+            self.accept(';')
+            self.take('}')
+        else:
+            fn = self.expression()
+        if self.pos != len(self.tokens):
+            raise SyntaxError(self.peek())
+        return fn
+
+    def binary(self, operators, operand):
+        fn = operand()
+        while self.peek()[0] == 'op' and self.peek()[1] in operators:
+            op = BINARY[self.take()[1]]
+            fn = self.combine(op, fn, operand())
+        return fn
+
+    @staticmethod
+    def combine(op, left, right):
+        return lambda job, ctx: op(left(job, ctx), right(job, ctx))
+
+    def expression(self):
+        return self.binary('+-', self.term)
+
+    def term(self):
+        return self.binary('*/%', self.unary)
+
+    def unary(self):
+        if self.accept('-'):
+            operand = self.unary()
+            return lambda job, ctx: BINARY['-'](0, operand(job, ctx))
+        return self.postfix()
+
+    def postfix(self):
+        fn = self.primary()
+        while True:
+            if self.accept('.'):
+                kind, name = self.take()
+                if kind != 'name':
+                    raise SyntaxError(name)
+                fn = self.member(fn, lambda job, ctx, name=name: name)
+            elif self.accept('['):
+                key = self.expression()
+                self.take(']')
+                fn = self.member(fn, key)
+            else:
+                return fn
+
+    @staticmethod
+    def member(obj, key):
+        return lambda job, ctx: member(obj(job, ctx), key(job, ctx))
+
+    def primary(self):
+        kind, text = self.take()
+        if kind == 'number':
+            if re.match(r'0\d', text):
+                # legacy octal
+                raise SyntaxError(text)
+            value = number(float(text) if re.search('[.eE]', text)
+                           else int(text))
+            return lambda job, ctx: value
+        if kind == 'string':
+            value = unquote(text)
+            return lambda job, ctx: value
+        if kind == 'name' and text in LITERALS:
+            value = LITERALS[text]
+            return lambda job, ctx: value
+        if text == '$job':
+            return lambda job, ctx: job
+        if text == '$self':
+            return lambda job, ctx: ctx
+        if text == '(':
+            fn = self.expression()
+            self.take(')')
+            return fn
+        raise SyntaxError(text)
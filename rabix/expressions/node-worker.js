@@ -0,0 +1,152 @@
+#!/usr/bin/env nodejs
+
+// Long-lived version of cwl-engine.js: reads one JSON request per line,
+// {"script", "job", "context", "engineConfig"}, and writes one JSON
+// response per line, {"result"} or {"error"}. $job is the request's job
+// as is.
+//
+// With "nodeGlobals" true, expressions can also use require, process,
+// Buffer and console, as they could when the rabix engine ran them
+// through execjs. console writes to stderr, stdout carries responses.
+//
+// A request with "batch", a list of {"script", "context"}, instead of
+// "script" and "context" evaluates each of them with the same $job, and
+// is answered with {"results"}, a response for each.
+//
+// Requests with the same engineConfig and nodeGlobals share a global
+// scope, where engineConfig runs once, but each expression gets its own
+// copy of $job. Globals are put back as engineConfig left them after
+// each expression, those it added are removed. Changes to the contents
+// of global objects are not undone.
+
+var readline = require('readline');
+var vm = require('vm');
+
+// scopes kept, by engineConfig and nodeGlobals, before starting over
+var MAX_SCOPES = 64;
+
+// Run in a sandbox, returns a function restoring the sandbox's globals,
+// except __job, to what they are now. A fresh context per expression
+// would be simpler, but takes longer to create than most expressions
+// take to run.
+var SNAPSHOT = new vm.Script(
+    "(function(global) {\n" +
+    "    var saved = Object.create(null);\n" +
+    "    Object.getOwnPropertyNames(global).forEach(function(name) {\n" +
+    "        if (name != '__job') {\n" +
+    "            saved[name] = global[name];\n" +
+    "        }\n" +
+    "    });\n" +
+    "    return function() {\n" +
+    "        Object.getOwnPropertyNames(global).forEach(function(name) {\n" +
+    "            if (!(name in saved) && name != '__job') {\n" +
+    "                delete global[name];\n" +
+    "            }\n" +
+    "        });\n" +
+    "        Object.keys(saved).forEach(function(name) {\n" +
+    "            if (global[name] !== saved[name]) {\n" +
+    "                global[name] = saved[name];\n" +
+    "            }\n" +
+    "        });\n" +
+    "    };\n" +
+    "})(this)");
+
+var NODE_GLOBALS = {
+    "require": require,
+    "process": process,
+    "Buffer": Buffer,
+    "console": new console.Console(process.stderr)
+};
+
+var scopes = {};
+var scopeCount = 0;
+
+function Scope(engineConfig, nodeGlobals) {
+    var globals = {"__job": "null"};
+    if (nodeGlobals) {
+        Object.keys(NODE_GLOBALS).forEach(function(name) {
+            globals[name] = NODE_GLOBALS[name];
+        });
+    }
+    this.sandbox = vm.createContext(globals);
+    this.error = null;
+    if (engineConfig) {
+        try {
+            vm.runInContext(engineConfig.join("\n"), this.sandbox);
+        }
+        catch (e) {
+            this.error = e;
+        }
+    }
+    this.restore = SNAPSHOT.runInContext(this.sandbox);
+}
+
+Scope.get = function(job, engineConfig, nodeGlobals) {
+    var key = JSON.stringify([engineConfig || null, !!nodeGlobals]);
+    var scope = scopes[key];
+    if (!scope) {
+        if (scopeCount >= MAX_SCOPES) {
+            scopes = {};
+            scopeCount = 0;
+        }
+        scope = scopes[key] = new Scope(engineConfig, nodeGlobals);
+        scopeCount++;
+    }
+    scope.sandbox.__job = JSON.stringify(job);
+    return scope;
+};
+
+Scope.prototype.evaluate = function(script, context) {
+    var exp = "";
+
+    if (script[0] == "{") {
+        exp = "{return function()" + script + "();}";
+    }
+    else {
+        exp = "{return " + script + ";}";
+    }
+
+    var fn = "var $job = JSON.parse(__job);\n";
+    fn += "var $self = " + JSON.stringify(context) + ";\n"
+
+    fn += "(function()" + exp + ")()";
+    try {
+        return vm.runInContext(fn, this.sandbox);
+    }
+    finally {
+        this.restore();
+    }
+};
+
+Scope.prototype.respond = function(script, context) {
+    try {
+        if (this.error) {
+            throw this.error;
+        }
+        return {"result": this.evaluate(script, context)};
+    }
+    catch (e) {
+        return {"error": String(e)};
+    }
+};
+
+readline.createInterface({input: process.stdin, terminal: false})
+    .on('line', function(line) {
+        var response;
+        try {
+            var j = JSON.parse(line);
+            var scope = Scope.get(j.job, j.engineConfig, j.nodeGlobals);
+            if (j.batch) {
+                response = {"results": j.batch.map(function(e) {
+                    return scope.respond(e.script, e.context);
+                })};
+            }
+            else {
+                response = scope.respond(j.script, j.context);
+            }
+        }
+        catch (e) {
+            response = {"error": String(e)};
+        }
+        process.stdout.write(JSON.stringify(response) + "\n");
+    });
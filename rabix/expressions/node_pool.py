@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import select
+import atexit
+import logging
+import threading
+import subprocess
+import multiprocessing
+
+from rabix.common.errors import RabixError
+
+log = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), 'node-worker.js')
+
+# seconds an expression may run before its worker is restarted
+DEFAULT_TIMEOUT = 30
+
+
+def find_node():
+    for name in ('nodejs', 'node'):
+        for path in os.environ.get('PATH', '').split(os.pathsep):
+            executable = os.path.join(path, name)
+            if os.path.isfile(executable) and os.access(executable, os.X_OK):
+                return executable
+    return None
+
+
+class ExpressionError(RabixError):
+    pass
+
+
+class ExpressionTimeout(RabixError):
+    pass
+
+
+class WorkerDied(RabixError):
+    pass
+
+
+def describe(request):
+    if 'batch' in request:
+        return '; '.join(e['script'] for e in request['batch'])
+    return request['script']
+
+
+def result_of(response, script):
+    if 'error' in response:
+        return ExpressionError('Expression failed: %s: %s' %
+                               (response['error'], script))
+    return response.get('result')
+
+
+class NodeWorker(object):
+    """
+    Node process evaluating a stream of expressions, see node-worker.js.
+    """
+
+    def __init__(self, node):
+        self.process = subprocess.Popen(
+            [node, WORKER_SCRIPT], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+        # output read past the last response
+        self.buffer = b''
+
+    def request(self, request, timeout):
+        try:
+            self.process.stdin.write(
+                (json.dumps(request) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (IOError, OSError) as e:
+            raise WorkerDied('Expression worker died: %s' % e)
+
+        deadline = time.time() + timeout
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [],
+                                                   remaining)[0]:
+                raise ExpressionTimeout(
+                    'Expression timed out after %ss: %s' %
+                    (timeout, describe(request)))
+            data = os.read(fd, 65536)
+            if not data:
+                raise WorkerDied('Expression worker died')
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return json.loads(line.decode('utf-8'))
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class NodePool(object):
+    """
+    Up to size long-lived node workers, started as needed and shared by
+    all threads. A worker that times out or dies is replaced.
+    """
+
+    def __init__(self, size=None, timeout=DEFAULT_TIMEOUT, node=None):
+        self.size = size or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.node = node or find_node()
+        self.idle = []
+        self.started = 0
+        self.lock = threading.Condition()
+
+    def acquire(self):
+        with self.lock:
+            while not self.idle and self.started >= self.size:
+                self.lock.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            return NodeWorker(self.node)
+        except Exception:
+            self.discard(None)
+            raise
+
+    def release(self, worker):
+        with self.lock:
+            self.idle.append(worker)
+            self.lock.notify()
+
+    def discard(self, worker):
+        if worker:
+            worker.close()
+        with self.lock:
+            self.started -= 1
+            self.lock.notify()
+
+    def evaluate(self, script, job, context=None, engine_config=None,
+                 node_globals=False):
+        response = self.request({'script': script, 'job': job,
+                                 'context': context,
+                                 'engineConfig': engine_config,
+                                 'nodeGlobals': node_globals})
+        result = result_of(response, script)
+        if isinstance(result, ExpressionError):
+            raise result
+        return result
+
+    def evaluate_batch(self, requests, job, engine_config=None,
+                       node_globals=False):
+        """
+        Evaluates (script, context) pairs with the same job in one round
+        trip. Returns their results, an ExpressionError for each that
+        failed. With node_globals, scripts can use require, process,
+        Buffer and console.
+        """
+        response = self.request({
+            'batch': [{'script': script, 'context': context}
+                      for script, context in requests],
+            'job': job, 'engineConfig': engine_config,
+            'nodeGlobals': node_globals})
+        if 'error' in response:
+            raise ExpressionError('Expression batch failed: %s' %
+                                  response['error'])
+        return [result_of(r, script)
+                for r, (script, _) in zip(response['results'], requests)]
+
+    def request(self, request):
+        if not self.node:
+            raise RabixError('Node.js not found')
+        # a worker that died between requests is retried once
+        for attempt in range(2):
+            worker = self.acquire()
+            try:
+                response = worker.request(request, self.timeout)
+            except WorkerDied:
+                self.discard(worker)
+                if attempt:
+                    raise
+                continue
+            except BaseException:
+                # timed out, interrupted or garbled, don't reuse
+                log.warning('Restarting expression worker')
+                self.discard(worker)
+                raise
+            self.release(worker)
+            return response
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.started -= len(idle)
+        for worker in idle:
+            worker.close()
+
+
+pool = NodePool()
+atexit.register(pool.close)
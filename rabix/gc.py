@@ -0,0 +1,122 @@
+import os
+import errno
+import shutil
+import logging
+
+from collections import defaultdict
+
+import six
+
+from rabix.cache import collect_files
+from rabix.common.models import parameter_name
+
+log = logging.getLogger(__name__)
+
+
+def local_paths(value):
+    return [os.path.abspath(f.path) for f in collect_files(value)
+            if f.url.islocal()]
+
+
+class Collector(object):
+    """
+    Disposes of intermediate files of workflow steps: deletes them, or
+    moves them under cold_storage, at their absolute path.
+    """
+
+    def __init__(self, cold_storage=None):
+        self.cold_storage = cold_storage
+
+    def dispose(self, path):
+        try:
+            if self.cold_storage:
+                dest = os.path.join(self.cold_storage, path.lstrip(os.sep))
+                dest_dir = os.path.dirname(dest)
+                if not os.path.isdir(dest_dir):
+                    os.makedirs(dest_dir)
+                shutil.move(path, dest)
+                log.debug('Moved %s to %s', path, dest)
+            else:
+                os.remove(path)
+                log.debug('Removed %s', path)
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                log.warning('Unable to dispose of %s: %s', path, e)
+
+
+class OutputRefs(object):
+    """
+    Reference counts for files in results of steps of a workflow run.
+
+    A step's result is held until every step consuming it has finished,
+    and a file is disposed of once no held result refers to it. Files
+    outside the workflow's work dir, files given as workflow inputs and
+    files that reached workflow outputs are kept.
+    """
+
+    def __init__(self, workflow, job, collector):
+        topology = workflow.step_graph
+        self.collector = collector
+        self.root = os.path.abspath(six.text_type(job.id)) + os.sep
+        self.consumers = {}
+        self.upstream = defaultdict(set)
+        self.exported = {}
+        for i, node_id in enumerate(topology.ids):
+            consumers = set(topology.ids[dst]
+                            for dst, _, _ in topology.links[i])
+            self.consumers[node_id] = consumers
+            for consumer in consumers:
+                self.upstream[consumer].add(node_id)
+            self.exported[node_id] = set(
+                parameter_name(port) for port, _ in topology.outputs[i])
+        self.protected = set(local_paths(list(job.inputs.values())))
+        # node id -> [consumers still running, paths]
+        self.held = {}
+        self.refs = defaultdict(int)
+
+    def restore(self, graph):
+        """
+        Hold results of steps replayed from the journal of a previous run.
+        """
+        done = set(node_id for node_id, ex in six.iteritems(graph.executables)
+                   if ex.status == 'DONE')
+        for node_id in done:
+            pending = len(self.consumers[node_id] - done)
+            self.hold(node_id, graph.executables[node_id].result, pending)
+
+    def step_done(self, node_id, result):
+        self.hold(node_id, result, len(self.consumers[node_id]))
+        for upstream in self.upstream[node_id]:
+            self.release(upstream)
+
+    def hold(self, node_id, result, pending):
+        paths = []
+        for port, value in six.iteritems(result or {}):
+            found = local_paths(value)
+            if parameter_name(port) in self.exported[node_id]:
+                self.protected.update(found)
+            paths.extend(found)
+        for path in paths:
+            self.refs[path] += 1
+        self.held[node_id] = [pending, paths]
+        if not pending:
+            self.free(node_id)
+
+    def release(self, node_id):
+        held = self.held.get(node_id)
+        if held is None:
+            return
+        held[0] -= 1
+        if not held[0]:
+            self.free(node_id)
+
+    def free(self, node_id):
+        _, paths = self.held.pop(node_id)
+        for path in paths:
+            self.refs[path] -= 1
+            if self.refs[path]:
+                continue
+            del self.refs[path]
+            if path in self.protected or not path.startswith(self.root):
+                continue
+            self.collector.dispose(path)
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import errno
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from rabix.cache import collect_files
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HISTORY = os.path.join('~', '.rabix', 'history.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    app_id TEXT NOT NULL,
+    inputs_hash TEXT,
+    started REAL,
+    wall_time REAL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    exit_status INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_app_id ON runs (app_id, inputs_hash);
+"""
+
+COLUMNS = ('app_id', 'inputs_hash', 'started', 'wall_time', 'cpu_time',
+           'max_rss', 'exit_status')
+
+
+def file_size(f):
+    if f.url.islocal() and os.path.exists(f.path):
+        return os.path.getsize(f.path)
+    return f.size
+
+
+def inputs_hash(job):
+    """
+    Hash of the sizes of input files of job, per input. Runs of the same
+    app on inputs of the same size are expected to perform alike.
+    """
+    sizes = {k: [file_size(f) for f in collect_files(v)]
+             for k, v in job.inputs.items()}
+    data = json.dumps(sizes, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+class History(object):
+    """
+    SQLite database of tool runs: wall time, CPU time (user + system),
+    max RSS in KB and exit status. Values the executor couldn't measure
+    are NULL, as is the exit status of jobs that failed before a process
+    was started.
+
+    Database errors are logged and otherwise ignored: a history that
+    can't be opened, or doesn't exist and create is False, has no runs
+    and records nothing.
+    """
+
+    def __init__(self, path, create=True):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        try:
+            self._db = self.connect(create)
+        except (OSError, sqlite3.Error) as e:
+            log.warning('Unable to open history %s: %s', self.path, e)
+            self._db = None
+
+    def connect(self, create):
+        """
+        Database at path, None if it doesn't exist and create is False.
+        """
+        if not create and not os.path.exists(self.path):
+            return None
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with db:
+            db.executescript(SCHEMA)
+        return db
+
+    def query(self, sql, *args):
+        if self._db is None:
+            return []
+        try:
+            with self._lock:
+                return self._db.execute(sql, args).fetchall()
+        except sqlite3.Error as e:
+            log.warning('Unable to read history %s: %s', self.path, e)
+            return []
+
+    def record(self, job, started, usage=None):
+        if self._db is None:
+            return
+        usage = usage or {}
+        row = (
+            job.app.id, inputs_hash(job), started, time.time() - started,
+            usage.get('cpu_time'), usage.get('max_rss'),
+            usage.get('exit_status')
+        )
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    'INSERT INTO runs (%s) VALUES (%s)' % (
+                        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    row)
+        except sqlite3.Error as e:
+            log.warning('Unable to record run of %s in %s: %s',
+                        job.id, self.path, e)
+
+    def estimate(self, app_id, default=None):
+        """
+        Mean wall time of successful runs of app_id.
+        """
+        for mean, in self.query(
+                'SELECT AVG(wall_time) FROM runs '
+                'WHERE app_id = ? AND exit_status = 0', app_id):
+            if mean is not None:
+                return mean
+        return default
+
+    def summary(self):
+        """
+        (app_id, runs, failed, mean wall time, mean cpu time, max RSS)
+        per app.
+        """
+        return self.query(
+            'SELECT app_id, COUNT(*), '
+            'SUM(CASE WHEN exit_status = 0 THEN 0 ELSE 1 END), '
+            'AVG(wall_time), AVG(cpu_time), MAX(max_rss) '
+            'FROM runs GROUP BY app_id ORDER BY app_id')
+
+    def runs(self, app_id, limit=20):
+        return self.query(
+            'SELECT %s FROM runs WHERE app_id = ? '
+            'ORDER BY started DESC LIMIT ?' % ', '.join(COLUMNS),
+            app_id, limit)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
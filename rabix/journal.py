@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+import threading
+
+from rabix.common.errors import RabixError
+from rabix.common.ref_resolver import loader
+
+log = logging.getLogger(__name__)
+
+JOURNAL_FILE = 'journal.jsonl'
+
+
+class JournalState(object):
+    """
+    Completed work recovered from a journal: results of finished nodes, in
+    completion order, and results of finished scatter shards per node.
+    """
+
+    def __init__(self):
+        self.done = []
+        self.shards = {}
+
+    def shards_for(self, node_id):
+        return self.shards.get(node_id, {})
+
+
+def run_digest(app, job):
+    """
+    Digest of the app and inputs of a run, a journal is only resumed by a
+    run with the same one.
+    """
+    return loader.checksum([job.context.to_primitive(app),
+                            job.context.to_primitive(job.inputs)])
+
+
+class Journal(object):
+    """
+    Append-only log of completed workflow steps and scatter shards, one
+    JSON object per line, kept in the workflow work directory. The first
+    record holds the digest of the run, see run_digest. Records of nodes
+    not in `nodes`, when given, are ignored on resume.
+    """
+
+    def __init__(self, work_dir, context, resume=False, digest=None,
+                 nodes=None):
+        self.path = os.path.join(work_dir, JOURNAL_FILE)
+        self.context = context
+        self.digest = digest
+        self.nodes = nodes
+        self._lock = threading.Lock()
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        resume = resume and os.path.exists(self.path) and \
+            os.path.getsize(self.path) > 0
+        self.state = self.load() if resume else JournalState()
+        self._file = open(self.path, 'a' if resume else 'w')
+        if not resume:
+            self.write({'event': 'start', 'digest': digest})
+
+    def load(self):
+        state = JournalState()
+        started = False
+        with open(self.path) as f:
+            for line_no, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                    event = record['event']
+                    if not started:
+                        self.check_start(record)
+                        started = True
+                        continue
+                    node_id = record['node']
+                    if self.nodes is not None and node_id not in self.nodes:
+                        log.warning('Ignoring journal record %s:%s of '
+                                    'unknown step %s',
+                                    self.path, line_no + 1, node_id)
+                        continue
+                    if event == 'job_done':
+                        results = self.context.from_dict(record['results'])
+                        state.done.append((node_id, results))
+                    elif event == 'shard_done':
+                        result = self.context.from_dict(record['result'])
+                        shards = state.shards.setdefault(node_id, {})
+                        shards[record['index']] = result
+                except (ValueError, KeyError, TypeError):
+                    # the last record may be cut short by a crash
+                    log.warning('Ignoring corrupt journal record %s:%s',
+                                self.path, line_no + 1)
+        return state
+
+    def check_start(self, record):
+        if record['event'] != 'start':
+            raise RabixError("Journal %s has no start record, "
+                             "can't resume" % self.path)
+        if self.digest is not None and record['digest'] != self.digest:
+            raise RabixError("Journal %s is of a different app or inputs, "
+                             "can't resume" % self.path)
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._file.closed:
+                log.warning('Journal %s closed, dropping %s', self.path, line)
+                return
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def job_done(self, node_id, results):
+        self.write({
+            'event': 'job_done',
+            'node': node_id,
+            'results': self.context.to_primitive(results)
+        })
+
+    def shard_done(self, node_id, index, result):
+        self.write({
+            'event': 'shard_done',
+            'node': node_id,
+            'index': index,
+            'result': self.context.to_primitive(result)
+        })
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -6,6 +6,8 @@ import logging
 import six
 import json
 import copy
+import time
+import socket
 
 from avro.schema import NamedSchema
 from functools import partial
@@ -24,6 +26,15 @@ from rabix.common.context import Context
 from rabix.common.ref_resolver import from_url, loader
 from rabix.common.errors import RabixError
 from rabix.executor import Executor
+from rabix.cache import CallCache
+from rabix.distributed import RemoteExecutor, parse_address
+from rabix.scheduling import CriticalPathPolicy
+from rabix.history import History, DEFAULT_HISTORY
+from rabix.gc import Collector
+from rabix.plan import Plan
+from rabix.resources import ResourceManager
+from rabix.workflows import Workflow
+from rabix.workdirs import WorkDirs
 from rabix.cli import CommandLineTool, CLIJob
 
 import rabix.cli
@@ -42,24 +53,69 @@ TEMPLATE_JOB = {
     'class': 'Job',
     'inputs': {},
     'platform': 'http://example.org/my_platform/v1',
-    'allocatedResources': TEMPLATE_RESOURCES
+    'allocatedResources': {}
 }
 
 USAGE = """
 Usage:
+    rabix stats [--history=<hist>] [<app_id>]
     rabix [-v...] [-hcpI] [-t <type>] [-d <dir>] [-i <inp>] [{resources}] <tool> [-- {inputs}...]
+          [-j <jobs>] [--cache-dir=<cache>] [--resume] [--workers=<addrs>] [--asyncio]
+          [--history=<hist>] [--critical-path] [--plan [--cores=<cores>]]
+          [--gc [--cold-storage=<dir>]] [--work-root=<root>] [--retain-days=<days>]
     rabix [--outdir=<outdir>] [--quiet] <tool> <inp>
     rabix --conformance-test [--basedir=<basedir>] [--no-container] [--quiet] <tool> <job>
     rabix --version
 
 Options:
   -d --dir=<dir>        Working directory for the task. If not provided one will
-                        be auto generated in the current dir.
+                        be auto generated under --work-root.
+     --work-root=<root>
+                        Directory in which work dirs are generated
+                        [default: .]. Work dirs are named after the tool
+                        and start time, grouped in a dir for each day.
+     --retain-days=<days>
+                        Remove work dirs generated under --work-root more
+                        than this many days ago. Only day dirs rabix
+                        created are removed.
   -h --help             Show this help message. In conjunction with tool,
                         it will print inputs you can provide for the job.
 
   -I --install          Only install referenced tools. Do not run anything.
   -i --inp-file=<inp>   Inputs
+  -j --jobs=<jobs>      Maximum number of jobs to run in parallel [default: 1].
+     --cache-dir=<cache>
+                        Reuse outputs of previous runs of the same tool with
+                        the same inputs, stored in this directory.
+     --resume           Continue an interrupted workflow run in the directory
+                        given with --dir, skipping steps that finished.
+                        The tool and inputs must be those of that run.
+     --workers=<addrs>  Run tools on rabix-worker daemons at these comma
+                        separated host:port addresses. Work dirs must be on
+                        a file system shared with the workers, and
+                        RABIX_WORKER_TOKEN set to the workers' token.
+     --asyncio          Supervise command line tools that don't run in a
+                        container from one event loop instead of a thread
+                        per tool (Python 3.8 or later).
+     --history=<hist>   Record runs of tools in this SQLite database, e.g.
+                        {history}. Nothing is recorded without
+                        it. --critical-path, --plan and "rabix stats" read
+                        runtimes from it, by default from {history}.
+     --critical-path    When more steps are ready than can run, start those
+                        on the longest remaining path first. Path lengths
+                        are estimated from runtimes in --history.
+     --plan             Only print the jobs the workflow would run, its
+                        critical path and, using runtimes in --history, an
+                        estimate of how long the run takes. Do not run
+                        anything.
+     --cores=<cores>    Number of cores to estimate the run time for with
+                        --plan. Defaults to the cores of this host.
+     --gc               Remove intermediate files of workflow steps as soon
+                        as all steps using them have finished. Files that
+                        are workflow outputs are kept.
+     --cold-storage=<dir>
+                        With --gc, move intermediate files under this
+                        directory instead of removing them.
   -c --print-cli        Only print calculated command line. Do not run anything.
   -p --pretty-print     Print human readable result instead of JSON.
   -t --type=<type>      Interpret given tool json as <type>.
@@ -78,8 +134,8 @@ def disable_warnings():
     requests.packages.urllib3.disable_warnings()
 
 
-def init_context(d):
-    executor = Executor()
+def init_context(d, executor=None):
+    executor = executor or Executor()
     context = Context(executor)
 
     for module in (
@@ -149,7 +205,21 @@ def make_app_usage_string(app, template=TOOL_TEMPLATE, inp=None):
     resolve_object(app, usage_str, param_str, inp, root=True)
     usage_str.extend(param_str)
     return template.format(resources=make_resources_usage_string(),
-                           inputs=' '.join(usage_str))
+                           inputs=' '.join(usage_str),
+                           history=DEFAULT_HISTORY)
+
+
+def get_resources(args, template=TEMPLATE_RESOURCES):
+    """
+    Resources explicitly requested on the command line. Anything not given
+    is taken from the app's requirements when the job is admitted.
+    """
+    resources = {}
+    for k, v in six.iteritems(template):
+        val = args.get('--resources.%s' % k)
+        if val is not None:
+            resources[k] = type(v)(val)
+    return resources
 
 
 def get_tool(args):
@@ -163,7 +233,7 @@ def dry_run_parse(args=None):
         args = args[:args.index('--')]
 
     usage = USAGE.format(resources=make_resources_usage_string(),
-                         inputs='<inputs>')
+                         inputs='<inputs>', history=DEFAULT_HISTORY)
     try:
         return docopt.docopt(usage, args, version=version, help=False)
     except docopt.DocoptExit:
@@ -175,6 +245,50 @@ def fail(message):
     sys.exit(1)
 
 
+def read_history(path=None):
+    """
+    History to read runtimes from, without creating its database.
+    """
+    return History(path or DEFAULT_HISTORY, create=False)
+
+
+def print_stats(history, app_id=None):
+    def fmt(value, spec):
+        return '-' if value is None else spec % value
+
+    if app_id:
+        runs = history.runs(app_id)
+        if not runs:
+            fail("No recorded runs of %s." % app_id)
+        print('%-20s %10s %10s %10s %6s' % (
+            'started', 'wall (s)', 'cpu (s)', 'rss (KB)', 'exit'))
+        for _, _, started, wall, cpu, rss, status in runs:
+            print('%-20s %10s %10s %10s %6s' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+                fmt(wall, '%.2f'), fmt(cpu, '%.2f'), fmt(rss, '%d'),
+                fmt(status, '%d')))
+        return
+
+    print('%-40s %6s %6s %10s %10s %10s' % (
+        'app', 'runs', 'failed', 'wall (s)', 'cpu (s)', 'rss (KB)'))
+    for app, runs, failed, wall, cpu, rss in history.summary():
+        print('%-40s %6d %6d %10s %10s %10s' % (
+            app, runs, failed, fmt(wall, '%.2f'), fmt(cpu, '%.2f'),
+            fmt(rss, '%d')))
+
+
+def print_plan(workflow, job, history, cores=None):
+    try:
+        cores = int(cores) if cores else ResourceManager().cpu
+    except ValueError:
+        fail("Number of cores must be an integer.")
+    try:
+        plan = Plan(workflow, job, history)
+    except RabixError as err:
+        fail(err.message)
+    print(plan.summary(cores))
+
+
 def main():
     disable_warnings()
     logging.basicConfig(level=logging.WARN)
@@ -183,7 +297,7 @@ def main():
         return
 
     usage = USAGE.format(resources=make_resources_usage_string(),
-                         inputs='<inputs>')
+                         inputs='<inputs>', history=DEFAULT_HISTORY)
     app_usage = usage
 
     if len(sys.argv) == 2 and \
@@ -196,6 +310,11 @@ def main():
         print(USAGE)
         return
 
+    if dry_run_args['stats']:
+        print_stats(read_history(dry_run_args['--history']),
+                    dry_run_args['<app_id>'])
+        return
+
     if not (dry_run_args['<tool>']):
         print('You have to specify a tool, with --tool option')
         print(usage)
@@ -214,7 +333,62 @@ def main():
     if 'id' not in tool:
         tool['id'] = dry_run_args['<tool>']
 
-    context = init_context(tool)
+    try:
+        max_workers = int(dry_run_args['--jobs'])
+    except ValueError:
+        fail("Number of jobs must be an integer.")
+    if max_workers < 1:
+        fail("Number of jobs must be positive.")
+
+    try:
+        retain_days = dry_run_args['--retain-days']
+        retain_days = int(retain_days) if retain_days else None
+    except ValueError:
+        fail("Number of days must be an integer.")
+    # dry runs only name work dirs, they don't create or remove any
+    dry_run = dry_run_args['--print-cli'] or dry_run_args['--plan']
+    Job.work_dirs = WorkDirs(dry_run_args['--work-root'], retain_days,
+                             create=not dry_run)
+    if not dry_run:
+        Job.work_dirs.cleanup()
+
+    cache_dir = dry_run_args['--cache-dir']
+    cache = CallCache(cache_dir) if cache_dir else None
+
+    resume = dry_run_args['--resume']
+    if resume and not dry_run_args['--dir']:
+        fail("--resume requires the work directory (--dir) of the run.")
+
+    workers = dry_run_args['--workers']
+    if workers and dry_run_args['--asyncio']:
+        fail("--asyncio can't be used together with --workers.")
+    if dry_run_args['--asyncio']:
+        if sys.version_info < (3, 8):
+            fail("--asyncio requires Python 3.8 or later.")
+        from rabix.aio import AsyncExecutor
+        executor = AsyncExecutor(max_workers=max_workers, cache=cache,
+                                 resume=resume)
+    elif workers:
+        addresses = [parse_address(w) for w in workers.split(',')]
+        try:
+            executor = RemoteExecutor(addresses, cache=cache, resume=resume)
+        except socket.error as e:
+            fail("Can't connect to workers: %s" % e)
+        except RabixError as e:
+            fail(e.message)
+    else:
+        executor = Executor(max_workers=max_workers, cache=cache,
+                            resume=resume)
+
+    if dry_run_args['--history'] and not dry_run:
+        executor.history = History(dry_run_args['--history'])
+    if dry_run_args['--critical-path']:
+        executor.policy = CriticalPathPolicy(
+            executor.history or read_history(dry_run_args['--history']))
+    if dry_run_args['--gc']:
+        executor.gc = Collector(dry_run_args['--cold-storage'])
+
+    context = init_context(tool, executor)
 
     app = process_builder(context, tool)
     job = None
@@ -238,6 +412,7 @@ def main():
     try:
         args = docopt.docopt(usage, version=version, help=False)
         job_dict = copy.deepcopy(TEMPLATE_JOB)
+        job_dict['allocatedResources'] = get_resources(args)
         logging.root.setLevel(log_level(dry_run_args['--verbose']))
 
         input_file_path = args.get('<inp>') or args.get('--inp-file')
@@ -287,10 +462,18 @@ def main():
 
         job.inputs.update(inp)
 
+        if args['--plan']:
+            if not isinstance(app, Workflow):
+                fail(dry_run_args['<tool>'] + " is not a workflow")
+            print_plan(app, job, read_history(args['--history']),
+                       args['--cores'])
+            return
+
         if args['--print-cli']:
             if not isinstance(app, CommandLineTool):
                 fail(dry_run_args['<tool>'] + " is not a command line app")
 
+            job.allocated_resources = context.executor.resources.request(job)
             print(CLIJob(job).cmd_line())
             return
 
@@ -0,0 +1,267 @@
+"""
+Dry run of a workflow: scatters are expanded and steps resolved against
+placeholder outputs without running anything, to see how many jobs a run
+has and how long it would take on a given number of cores.
+"""
+
+import heapq
+import logging
+
+from collections import namedtuple
+
+import six
+
+from rabix.cli import CpuRequirement
+from rabix.common.errors import RabixError
+from rabix.executor import Executor
+from rabix.resources import DEFAULT_REQUEST
+from rabix.scatter import Scatter
+from rabix.scheduling import CriticalPathPolicy
+from rabix.workflows import ExecutionGraph
+
+log = logging.getLogger(__name__)
+
+
+class Placeholder(object):
+    """
+    Output value of a step that wasn't run.
+    """
+
+    def __repr__(self):
+        return '<placeholder>'
+
+
+PLACEHOLDER = Placeholder()
+
+
+# Jobs of one tool step that can start together. deps are indexes of
+# stages that must finish first.
+Stage = namedtuple('Stage', ['node_id', 'app', 'jobs', 'runtime', 'cpu',
+                             'deps'])
+
+
+def placeholder(depth):
+    """
+    Array outputs of unknown length are assumed to hold a single item.
+    """
+    value = PLACEHOLDER
+    for _ in range(depth):
+        value = [value]
+    return value
+
+
+def job_cpu(app):
+    req = app.get_requirement_or_hint(CpuRequirement)
+    if req is not None and isinstance(req.value, six.integer_types):
+        return req.value
+    return DEFAULT_REQUEST['cpu']
+
+
+class Plan(object):
+    """
+    Jobs a workflow would run for the inputs of job.
+
+    steps: (step id, number of tool jobs) for steps of the workflow, in the
+    order they became ready. Jobs of nested workflows count towards the
+    step that runs them.
+    stages: tool steps of this and nested workflows, see Stage.
+    unknown_lengths: array outputs of tool steps, of unknown length.
+    missing_history: ids of tools without recorded runs.
+
+    Runtimes of tools come from history, tools that never ran count as
+    default seconds.
+    """
+
+    def __init__(self, workflow, job, history, default=1.0,
+                 policy=None, prefix=''):
+        self.workflow = workflow
+        self.history = history
+        self.default = default
+        self.policy = policy or CriticalPathPolicy(history, default)
+        self.prefix = prefix
+        self.steps = []
+        self.stages = []
+        self.unknown_lengths = []
+        self.missing_history = set()
+
+        topology = workflow.step_graph
+        self._upstream = [[] for _ in range(len(topology))]
+        for i, links in enumerate(topology.links):
+            for dst, _, _ in links:
+                self._upstream[dst].append(topology.ids[i])
+        self._step_stages = {}
+
+        graph = ExecutionGraph(workflow, job)
+        while graph.has_next():
+            ready = graph.ready_jobs()
+            if not ready:
+                raise RabixError(
+                    "Unable to resolve inputs for steps: %s" %
+                    ', '.join(graph.unresolved()))
+            for node_id, step_job in ready:
+                graph.job_done(node_id, self.plan_step(node_id, step_job))
+        self.outputs = graph.outputs
+
+    @property
+    def jobs(self):
+        return sum(stage.jobs for stage in self.stages)
+
+    def plan_step(self, node_id, job):
+        """
+        Add stages for a ready step, returns its placeholder outputs.
+        """
+        index = self.workflow.step_graph.index[node_id]
+        deps = [s for upstream in self._upstream[index]
+                for s in self._step_stages[upstream]]
+        split = Executor.split_job(job)
+        shards = list(split) if isinstance(split, Scatter) else [job]
+        app = job.app
+        first = len(self.stages)
+
+        if getattr(app, 'step_graph', None) is not None:
+            results = []
+            for shard in shards:
+                sub = Plan(app, shard, self.history, self.default,
+                           self.policy, self.prefix + node_id + '/')
+                offset = len(self.stages)
+                for stage in sub.stages:
+                    self.stages.append(stage._replace(
+                        deps=deps + [d + offset for d in stage.deps]))
+                for name in sub.unknown_lengths:
+                    if name not in self.unknown_lengths:
+                        self.unknown_lengths.append(name)
+                self.missing_history.update(sub.missing_history)
+                results.append(sub.outputs)
+        else:
+            result = {}
+            for out in app.outputs:
+                result[out.id] = placeholder(out.depth)
+                if out.depth:
+                    self.unknown_lengths.append(
+                        self.prefix + node_id + '.' + out.id)
+            results = [result] * len(shards)
+            runtime = self.history.estimate(app.id)
+            if runtime is None:
+                runtime = self.default
+                self.missing_history.add(app.id)
+            self.stages.append(Stage(self.prefix + node_id, app, len(shards),
+                                     runtime, job_cpu(app), deps))
+
+        self._step_stages[node_id] = list(range(first, len(self.stages)))
+        self.steps.append((node_id, sum(
+            stage.jobs for stage in self.stages[first:])))
+        if isinstance(split, Scatter):
+            return split.combine(results)
+        return results[0]
+
+    def critical_path(self):
+        """
+        Steps on the longest path through the workflow, and its length in
+        seconds.
+        """
+        topology = self.workflow.step_graph
+        if not len(topology):
+            return [], 0
+        paths = self.policy.paths(self.workflow)
+        node_id = max(topology.ids, key=paths.get)
+        length = paths[node_id]
+        path = [node_id]
+        while True:
+            links = topology.links[topology.index[node_id]]
+            if not links:
+                return path, length
+            node_id = max((topology.ids[dst] for dst, _, _ in links),
+                          key=paths.get)
+            path.append(node_id)
+
+    def simulate(self, cores=None):
+        """
+        Replay the plan with jobs taking their estimated runtimes, on the
+        given number of cores or on as many as needed. Jobs on the longest
+        remaining path start first and a stage starts when all stages it
+        depends on are done, so shards that would be pipelined are not
+        overlapped with their producers.
+
+        Returns (makespan in seconds, most jobs running at once).
+        """
+        stages = self.stages
+        lengths = [0.0] * len(stages)
+        dependents = [[] for _ in stages]
+        waiting = [len(set(stage.deps)) for stage in stages]
+        for i in reversed(range(len(stages))):
+            lengths[i] += stages[i].runtime
+            for d in set(stages[i].deps):
+                dependents[d].append(i)
+                lengths[d] = max(lengths[d], lengths[i])
+
+        unstarted = [stage.jobs for stage in stages]
+        unfinished = list(unstarted)
+        ready = []
+        running = []
+        free = cores
+        now = 0.0
+        width = 0
+
+        def release(i):
+            if unfinished[i]:
+                ready.append((-lengths[i], i))
+                return
+            # scatter over an empty array, done right away
+            for dependent in dependents[i]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    release(dependent)
+
+        for i, w in enumerate(waiting):
+            if not w:
+                release(i)
+
+        while True:
+            ready.sort()
+            for _, i in list(ready):
+                cpu = min(stages[i].cpu, cores) if cores else 0
+                while unstarted[i] and (not cores or free >= cpu):
+                    unstarted[i] -= 1
+                    if cores:
+                        free -= cpu
+                    heapq.heappush(running,
+                                   (now + stages[i].runtime, i, cpu))
+                if not unstarted[i]:
+                    ready.remove((-lengths[i], i))
+            width = max(width, len(running))
+            if not running:
+                return now, width
+
+            now, i, cpu = heapq.heappop(running)
+            if cores:
+                free += cpu
+            unfinished[i] -= 1
+            if not unfinished[i]:
+                release(i)
+
+    def summary(self, cores):
+        lines = ['%-40s %8s' % ('step', 'jobs')]
+        lines.extend('%-40s %8d' % step for step in self.steps)
+        lines.append('')
+        lines.append('Total jobs: %d' % self.jobs)
+        _, width = self.simulate()
+        lines.append('Maximum parallel width: %d jobs' % width)
+        path, length = self.critical_path()
+        lines.append('Critical path (%.1f s): %s' %
+                     (length, ' -> '.join(path)))
+
+        has_history = any(stage.app.id not in self.missing_history
+                          for stage in self.stages)
+        if has_history:
+            makespan, _ = self.simulate(cores)
+            lines.append('Estimated makespan on %d cores: %.1f s' %
+                         (cores, makespan))
+        else:
+            lines.append('No recorded runtimes, makespan not estimated.')
+        if self.missing_history and has_history:
+            lines.append('No recorded runtimes for %s, assumed %.1f s.' % (
+                ', '.join(sorted(self.missing_history)), self.default))
+        if self.unknown_lengths:
+            lines.append('Array outputs of unknown length, assumed to hold '
+                         'one item: %s' % ', '.join(self.unknown_lengths))
+        return '\n'.join(lines)
@@ -0,0 +1,106 @@
+import os
+import logging
+import threading
+import multiprocessing
+
+import six
+
+from rabix.cli import CpuRequirement, MemRequirement
+from rabix.common.errors import RabixError
+from rabix.expressions import ValueResolver
+
+log = logging.getLogger(__name__)
+
+# used for jobs that declare neither CpuRequirement nor MemRequirement
+DEFAULT_REQUEST = {
+    'cpu': 1,
+    'mem': 256
+}
+
+
+def host_cpu():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def host_mem():
+    """
+    Physical memory of the host in megabytes, or None if it can't be
+    determined (memory is then not accounted for).
+    """
+    try:
+        pages = os.sysconf('SC_PHYS_PAGES')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+    return pages * page_size // (1024 * 1024)
+
+
+class ResourceManager(object):
+    """
+    Keeps track of cores and memory (in MB) available on the local host.
+    """
+
+    def __init__(self, cpu=None, mem=None):
+        self.cpu = cpu or host_cpu()
+        self.mem = mem or host_mem()
+        self.free_cpu = self.cpu
+        self.free_mem = self.mem
+        self._lock = threading.Lock()
+
+    def request(self, job):
+        """
+        Resources job asks for: values in job.allocated_resources win over
+        the app's CpuRequirement and MemRequirement, which win over
+        DEFAULT_REQUEST.
+        """
+        app = job.app
+        resolver = ValueResolver(job)
+        requested = dict(DEFAULT_REQUEST)
+        for key, req_class in (('cpu', CpuRequirement),
+                               ('mem', MemRequirement)):
+            req = app.get_requirement_or_hint(req_class)
+            if req is not None and req.value is not None:
+                requested[key] = int(resolver.resolve(req.value))
+
+        for k, v in six.iteritems(job.allocated_resources or {}):
+            if v is not None:
+                requested[k] = v
+        return requested
+
+    def check(self, job_id, requested):
+        if requested['cpu'] > self.cpu:
+            raise RabixError(
+                "Job %s requires %s cores, host has %s" %
+                (job_id, requested['cpu'], self.cpu))
+        if self.mem is not None and requested['mem'] > self.mem:
+            raise RabixError(
+                "Job %s requires %s MB of memory, host has %s MB" %
+                (job_id, requested['mem'], self.mem))
+
+    def try_allocate(self, requested):
+        """
+        Reserve requested resources if they fit in what is currently free.
+        Returns the granted resources or None.
+        """
+        with self._lock:
+            if requested['cpu'] > self.free_cpu:
+                return None
+            if self.mem is not None and requested['mem'] > self.free_mem:
+                return None
+            self.free_cpu -= requested['cpu']
+            if self.mem is not None:
+                self.free_mem -= requested['mem']
+        return dict(requested)
+
+    def release(self, granted):
+        with self._lock:
+            self.free_cpu += granted['cpu']
+            if self.mem is not None:
+                self.free_mem += granted['mem']
+
+    def __repr__(self):
+        return "ResourceManager(cpu=%s/%s, mem=%s/%s)" % (
+            self.free_cpu, self.cpu, self.free_mem, self.mem)
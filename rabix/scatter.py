@@ -0,0 +1,188 @@
+import os
+import six
+import itertools
+
+from rabix.common.errors import RabixError
+from rabix.common.models import Job
+from rabix.workdirs import shard_dir
+
+DOTPRODUCT = 'dotproduct'
+NESTED_CROSSPRODUCT = 'nested_crossproduct'
+FLAT_CROSSPRODUCT = 'flat_crossproduct'
+
+SCATTER_METHODS = (DOTPRODUCT, NESTED_CROSSPRODUCT, FLAT_CROSSPRODUCT)
+
+
+def combine(results):
+    combined = {}
+    for result in results:
+        for k, v in six.iteritems(result):
+            acc = combined.get(k, [])
+            acc.append(v)
+            combined[k] = acc
+    return combined
+
+
+def reshape(values, shape):
+    """
+    Split a flat list of values into nested lists of given shape
+    (row-major, last dimension varies fastest).
+    """
+    if len(shape) <= 1:
+        return values
+    step = len(values) // shape[0] if shape[0] else 0
+    return [reshape(values[i * step:(i + 1) * step], shape[1:])
+            for i in range(shape[0])]
+
+
+class Scatter(object):
+    """
+    Job split into shards over one or more of its inputs.
+
+    Shard jobs are created on demand while iterating. They share values
+    of inputs that are not scattered with the original job, so tools
+    must not modify input values in place.
+
+    With chunk_size above one, consecutive shards are grouped into
+    Chunks, see units().
+    """
+
+    def __init__(self, job, inputs, method=None, chunk_size=None):
+        self.job = job
+        self.inputs = inputs
+        self.method = method or DOTPRODUCT
+        self.chunk_size = chunk_size or 1
+        if self.method not in SCATTER_METHODS:
+            raise RabixError("Unknown scatter method '%s'" % self.method)
+
+        missing = [i for i in inputs if i not in job.inputs]
+        if missing:
+            raise RabixError("Job %s: can't scatter over missing inputs: %s"
+                             % (job.id, ', '.join(missing)))
+
+        self.values = [job.inputs[i] for i in inputs]
+        self.shape = [len(v) for v in self.values]
+        if self.method == DOTPRODUCT and len(set(self.shape)) > 1:
+            raise RabixError(
+                "Job %s: dotproduct scatter over inputs of different "
+                "lengths (%s)" % (job.id, ', '.join(
+                    '%s: %s' % (i, n) for i, n in zip(inputs, self.shape))))
+
+    @property
+    def flat(self):
+        """
+        Whether shard results are combined into flat lists, in shard order.
+        """
+        return self.method != NESTED_CROSSPRODUCT or len(self.inputs) == 1
+
+    def __len__(self):
+        if self.method == DOTPRODUCT:
+            return self.shape[0] if self.shape else 0
+        total = 1
+        for n in self.shape:
+            total *= n
+        return total
+
+    def combinations(self):
+        if self.method == DOTPRODUCT:
+            return six.moves.zip(*self.values)
+        return itertools.product(*self.values)
+
+    def shard(self, index, values, chunk_id=None):
+        inputs = dict(self.job.inputs)
+        inputs.update(zip(self.inputs, values))
+        if chunk_id is None:
+            job_id = shard_dir(self.job.id, index, len(self))
+        else:
+            job_id = os.path.join(chunk_id, '%s_%s' % (
+                os.path.basename(six.text_type(self.job.id)), index))
+        job = Job(job_id, self.job.app, inputs, {}, self.job.context)
+        job.priority = self.job.priority
+        return job
+
+    def __iter__(self):
+        for index, values in enumerate(self.combinations()):
+            yield self.shard(index, values)
+
+    def chunk(self, shards):
+        """
+        (indexes, Chunk) of shards given as (index, values). The chunk's
+        work dir is named after its first and last shard, its shards work
+        in dirs inside it.
+        """
+        indexes = [index for index, _ in shards]
+        chunk_id = '%s-%s' % (shard_dir(self.job.id, indexes[0], len(self)),
+                              indexes[-1])
+        return indexes, Chunk(chunk_id, [
+            self.shard(index, values, chunk_id) for index, values in shards])
+
+    def units(self, skip=()):
+        """
+        Yield (shard indexes, job) for shards with indexes not in skip.
+        Jobs are shards, or Chunks of up to chunk_size shards.
+        """
+        chunk = []
+        for index, values in enumerate(self.combinations()):
+            if index in skip:
+                continue
+            if self.chunk_size == 1:
+                yield [index], self.shard(index, values)
+                continue
+            chunk.append((index, values))
+            if len(chunk) == self.chunk_size:
+                yield self.chunk(chunk)
+                chunk = []
+        if chunk:
+            yield self.chunk(chunk)
+
+    def combine(self, results):
+        combined = combine(results)
+        if self.flat:
+            return combined
+        return {k: reshape(v, self.shape) for k, v in six.iteritems(combined)}
+
+    def __repr__(self):
+        return "Scatter(%s, %s, %s)" % (self.job.id, self.inputs, self.method)
+
+
+class Chunk(Job):
+    """
+    Shards of a scatter admitted as a single job and run together by
+    the app's run_chunk, to spare shards that finish quickly most of
+    the per-job overhead. Resources are requested as for the first
+    shard. Runs to a list of shard results.
+    """
+
+    __slots__ = ('jobs',)
+
+    def __init__(self, chunk_id, jobs):
+        first = jobs[0]
+        super(Chunk, self).__init__(chunk_id, first.app, first.inputs, {},
+                                    first.context)
+        self.jobs = jobs
+        self.priority = first.priority
+
+    def shards(self):
+        """
+        Shard jobs, given the resources allocated to the chunk.
+        """
+        for job in self.jobs:
+            job.allocated_resources = self.allocated_resources
+            yield job
+
+    def run(self):
+        return self.app.run_chunk(self)
+
+    def to_dict(self, context=None):
+        ctx = context or self.context
+        d = super(Chunk, self).to_dict(context)
+        # shards share the app
+        d.update({
+            'class': 'Chunk',
+            'jobs': [{'id': job.id, 'inputs': ctx.to_primitive(job.inputs)}
+                     for job in self.jobs]
+        })
+        return d
+
+    def __repr__(self):
+        return "Chunk(%s)" % ', '.join(job.id for job in self.jobs)
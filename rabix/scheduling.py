@@ -0,0 +1,48 @@
+import logging
+import threading
+
+import six
+
+log = logging.getLogger(__name__)
+
+
+class CriticalPathPolicy(object):
+    """
+    Ranks workflow steps by the length of the longest path from the
+    step to the end of the workflow, the step's own runtime included.
+    Runtimes come from history; apps that never ran count as default
+    seconds, so without any history steps are ranked by the number of
+    steps after them.
+    """
+
+    def __init__(self, history, default=1.0):
+        self.history = history
+        self.default = default
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def runtime(self, app):
+        step_graph = getattr(app, 'step_graph', None)
+        if step_graph is not None:
+            return max(list(six.itervalues(self.paths(app))) or [0])
+        return self.history.estimate(app.id, self.default)
+
+    def paths(self, workflow):
+        with self._lock:
+            paths = self._paths.get(workflow)
+        if paths is not None:
+            return paths
+
+        topology = workflow.step_graph
+        lengths = [0.0] * len(topology)
+        for i in reversed(topology.order):
+            downstream = [lengths[dst] for dst, _, _ in topology.links[i]]
+            lengths[i] = (self.runtime(topology.nodes[i].app) +
+                          max(downstream or [0]))
+        paths = dict(six.moves.zip(topology.ids, lengths))
+        with self._lock:
+            self._paths[workflow] = paths
+        return paths
+
+    def priority(self, workflow, node_id):
+        return self.paths(workflow)[node_id]
@@ -21,3 +21,39 @@ def test_secondary_files():
     eval = ValueResolver({})
     sf = secondary_files("main_path", {"secondaryFiles": [".bai"]}, eval)
     assert_equal(os.path.basename(sf[0]['path']), 'main_path.bai')
+
+
+def test_cmd_line_expressions_batched():
+    from unittest import SkipTest
+    from rabix.common.models import process_builder, Job
+    from rabix.expressions.node_pool import pool, ExpressionError
+    from rabix.tests.test_executors.test_scheduler import make_context
+    if not pool.node:
+        raise SkipTest('batched expressions need Node.js')
+
+    def js(script):
+        return {'engine': 'javascript', 'script': script}
+
+    context = make_context(1)
+    tool = process_builder(context, {
+        'id': 'tool',
+        'class': 'CommandLineTool',
+        'inputs': [{'id': 'x', 'type': 'int',
+                    'inputBinding': {'position': 1,
+                                     'valueFrom': js('$self * 2')}}],
+        'outputs': [],
+        'baseCommand': ['echo', js('"n" + $job.inputs.x')],
+        'arguments': [{'position': 0, 'valueFrom': js('$job.inputs.x + 1')},
+                      {'position': 2, 'valueFrom': js('missing.x')}],
+        'stdout': js('"out" + $job.inputs.x + ".txt"')
+    })
+    job = Job('job', tool, {'x': 3}, {}, context)
+    with mock.patch.object(pool, 'request', wraps=pool.request) as request:
+        cli_job = CLIJob(job)
+        cli_job.eval.prefetch(cli_job.expressions())
+        assert_equal(request.call_count, 1)
+        assert_raises(ExpressionError, cli_job.cmd_line)
+        assert_equal(request.call_count, 1)
+
+    tool.arguments.pop()
+    assert_equal(CLIJob(job).cmd_line(), 'echo n3 4 6 > out3.txt')
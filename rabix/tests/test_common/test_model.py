@@ -1,2 +1,69 @@
 from nose.tools import *
 from rabix.common.models import *
+from six.moves.urllib.parse import urlparse
+
+
+def test_url_parts():
+    for url in ['/data/a.bam', 'rel/a b.bam', '/data/a#1.bam', '//host/a',
+                ' /a', 'http://host/a?x=1', 'file:///a', '']:
+        u = URL(url)
+        assert_equal(u.parts, urlparse(url, 'file'))
+        assert_equal(u.geturl(), urlparse(url, 'file').geturl())
+
+    u = URL('data:text/plain;base64,aGk=')
+    assert_equal((u.content_type, u.data), ('text/plain', b'hi'))
+
+
+def test_file_to_dict():
+    d = {'class': 'File', 'path': '/data/a.bam', 'size': 10,
+         'secondaryFiles': [{'class': 'File', 'path': '/data/a.bai'}]}
+    f = File(d)
+    assert_equal(f.to_dict(), d)
+    f.remap({'/data/': '/mnt/'})
+    assert_equal(f.secondary_files[0].path, '/mnt/a.bai')
+    assert_raises(AttributeError, setattr, f, 'other', 1)
+
+
+def test_job_serialized():
+    from rabix.common.context import Context
+    app = Process('tool', [InputParameter('bam')], [OutputParameter('out')],
+                  [], [], None, None)
+    job = Job('job', app, {'bam': File('/data/a.bam')}, {}, Context(None))
+    first = job.serialized()
+    assert_is(job.serialized(), first)
+    assert_equal(first, job.to_dict())
+
+    job.inputs['bam'].remap({'/data/': '/mnt/'})
+    job.invalidate()
+    assert_equal(job.serialized()['inputs']['bam']['path'], '/mnt/a.bam')
+
+    job.inputs = {'bam': File('/data/b.bam')}
+    assert_equal(job.serialized()['inputs']['bam']['path'], '/data/b.bam')
+
+
+def test_job_serialized_after_allocation():
+    from rabix.common.context import Context
+    from rabix.expressions.evaluator import ValueResolver
+    app = Process('tool', [], [], [], [], None, None)
+    job = Job('job', app, {}, {}, Context(None))
+    resolver = ValueResolver(job)
+    cpu = {'engine': '#cwl-js-engine',
+           'script': '$job.allocatedResources.cpu'}
+    assert_equal(resolver.resolve(cpu), None)
+    job.allocated_resources = {'cpu': 4, 'mem': 1024}
+    assert_equal(resolver.resolve(cpu), 4)
+
+
+def test_job_to_dict_keys():
+    from rabix.common.context import Context
+    app = Process('tool', [InputParameter('bam')], [OutputParameter('out')],
+                  [], [], None, None)
+    job = Job('job', app, {'bam': None}, {}, Context(None))
+    assert_equal(sorted(job.to_dict()),
+                 ['allocatedResources', 'app', 'class', 'id', 'inputs'])
+
+    job = Job('job', app, {'bam': None}, {}, Context(None), ['bam'],
+              'dotproduct', 2)
+    d = job.to_dict()
+    assert_equal((d['scatter'], d['scatterMethod'], d['scatterChunkSize']),
+                 (['bam'], 'dotproduct', 2))
@@ -0,0 +1,151 @@
+import os
+import sys
+import copy
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+
+from unittest import SkipTest
+from nose.tools import assert_equal, assert_raises, assert_true
+
+if sys.version_info < (3, 8):
+    raise SkipTest('asyncio executor needs Python 3.8')
+
+import rabix.cli
+import rabix.common.models
+import rabix.workflows
+
+from rabix.aio import AsyncExecutor
+from rabix.common.context import Context
+from rabix.common.errors import RabixError
+from rabix.cli import CommandLineTool
+from rabix.common.models import Job, process_builder
+from rabix.resources import ResourceManager
+
+SLEEP = {
+    'id': 'sleep',
+    'class': 'CommandLineTool',
+    'inputs': [{
+        'id': 'seconds',
+        'type': 'float',
+        'inputBinding': {'position': 1}
+    }],
+    'outputs': [{
+        'id': 'out',
+        'type': 'File',
+        'outputBinding': {'glob': 'out.txt'}
+    }],
+    'baseCommand': ['sleep'],
+    'arguments': [{'valueFrom': '&& pwd > out.txt', 'position': 2}],
+}
+
+
+def sleep_workflow(command=None, chunk_size=None):
+    tool = copy.deepcopy(SLEEP)
+    if command:
+        tool['baseCommand'] = command
+    step = {
+        'id': 'sleep',
+        'run': tool,
+        'inputs': [{'id': 'sleep.seconds', 'source': 'times'}],
+        'outputs': [{'id': 'sleep.out'}]
+    }
+    if chunk_size:
+        step['scatterChunkSize'] = chunk_size
+    return {
+        'id': 'sleeps',
+        'class': 'Workflow',
+        'inputs': [{'id': 'times', 'type': {'type': 'array',
+                                            'items': 'float'}}],
+        'outputs': [{'id': 'sleeps_out', 'type': {'type': 'array',
+                                                  'items': 'File'},
+                     'source': 'sleep.out'}],
+        'steps': [step]
+    }
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.usage = []
+
+    def record(self, job, started, usage=None):
+        self.usage.append(usage)
+
+
+def run_async(doc, inputs, max_in_flight, history=None):
+    executor = AsyncExecutor(max_workers=1, max_in_flight=max_in_flight,
+                             resources=ResourceManager(cpu=64, mem=64000))
+    executor.history = history
+    context = Context(executor)
+    for module in (rabix.common.models, rabix.cli, rabix.workflows):
+        module.init(context)
+    app = process_builder(context, doc)
+    work_dir = tempfile.mkdtemp()
+    try:
+        job = Job(os.path.join(work_dir, 'wf'), app, inputs, {}, context)
+        result = executor.execute_async(job).result()
+        paths = [out.path for out in result['sleeps_out']]
+        return paths, [open(p).read().strip() for p in paths]
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_tools_in_flight_without_threads():
+    threads = threading.active_count()
+    start = time.time()
+    paths, dirs = run_async(sleep_workflow(), {'times': [0.5] * 32}, 32)
+    elapsed = time.time() - start
+
+    assert_equal(dirs, [os.path.dirname(p) for p in paths])
+    assert_equal(len(set(dirs)), 32)
+    # one pool worker, yet all tools ran at the same time
+    assert_true(elapsed < 4, elapsed)
+    assert_true(threading.active_count() - threads < 8)
+
+
+def test_tool_failure():
+    assert_raises(RabixError, run_async, sleep_workflow(['false']),
+                  {'times': [0.1]}, 1)
+
+
+def test_chunks():
+    paths, dirs = run_async(sleep_workflow(chunk_size=3),
+                            {'times': [0.1] * 7}, 8)
+    assert_equal(dirs, [os.path.dirname(p) for p in paths])
+    assert_equal([p.split(os.sep)[-3] for p in paths],
+                 ['sleep_0-2'] * 3 + ['sleep_3-5'] * 3 + ['sleep_6-6'])
+
+
+def test_prepare_off_the_loop():
+    prepare = CommandLineTool.prepare
+    popen = subprocess.Popen
+    threads = []
+
+    def recording_prepare(self, *args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return prepare(self, *args, **kwargs)
+
+    def recording_popen(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return popen(*args, **kwargs)
+
+    CommandLineTool.prepare = recording_prepare
+    subprocess.Popen = recording_popen
+    history = Recorder()
+    try:
+        run_async(sleep_workflow(), {'times': [0.1] * 2}, 2, history)
+    finally:
+        CommandLineTool.prepare = prepare
+        subprocess.Popen = popen
+    # prepared and started
+    assert_equal(len(threads), 4)
+    assert_true('rabix-event-loop' not in threads)
+    # cpu time and RSS are recorded, as with threads
+    assert_equal(len(history.usage), 2)
+    for usage in history.usage:
+        assert_equal(usage['exit_status'], 0)
+        assert_true(usage['cpu_time'] is not None)
+        assert_true(usage['max_rss'] > 0)
@@ -0,0 +1,88 @@
+import os
+import copy
+import shutil
+import tempfile
+import functools
+
+from nose.tools import assert_equal, assert_not_equal
+
+from rabix.cache import CallCache
+from rabix.common.models import Job, File, process_builder
+from rabix.resources import ResourceManager
+from rabix.tests.test_executors.test_scheduler import make_context
+
+TMP = {}
+
+ECHO = {
+    'id': 'echo',
+    'class': 'CommandLineTool',
+    'inputs': [{
+        'id': 'file',
+        'type': 'File',
+        'inputBinding': {'position': 1}
+    }],
+    'outputs': [{
+        'id': 'out',
+        'type': 'File',
+        'outputBinding': {'glob': 'out.txt'}
+    }],
+    'baseCommand': ['cat'],
+    'stdout': 'out.txt'
+}
+
+
+def in_tmp_dir(test):
+    @functools.wraps(test)
+    def wrapped():
+        TMP['dir'] = tempfile.mkdtemp()
+        TMP['input'] = os.path.join(TMP['dir'], 'input.txt')
+        with open(TMP['input'], 'w') as f:
+            f.write('hello')
+        try:
+            test()
+        finally:
+            shutil.rmtree(TMP['dir'])
+    return wrapped
+
+
+def run_echo(cache, job_name):
+    context = make_context(1, ResourceManager(cpu=1, mem=1024))
+    context.executor.cache = cache
+    app = process_builder(context, copy.deepcopy(ECHO))
+    job_dir = os.path.join(TMP['dir'], job_name)
+    job = Job(job_dir, app, {'file': File(TMP['input'])}, {}, context)
+    return context.executor.execute_async(job).result()
+
+
+@in_tmp_dir
+def test_cache_hit():
+    cache = CallCache(os.path.join(TMP['dir'], 'cache'))
+    first = run_echo(cache, 'first')
+    second = run_echo(cache, 'second')
+
+    assert_equal(first['out'].path, second['out'].path)
+    assert not os.path.exists(os.path.join(TMP['dir'], 'second'))
+
+
+@in_tmp_dir
+def test_cache_miss_on_changed_input():
+    cache = CallCache(os.path.join(TMP['dir'], 'cache'))
+    first = run_echo(cache, 'first')
+
+    with open(TMP['input'], 'w') as f:
+        f.write('changed')
+    second = run_echo(cache, 'second')
+
+    assert_not_equal(first['out'].path, second['out'].path)
+    with open(second['out'].path) as f:
+        assert_equal(f.read(), 'changed')
+
+
+@in_tmp_dir
+def test_cache_miss_on_deleted_output():
+    cache = CallCache(os.path.join(TMP['dir'], 'cache'))
+    first = run_echo(cache, 'first')
+    os.remove(first['out'].path)
+
+    second = run_echo(cache, 'second')
+    assert os.path.exists(second['out'].path)
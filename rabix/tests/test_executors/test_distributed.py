@@ -0,0 +1,173 @@
+import os
+import copy
+import time
+import socket
+import shutil
+import tempfile
+import threading
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import rabix.cli
+import rabix.common.models
+import rabix.distributed
+import rabix.workflows
+
+from rabix.common.context import Context
+from rabix.common.errors import RabixError
+from rabix.common.models import Job, File, process_builder
+from rabix.distributed import Worker, RemoteExecutor, send_message, \
+    recv_message, call
+from rabix.tests.test_executors.test_cache import ECHO
+
+TOKEN = 'secret'
+
+
+class CountingWorker(Worker):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingWorker, self).__init__(*args, **kwargs)
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def run(self, job):
+        with self.lock:
+            self.jobs.append(job.id)
+        return super(CountingWorker, self).run(job)
+
+
+def echo_workflow():
+    return {
+        'id': 'echoes',
+        'class': 'Workflow',
+        'inputs': [{'id': 'files', 'type': {'type': 'array',
+                                            'items': 'File'}}],
+        'outputs': [{'id': 'echoes_out', 'type': {'type': 'array',
+                                                  'items': 'File'},
+                     'source': 'echo.out'}],
+        'steps': [{
+            'id': 'echo',
+            'run': copy.deepcopy(ECHO),
+            'inputs': [{'id': 'echo.file', 'source': 'files'}],
+            'outputs': [{'id': 'echo.out'}]
+        }]
+    }
+
+
+def run_on_workers(doc, inputs, work_dir, workers, timeout=None):
+    executor = RemoteExecutor([w.address for w in workers], token=TOKEN,
+                              timeout=timeout)
+    context = Context(executor)
+    for module in (rabix.common.models, rabix.cli, rabix.workflows):
+        module.init(context)
+    app = process_builder(context, doc)
+    job = Job(os.path.join(work_dir, 'wf'), app, inputs, {}, context)
+    return executor.execute_async(job).result()
+
+
+def with_workers(test):
+    def wrapped():
+        work_dir = tempfile.mkdtemp()
+        workers = [CountingWorker('127.0.0.1', 0, cpu=2, mem=1024,
+                                  token=TOKEN)
+                   for _ in range(2)]
+        for w in workers:
+            w.start()
+        try:
+            test(work_dir, workers)
+        finally:
+            for w in workers:
+                w.stop()
+            shutil.rmtree(work_dir)
+    wrapped.__name__ = test.__name__
+    return wrapped
+
+
+def test_framing():
+    a, b = socket.socketpair()
+    try:
+        message = {'type': 'run', 'data': 'x' * 100000}
+        t = threading.Thread(target=send_message, args=(a, message))
+        t.start()
+        assert_equal(recv_message(b), message)
+        t.join()
+    finally:
+        a.close()
+        b.close()
+
+
+@with_workers
+def test_scatter_on_workers(work_dir, workers):
+    paths = []
+    for i in range(6):
+        path = os.path.join(work_dir, 'in%s.txt' % i)
+        with open(path, 'w') as f:
+            f.write('hello %s' % i)
+        paths.append(path)
+
+    result = run_on_workers(echo_workflow(),
+                            {'files': [File(p) for p in paths]},
+                            work_dir, workers)
+
+    contents = []
+    for out in result['echoes_out']:
+        with open(out.path) as f:
+            contents.append(f.read())
+    assert_equal(contents, ['hello %s' % i for i in range(6)])
+    assert_equal(sum(len(w.jobs) for w in workers), 6)
+    assert_true(all(w.jobs for w in workers))
+
+
+@with_workers
+def test_failure_on_worker(work_dir, workers):
+    doc = echo_workflow()
+    doc['steps'][0]['run']['baseCommand'] = ['false']
+    path = os.path.join(work_dir, 'in.txt')
+    open(path, 'w').close()
+    assert_raises(RabixError, run_on_workers, doc, {'files': [File(path)]},
+                  work_dir, workers)
+
+
+@with_workers
+def test_wrong_token(work_dir, workers):
+    for token in ('wrong', None):
+        reply = call(workers[0].address, {'type': 'info'}, token)
+        assert_equal(reply, {'error': 'Wrong token'})
+    assert_raises(RabixError, RemoteExecutor, [workers[0].address],
+                  token='wrong')
+
+
+def test_silent_worker():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    try:
+        start = time.time()
+        assert_raises(socket.timeout, call, server.getsockname(),
+                      {'type': 'info'}, TOKEN, 0.2)
+        assert_true(time.time() - start < 5)
+    finally:
+        server.close()
+
+
+@with_workers
+def test_heartbeat(work_dir, workers):
+    run = CountingWorker.run
+
+    def slow_run(worker, job):
+        time.sleep(0.6)
+        return run(worker, job)
+
+    heartbeat = rabix.distributed.HEARTBEAT
+    rabix.distributed.HEARTBEAT = 0.05
+    CountingWorker.run = slow_run
+    try:
+        path = os.path.join(work_dir, 'in.txt')
+        open(path, 'w').close()
+        # the job takes longer than the timeout, but the worker is alive
+        result = run_on_workers(echo_workflow(), {'files': [File(path)]},
+                                work_dir, workers, timeout=0.3)
+        assert_equal(len(result['echoes_out']), 1)
+    finally:
+        CountingWorker.run = run
+        rabix.distributed.HEARTBEAT = heartbeat
@@ -0,0 +1,69 @@
+import os
+import copy
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from rabix.common.models import Job, File, process_builder
+from rabix.gc import Collector
+from rabix.tests.test_executors.test_cache import ECHO, TMP, in_tmp_dir
+from rabix.tests.test_executors.test_scheduler import make_context
+
+
+def echo_step(step_id, source):
+    return {
+        'id': step_id,
+        'run': copy.deepcopy(ECHO),
+        'inputs': [{'id': step_id + '.file', 'source': source}],
+        'outputs': [{'id': step_id + '.out'}]
+    }
+
+
+def chain_workflow(outputs):
+    """
+    Three echo steps in a chain, exposing outputs of the given steps.
+    """
+    return {
+        'id': 'chain',
+        'class': 'Workflow',
+        'inputs': [{'id': 'file', 'type': 'File'}],
+        'outputs': [{'id': s + '_out', 'type': 'File', 'source': s + '.out'}
+                    for s in outputs],
+        'steps': [echo_step('first', 'file'),
+                  echo_step('second', 'first.out'),
+                  echo_step('third', 'second.out')]
+    }
+
+
+def run_chain(collector, outputs):
+    context = make_context(1)
+    context.executor.gc = collector
+    app = process_builder(context, chain_workflow(outputs))
+    job = Job(os.path.join(TMP['dir'], 'chain'), app,
+              {'file': File(TMP['input'])}, {}, context)
+    return context.executor.execute_async(job).result()
+
+
+def step_output(step_id):
+    return os.path.join(TMP['dir'], 'chain', step_id, 'out.txt')
+
+
+@in_tmp_dir
+def test_intermediate_outputs_removed():
+    result = run_chain(Collector(), ['third', 'first'])
+    with open(result['third_out'].path) as f:
+        assert_equal(f.read(), 'hello')
+    assert_true(os.path.exists(TMP['input']))
+    assert_true(os.path.exists(step_output('first')))
+    assert_false(os.path.exists(step_output('second')))
+
+
+@in_tmp_dir
+def test_intermediate_outputs_moved():
+    cold = os.path.join(TMP['dir'], 'cold')
+    run_chain(Collector(cold), ['third'])
+    for step_id in ('first', 'second'):
+        path = step_output(step_id)
+        assert_false(os.path.exists(path))
+        with open(os.path.join(cold, path.lstrip(os.sep))) as f:
+            assert_equal(f.read(), 'hello')
+    assert_true(os.path.exists(step_output('third')))
@@ -0,0 +1,46 @@
+from nose.tools import assert_equal, assert_raises
+
+from rabix.common.errors import ValidationError
+from rabix.common.models import Job, process_builder
+from rabix.tests.test_executors.test_scheduler import make_context, step
+from rabix.workflows import ExecutionGraph
+
+
+def chain_workflow(links):
+    """
+    Steps named after keys in links, each reading output of the step
+    given as value ('x' is the workflow input).
+    """
+    return {
+        'id': 'chain',
+        'class': 'Workflow',
+        'inputs': [{'id': 'x', 'type': 'int'}],
+        'outputs': [{'id': 'chain_out', 'type': 'int', 'source': 'c.out'}],
+        'steps': [step(s, src if src == 'x' else src + '.out')
+                  for s, src in links]
+    }
+
+
+def test_step_graph_order():
+    context = make_context(1)
+    # declared in reverse, must still run in dependency order
+    wf = process_builder(context, chain_workflow(
+        [('c', 'b'), ('b', 'a'), ('a', 'x')]))
+    topology = wf.step_graph
+    assert_equal([topology.ids[i] for i in topology.order], ['a', 'b', 'c'])
+
+    graph = ExecutionGraph(wf, Job('chain', wf, {'x': 1}, {}, context))
+    done = []
+    while graph.has_next():
+        ready = [node_id for node_id, _ in graph.ready_jobs()]
+        assert_equal(len(ready), 1)
+        done.extend(ready)
+        graph.job_done(ready[0], {'out': 1})
+    assert_equal(done, ['a', 'b', 'c'])
+    assert_equal(graph.outputs, {'chain_out': 1})
+
+
+def test_step_graph_cycle():
+    context = make_context(1)
+    doc = chain_workflow([('a', 'x'), ('b', 'c'), ('c', 'b')])
+    assert_raises(ValidationError, process_builder, context, doc)
@@ -0,0 +1,84 @@
+import os
+import copy
+
+from nose.tools import assert_equal, assert_not_equal, assert_raises, \
+    assert_true
+
+from rabix.common.errors import RabixError
+from rabix.common.models import Job, File, process_builder
+from rabix.history import History, inputs_hash
+from rabix.resources import ResourceManager
+from rabix.tests.test_executors.test_cache import ECHO, TMP, in_tmp_dir
+from rabix.tests.test_executors.test_scheduler import make_context
+
+
+def echo_job(context, job_name, path):
+    app = process_builder(context, copy.deepcopy(ECHO))
+    job_dir = os.path.join(TMP['dir'], job_name)
+    return Job(job_dir, app, {'file': File(path)}, {}, context)
+
+
+def run_echo(history, job_name, command=None):
+    context = make_context(1, ResourceManager(cpu=1, mem=1024))
+    context.executor.history = history
+    doc = copy.deepcopy(ECHO)
+    if command:
+        doc['baseCommand'] = command
+    app = process_builder(context, doc)
+    job = Job(os.path.join(TMP['dir'], job_name), app,
+              {'file': File(TMP['input'])}, {}, context)
+    return context.executor.execute_async(job).result()
+
+
+@in_tmp_dir
+def test_inputs_hash():
+    context = make_context(1)
+    other = os.path.join(TMP['dir'], 'other.txt')
+    with open(other, 'w') as f:
+        f.write('HELLO')
+    same = inputs_hash(echo_job(context, 'a', TMP['input']))
+    assert_equal(same, inputs_hash(echo_job(context, 'b', other)))
+
+    with open(other, 'w') as f:
+        f.write('hello world')
+    assert_not_equal(same, inputs_hash(echo_job(context, 'c', other)))
+
+
+@in_tmp_dir
+def test_runs_recorded():
+    path = os.path.join(TMP['dir'], 'history', 'history.db')
+    history = History(path)
+    run_echo(history, 'ok')
+    assert_raises(RabixError, run_echo, history, 'failed', ['false'])
+    history.close()
+
+    history = History(path)
+    ok, failed = sorted(history.runs('echo'), key=lambda r: r[-1])
+    app_id, _, _, wall, cpu, rss, status = ok
+    assert_equal((app_id, status), ('echo', 0))
+    assert_true(wall > 0 and cpu >= 0 and rss > 0)
+    assert_equal(failed[-1], 1)
+
+    assert_equal([row[:3] for row in history.summary()], [('echo', 2, 1)])
+    assert_equal(history.estimate('echo'), wall)
+    assert_equal(history.estimate('missing', 5), 5)
+
+
+@in_tmp_dir
+def test_missing_history_not_created():
+    path = os.path.join(TMP['dir'], 'history', 'history.db')
+    history = History(path, create=False)
+    assert_equal(history.summary(), [])
+    assert_equal(history.estimate('echo', 5), 5)
+    run_echo(history, 'ok')
+    assert_true(not os.path.exists(os.path.dirname(path)))
+
+
+@in_tmp_dir
+def test_history_errors_not_fatal():
+    # a file where the directory of the database should be
+    path = os.path.join(TMP['input'], 'history.db')
+    history = History(path)
+    run_echo(history, 'ok')
+    assert_equal(history.runs('echo'), [])
+    history.close()
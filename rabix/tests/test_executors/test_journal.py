@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+
+from collections import defaultdict
+from nose.tools import assert_equal, assert_raises
+
+from rabix.common.errors import RabixError
+from rabix.common.models import Job, process_builder
+from rabix.journal import Journal, JOURNAL_FILE, run_digest
+from rabix.tests.test_executors.test_scheduler import SleepTool, make_context
+
+
+class FlakyTool(SleepTool):
+    """
+    Counts runs per tool and fails for tools listed in `failing`.
+    """
+
+    runs = defaultdict(int)
+    failing = set()
+
+    def run(self, job):
+        FlakyTool.runs[self.id] += 1
+        if self.id in FlakyTool.failing:
+            raise RabixError('%s failed' % self.id)
+        return super(FlakyTool, self).run(job)
+
+
+def flaky_step(step_id, source):
+    return {
+        'id': step_id,
+        'run': {
+            'id': step_id + '_tool',
+            'class': 'FlakyTool',
+            'inputs': [{'id': 'inp', 'type': 'int'}],
+            'outputs': [{'id': 'out', 'type': 'int'}]
+        },
+        'inputs': [{'id': step_id + '.inp', 'source': source}],
+        'outputs': [{'id': step_id + '.out'}]
+    }
+
+
+def chain_workflow(input_type='int'):
+    return {
+        'id': 'chain',
+        'class': 'Workflow',
+        'inputs': [{'id': 'x', 'type': input_type}],
+        'outputs': [{'id': 'y', 'type': 'int', 'source': 'second.out'}],
+        'steps': [flaky_step('first', 'x'), flaky_step('second', 'first.out')]
+    }
+
+
+def chain_job(job_dir, inputs, resume, input_type='int'):
+    context = make_context(2)
+    context.add_type('FlakyTool', FlakyTool.from_dict)
+    context.executor.resume = resume
+    app = process_builder(context, chain_workflow(input_type))
+    return Job(job_dir, app, inputs, {}, context)
+
+
+def run_chain(job_dir, inputs, resume, input_type='int'):
+    job = chain_job(job_dir, inputs, resume, input_type)
+    return job.context.executor.execute_async(job).result()
+
+
+def test_resume_skips_finished_steps():
+    job_dir = tempfile.mkdtemp()
+    FlakyTool.runs.clear()
+    try:
+        FlakyTool.failing = {'second_tool'}
+        assert_raises(RabixError, run_chain, job_dir, {'x': 1}, False)
+        assert os.path.exists(os.path.join(job_dir, JOURNAL_FILE))
+
+        FlakyTool.failing = set()
+        result = run_chain(job_dir, {'x': 1}, True)
+        assert_equal(result, {'y': 1})
+        assert_equal(FlakyTool.runs['first_tool'], 1)
+        assert_equal(FlakyTool.runs['second_tool'], 2)
+    finally:
+        FlakyTool.failing = set()
+        shutil.rmtree(job_dir)
+
+
+def test_resume_skips_finished_shards():
+    job_dir = tempfile.mkdtemp()
+    FlakyTool.runs.clear()
+    try:
+        job = chain_job(job_dir, {'x': [0, 1, 2]}, True,
+                        {'type': 'array', 'items': 'int'})
+        journal = Journal(job_dir, job.context,
+                          digest=run_digest(job.app, job))
+        journal.shard_done('first', 0, {'out': 0})
+        journal.shard_done('first', 1, {'out': 1})
+        journal.close()
+
+        result = job.context.executor.execute_async(job).result()
+        assert_equal(result, {'y': [0, 1, 2]})
+        assert_equal(FlakyTool.runs['first_tool'], 1)
+        assert_equal(FlakyTool.runs['second_tool'], 3)
+    finally:
+        shutil.rmtree(job_dir)
+
+
+def test_load_ignores_truncated_record():
+    job_dir = tempfile.mkdtemp()
+    try:
+        context = make_context(1)
+        journal = Journal(job_dir, context)
+        journal.job_done('first', {'out': 1})
+        journal.close()
+        with open(os.path.join(job_dir, JOURNAL_FILE), 'a') as f:
+            f.write('{"event": "job_do')
+
+        state = Journal(job_dir, context, resume=True).state
+        assert_equal(state.done, [('first', {'out': 1})])
+    finally:
+        shutil.rmtree(job_dir)
+
+
+def test_resume_with_other_inputs():
+    job_dir = tempfile.mkdtemp()
+    FlakyTool.runs.clear()
+    try:
+        FlakyTool.failing = {'second_tool'}
+        assert_raises(RabixError, run_chain, job_dir, {'x': 1}, False)
+        FlakyTool.failing = set()
+        assert_raises(RabixError, run_chain, job_dir, {'x': 2}, True)
+        assert_equal(FlakyTool.runs['first_tool'], 1)
+
+        # without a journal, resume starts from scratch
+        os.remove(os.path.join(job_dir, JOURNAL_FILE))
+        assert_equal(run_chain(job_dir, {'x': 2}, True), {'y': 2})
+        assert_equal(FlakyTool.runs['first_tool'], 2)
+    finally:
+        FlakyTool.failing = set()
+        shutil.rmtree(job_dir)
+
+
+def test_load_ignores_unknown_steps():
+    job_dir = tempfile.mkdtemp()
+    try:
+        context = make_context(1)
+        journal = Journal(job_dir, context, digest='x')
+        journal.job_done('first', {'out': 1})
+        journal.job_done('renamed', {'out': 2})
+        journal.close()
+
+        state = Journal(job_dir, context, resume=True, digest='x',
+                        nodes={'first', 'second'}).state
+        assert_equal(state.done, [('first', {'out': 1})])
+    finally:
+        shutil.rmtree(job_dir)
@@ -0,0 +1,64 @@
+import time
+
+from nose.tools import assert_equal, assert_almost_equal
+
+from rabix.common.models import Job, process_builder
+from rabix.history import History
+from rabix.plan import Plan
+from rabix.tests.test_executors.test_scheduler import make_context, step
+
+
+def samples_workflow():
+    """
+    Two steps scattered over samples and one step run once.
+    """
+    return {
+        'id': 'samples',
+        'class': 'Workflow',
+        'inputs': [{'id': 'xs', 'type': {'type': 'array', 'items': 'int'}},
+                   {'id': 'y', 'type': 'int'}],
+        'outputs': [{'id': 'xs_out', 'type': {'type': 'array',
+                                              'items': 'int'},
+                     'source': 'align.out'},
+                    {'id': 'y_out', 'type': 'int', 'source': 'index.out'}],
+        'steps': [step('index', 'y'), step('call', 'xs'),
+                  step('align', 'call.out')]
+    }
+
+
+def make_plan(history, samples=5):
+    context = make_context(1)
+    wf = process_builder(context, samples_workflow())
+    job = Job('plan', wf, {'xs': list(range(samples)), 'y': 0}, {}, context)
+    return context, wf, Plan(wf, job, history)
+
+
+def test_plan_without_history():
+    _, _, plan = make_plan(History(':memory:'))
+    assert_equal(sorted(plan.steps),
+                 [('align', 5), ('call', 5), ('index', 1)])
+    assert_equal(plan.jobs, 11)
+    assert_equal(plan.simulate(), (2.0, 6))
+    assert_equal(plan.critical_path(), (['call', 'align'], 2.0))
+    assert_equal(plan.unknown_lengths, [])
+    assert_equal(plan.missing_history,
+                 set(['index_tool', 'call_tool', 'align_tool']))
+
+
+def test_makespan_from_history():
+    history = History(':memory:')
+    context, wf, _ = make_plan(history)
+    for node_id, seconds in (('index', 4), ('call', 2), ('align', 1)):
+        app = wf.step_graph.nodes[wf.step_graph.index[node_id]].app
+        history.record(Job(node_id, app, {'inp': 0}, {}, context),
+                       time.time() - seconds, {'exit_status': 0})
+
+    _, _, plan = make_plan(history, samples=4)
+    path, length = plan.critical_path()
+    assert_equal(path, ['index'])
+    assert_almost_equal(length, 4, places=2)
+    makespan, width = plan.simulate(2)
+    # index takes a core for 4 s while the calls run one at a time on
+    # the other, then the calls left and the aligns run two at a time
+    assert_equal(width, 2)
+    assert_almost_equal(makespan, 8, places=2)
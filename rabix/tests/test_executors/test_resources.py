@@ -0,0 +1,69 @@
+from nose.tools import assert_equal, assert_raises
+
+from rabix.common.errors import RabixError
+from rabix.common.models import Job, process_builder
+from rabix.resources import ResourceManager, DEFAULT_REQUEST
+from rabix.tests.test_executors.test_scheduler import (
+    SleepTool, make_context, sleep_tool, step, run_workflow
+)
+
+
+def cpu(n):
+    return [{'class': 'CPURequirement', 'value': n}]
+
+
+def scatter_workflow(requirements):
+    return {
+        'id': 'packed',
+        'class': 'Workflow',
+        'inputs': [{'id': 'x', 'type': 'int'}],
+        'outputs': [{'id': 'y', 'type': 'int', 'source': 'sleep.out'}],
+        'steps': [step('sleep', 'x', requirements)]
+    }
+
+
+def test_request():
+    context = make_context(1)
+    app = process_builder(context, sleep_tool('tool', cpu(3)))
+    job = Job('job', app, {'inp': 1}, {}, context)
+    rm = ResourceManager(cpu=4, mem=1024)
+    assert_equal(rm.request(job), {'cpu': 3, 'mem': DEFAULT_REQUEST['mem']})
+
+    job.allocated_resources = {'mem': 100}
+    assert_equal(rm.request(job), {'cpu': 3, 'mem': 100})
+
+
+def test_allocate_release():
+    rm = ResourceManager(cpu=4, mem=1000)
+    first = rm.try_allocate({'cpu': 3, 'mem': 500})
+    assert_equal(first, {'cpu': 3, 'mem': 500})
+    assert_equal(rm.try_allocate({'cpu': 2, 'mem': 100}), None)
+    assert_equal(rm.try_allocate({'cpu': 1, 'mem': 600}), None)
+    rm.release(first)
+    assert_equal((rm.free_cpu, rm.free_mem), (4, 1000))
+
+
+def test_jobs_packed_by_cpu():
+    inputs = {'x': [0, 1, 2, 3, 0, 1]}
+    resources = ResourceManager(cpu=4, mem=4096)
+    result = run_workflow(scatter_workflow(cpu(2)), inputs,
+                          max_workers=8, resources=resources)
+    assert_equal(result['y'], inputs['x'])
+    assert_equal(SleepTool.max_running, 2)
+    assert_equal(resources.free_cpu, 4)
+
+
+def test_granted_resources_visible_to_job():
+    context = make_context(1, ResourceManager(cpu=4, mem=4096))
+    app = process_builder(context, sleep_tool('tool', cpu(3)))
+    job = Job('job', app, {'inp': 1}, {}, context)
+    context.executor.execute(job)
+    assert_equal(job.allocated_resources,
+                 {'cpu': 3, 'mem': DEFAULT_REQUEST['mem']})
+
+
+def test_request_too_large():
+    context = make_context(1, ResourceManager(cpu=2, mem=4096))
+    app = process_builder(context, sleep_tool('tool', cpu(3)))
+    job = Job('job', app, {'inp': 1}, {}, context)
+    assert_raises(RabixError, context.executor.execute, job)
@@ -0,0 +1,246 @@
+import os
+import copy
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_is, assert_raises
+
+import rabix.workdirs
+
+from rabix.common.errors import RabixError
+from rabix.common.models import Process, InputParameter, OutputParameter, \
+    Job, File, process_builder
+from rabix.scatter import Scatter
+from rabix.tests.test_executors.test_scheduler import make_context, \
+    execute_in_tmp_dir
+
+
+class PairTool(Process):
+
+    def run(self, job):
+        return {'out': [job.inputs['a'], job.inputs['b'], job.inputs['c']]}
+
+    @classmethod
+    def from_dict(cls, context, d):
+        converted = {k: context.from_dict(v) for k, v in d.items()}
+        kwargs = Process.kwarg_dict(converted)
+        kwargs.update({
+            'inputs': [InputParameter.from_dict(context, inp)
+                       for inp in converted.get('inputs', [])],
+            'outputs': [OutputParameter.from_dict(context, inp)
+                        for inp in converted.get('outputs', [])]
+        })
+        return cls(**kwargs)
+
+
+def pair_workflow(scatter, method=None, chunk_size=None):
+    step = {
+        'id': 'pair',
+        'run': {
+            'id': 'pair_tool',
+            'class': 'PairTool',
+            'inputs': [{'id': 'a', 'type': 'int'},
+                       {'id': 'b', 'type': 'string'},
+                       {'id': 'c', 'type': {'type': 'array',
+                                            'items': 'int'}}],
+            'outputs': [{'id': 'out', 'type': {'type': 'array',
+                                               'items': 'int'}}]
+        },
+        'inputs': [{'id': 'pair.a', 'source': 'xs'},
+                   {'id': 'pair.b', 'source': 'ys'},
+                   {'id': 'pair.c', 'source': 'zs'}],
+        'outputs': [{'id': 'pair.out'}],
+        'scatter': scatter
+    }
+    if method:
+        step['scatterMethod'] = method
+    if chunk_size:
+        step['scatterChunkSize'] = chunk_size
+    return {
+        'id': 'pairs',
+        'class': 'Workflow',
+        'inputs': [
+            {'id': 'xs', 'type': {'type': 'array', 'items': 'int'}},
+            {'id': 'ys', 'type': {'type': 'array', 'items': 'string'}},
+            {'id': 'zs', 'type': {'type': 'array', 'items': 'int'}},
+        ],
+        'outputs': [{'id': 'pairs_out', 'type': {'type': 'array',
+                                                 'items': 'int'},
+                     'source': 'pair.out'}],
+        'steps': [step]
+    }
+
+
+def run_pairs(scatter, method, inputs):
+    context = make_context(4)
+    context.add_type('PairTool', PairTool.from_dict)
+    app = process_builder(context, pair_workflow(scatter, method))
+    return execute_in_tmp_dir(context, app, inputs)['pairs_out']
+
+
+INPUTS = {'xs': [1, 2], 'ys': ['a', 'b'], 'zs': [0]}
+
+
+def test_dotproduct():
+    result = run_pairs(['#pair.a', '#pair.b'], None, INPUTS)
+    assert_equal(result, [[1, 'a', [0]], [2, 'b', [0]]])
+
+
+def test_flat_crossproduct():
+    result = run_pairs(['#pair.a', '#pair.b'], 'flat_crossproduct', INPUTS)
+    assert_equal(result, [[1, 'a', [0]], [1, 'b', [0]],
+                          [2, 'a', [0]], [2, 'b', [0]]])
+
+
+def test_nested_crossproduct():
+    inputs = dict(INPUTS, ys=['a', 'b', 'c'])
+    result = run_pairs(['#pair.a', '#pair.b'], 'nested_crossproduct', inputs)
+    assert_equal(result, [[[1, 'a', [0]], [1, 'b', [0]], [1, 'c', [0]]],
+                          [[2, 'a', [0]], [2, 'b', [0]], [2, 'c', [0]]]])
+
+
+def test_dotproduct_length_mismatch():
+    inputs = dict(INPUTS, ys=['a'])
+    assert_raises(RabixError, run_pairs, ['#pair.a', '#pair.b'], None,
+                  inputs)
+
+
+def test_chunked_scatter():
+    context = make_context(4)
+    context.add_type('PairTool', PairTool.from_dict)
+    spawned = []
+    spawn = context.executor.spawn
+
+    def count_spawns(job):
+        spawned.append(job)
+        return spawn(job)
+
+    context.executor.spawn = count_spawns
+    app = process_builder(context, pair_workflow(['#pair.a'], None, 3))
+    inputs = dict(INPUTS, xs=list(range(7)))
+    result = execute_in_tmp_dir(context, app, inputs)['pairs_out']
+    assert_equal(result, [[x, ['a', 'b'], [0]] for x in range(7)])
+    # the workflow, then chunks of 3, 3 and 1 shards
+    assert_equal([len(getattr(job, 'jobs', [])) for job in spawned[1:]],
+                 [3, 3, 1])
+
+
+def test_shards_are_lazy():
+    context = make_context(1)
+    context.add_type('PairTool', PairTool.from_dict)
+    app = process_builder(context, pair_workflow([])).steps[0].app
+    shared = [0]
+    job = Job('pairs', app, {'a': list(range(10 ** 6)), 'b': ['x'],
+                             'c': shared}, {}, context)
+    scatter = Scatter(job, ['a', 'b'], 'flat_crossproduct')
+    assert_equal(len(scatter), 10 ** 6)
+    shard = next(iter(scatter))
+    assert_equal(shard.id, os.path.join('pairs', '0', 'pairs_0'))
+    assert_equal((shard.inputs['a'], shard.inputs['b']), (0, 'x'))
+    assert_is(shard.inputs['c'], shared)
+
+
+ECHO = {
+    'id': 'echo',
+    'class': 'CommandLineTool',
+    'inputs': [{'id': 'x', 'type': 'int', 'inputBinding': {'position': 1}}],
+    'outputs': [{'id': 'out', 'type': 'File',
+                 'outputBinding': {'glob': 'out.txt'}}],
+    'baseCommand': ['echo'],
+    'stdout': 'out.txt'
+}
+
+
+def echo_workflow(chunk_size=None):
+    step = {
+        'id': 'echo',
+        'run': copy.deepcopy(ECHO),
+        'inputs': [{'id': 'echo.x', 'source': 'xs'}],
+        'outputs': [{'id': 'echo.out'}],
+        'scatter': '#echo.x'
+    }
+    if chunk_size:
+        step['scatterChunkSize'] = chunk_size
+    return {
+        'id': 'echoes',
+        'class': 'Workflow',
+        'inputs': [{'id': 'xs', 'type': {'type': 'array', 'items': 'int'}}],
+        'outputs': [{'id': 'echoes_out',
+                     'type': {'type': 'array', 'items': 'File'},
+                     'source': 'echo.out'}],
+        'steps': [step]
+    }
+
+
+def read_outputs(result):
+    contents = []
+    for out in result['echoes_out']:
+        with open(out.path) as f:
+            contents.append(f.read().strip())
+    return [out.path for out in result['echoes_out']], contents
+
+
+def test_scatter_above_fanout():
+    context = make_context(4)
+    app = process_builder(context, echo_workflow())
+    fanout = rabix.workdirs.SHARD_FANOUT
+    rabix.workdirs.SHARD_FANOUT = 2
+    try:
+        outputs = []
+        execute_in_tmp_dir(context, app, {'xs': list(range(5))},
+                           lambda _, result: outputs.extend(
+                               read_outputs(result)))
+    finally:
+        rabix.workdirs.SHARD_FANOUT = fanout
+    paths, contents = outputs
+    assert_equal(contents, [str(x) for x in range(5)])
+    # shard 3 of 5 in the second group of 2
+    assert_equal(paths[3].split(os.sep)[-4:],
+                 ['echo', '1', 'echo_3', 'out.txt'])
+
+
+def test_chunked_command_line_tool():
+    context = make_context(4)
+    app = process_builder(context, echo_workflow(chunk_size=3))
+    outputs = []
+    dumps = []
+
+    def read(_, result):
+        outputs.extend(read_outputs(result))
+        wf_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+            outputs[0][0])))
+        for root, _, files in os.walk(wf_dir):
+            dumps.extend(os.path.relpath(root, wf_dir) for f in files
+                         if f == 'job.cwl.json')
+
+    execute_in_tmp_dir(context, app, {'xs': list(range(7))}, read)
+    paths, contents = outputs
+    assert_equal(contents, [str(x) for x in range(7)])
+    # shards work in the dir of their chunk, which is dumped once
+    assert_equal(paths[4].split(os.sep)[-3:],
+                 ['echo_3-5', 'echo_4', 'out.txt'])
+    assert_equal(sorted(dumps), ['echo_0-2', 'echo_3-5', 'echo_6-6'])
+
+
+def test_prepare_shares_inputs():
+    context = make_context(1)
+    doc = copy.deepcopy(ECHO)
+    doc['inputs'] += [
+        {'id': 'f', 'type': 'File', 'inputBinding': {'loadContents': True}},
+        {'id': 'ys', 'type': {'type': 'array', 'items': 'int'}}
+    ]
+    app = process_builder(context, doc)
+    work_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(work_dir, 'f.txt')
+        with open(path, 'w') as f:
+            f.write('hello')
+        inputs = {'x': 1, 'f': File(path), 'ys': list(range(10))}
+        job = Job(os.path.join(work_dir, 'echo'), app, inputs, {}, context)
+        prepared = app.prepare(job)
+    finally:
+        shutil.rmtree(work_dir)
+    # the loaded file is a copy, other values are shared
+    assert_equal(prepared.job.inputs['f'].contents, 'hello')
+    assert_is(inputs['f'].contents, None)
+    assert_is(prepared.job.inputs['ys'], inputs['ys'])
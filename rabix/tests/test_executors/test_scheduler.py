@@ -0,0 +1,186 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from nose.tools import assert_equal, assert_true
+
+import rabix.cli
+import rabix.common.models
+import rabix.workflows
+
+from rabix.common.context import Context
+from rabix.common.models import Process, InputParameter, OutputParameter, \
+    Job, process_builder
+from rabix.executor import Executor
+from rabix.resources import ResourceManager
+
+
+class SleepTool(Process):
+    """
+    Passes its input through after a short sleep that depends on the
+    input, recording how many instances were running at the same time.
+    """
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+    spans = {}
+
+    def run(self, job):
+        start = time.time()
+        with SleepTool.lock:
+            SleepTool.running += 1
+            SleepTool.max_running = max(SleepTool.max_running,
+                                        SleepTool.running)
+        time.sleep(0.05 * (1 + job.inputs['inp'] % 4))
+        with SleepTool.lock:
+            SleepTool.running -= 1
+            SleepTool.spans[(self.id, job.inputs['inp'])] = \
+                (start, time.time())
+        return {'out': job.inputs['inp']}
+
+    @classmethod
+    def reset(cls):
+        cls.running = 0
+        cls.max_running = 0
+        cls.spans = {}
+
+    @classmethod
+    def from_dict(cls, context, d):
+        converted = {k: context.from_dict(v) for k, v in d.items()}
+        kwargs = Process.kwarg_dict(converted)
+        kwargs.update({
+            'inputs': [InputParameter.from_dict(context, inp)
+                       for inp in converted.get('inputs', [])],
+            'outputs': [OutputParameter.from_dict(context, inp)
+                        for inp in converted.get('outputs', [])]
+        })
+        return cls(**kwargs)
+
+
+def sleep_tool(tool_id, requirements=None):
+    return {
+        'id': tool_id,
+        'class': 'SleepTool',
+        'inputs': [{'id': 'inp', 'type': 'int'}],
+        'outputs': [{'id': 'out', 'type': 'int'}],
+        'requirements': requirements or []
+    }
+
+
+def step(step_id, source, requirements=None):
+    return {
+        'id': step_id,
+        'run': sleep_tool(step_id + '_tool', requirements),
+        'inputs': [{'id': step_id + '.inp', 'source': source}],
+        'outputs': [{'id': step_id + '.out'}]
+    }
+
+
+def make_context(max_workers, resources=None):
+    resources = resources or ResourceManager(cpu=16, mem=16 * 1024)
+    context = Context(Executor(max_workers=max_workers, resources=resources))
+    rabix.common.models.init(context)
+    rabix.cli.init(context)
+    rabix.workflows.init(context)
+    context.add_type('SleepTool', SleepTool.from_dict)
+    return context
+
+
+def branching_workflow():
+    return {
+        'id': 'branches',
+        'class': 'Workflow',
+        'inputs': [{'id': 'x', 'type': 'int'}],
+        'outputs': [
+            {'id': 'left_out', 'type': 'int', 'source': 'left.out'},
+            {'id': 'right_out', 'type': 'int', 'source': 'right.out'},
+            {'id': 'joined_out', 'type': 'int', 'source': 'joined.out'},
+        ],
+        'steps': [
+            step('left', 'x'),
+            step('right', 'x'),
+            step('joined', 'left.out'),
+        ]
+    }
+
+
+def execute_in_tmp_dir(context, app, inputs, callback=None):
+    work_dir = tempfile.mkdtemp()
+    try:
+        job = Job(os.path.join(work_dir, 'wf_test'), app, inputs, {}, context)
+        if callback:
+            return context.executor.execute(job, callback, 'cb')
+        return context.executor.execute_async(job).result()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def run_workflow(doc, inputs, max_workers, max_in_flight=None,
+                 resources=None):
+    SleepTool.reset()
+    context = make_context(max_workers, resources)
+    context.executor.max_in_flight = max_in_flight or max_workers
+    app = process_builder(context, doc)
+    return execute_in_tmp_dir(context, app, inputs)
+
+
+def test_independent_branches_overlap():
+    result = run_workflow(branching_workflow(), {'x': 3}, max_workers=4)
+    assert_equal(result, {'left_out': 3, 'right_out': 3, 'joined_out': 3})
+    assert_equal(SleepTool.max_running, 2)
+
+
+def test_single_worker_is_serial():
+    result = run_workflow(branching_workflow(), {'x': 5}, max_workers=1)
+    assert_equal(result, {'left_out': 5, 'right_out': 5, 'joined_out': 5})
+    assert_equal(SleepTool.max_running, 1)
+
+
+def test_callback():
+    results = []
+    context = make_context(2)
+    app = process_builder(context, branching_workflow())
+    execute_in_tmp_dir(context, app, {'x': 1},
+                       lambda id, res: results.append((id, res)))
+    assert_true(results)
+    assert_equal(results[0],
+                 ('cb', {'left_out': 1, 'right_out': 1, 'joined_out': 1}))
+
+
+def test_scatter_runs_in_parallel():
+    inputs = {'x': [7, 6, 5, 4, 3, 2, 1, 0]}
+    result = run_workflow(branching_workflow(), inputs, max_workers=4)
+    assert_equal(result['joined_out'], inputs['x'])
+    assert_equal(SleepTool.max_running, 4)
+
+
+def test_scatter_max_in_flight():
+    inputs = {'x': [3, 2, 1, 0]}
+    result = run_workflow(branching_workflow(), inputs, max_workers=4,
+                          max_in_flight=1)
+    assert_equal(result['left_out'], inputs['x'])
+    assert_equal(SleepTool.max_running, 2)
+
+
+def test_scatter_shards_pipelined():
+    doc = {
+        'id': 'chain',
+        'class': 'Workflow',
+        'inputs': [{'id': 'xs', 'type': {'type': 'array', 'items': 'int'}}],
+        'outputs': [{'id': 'chain_out', 'type': {'type': 'array',
+                                                 'items': 'int'},
+                     'source': 'second.out'}],
+        'steps': [step('first', 'xs'), step('second', 'first.out')]
+    }
+    inputs = {'xs': [3, 0, 0, 0]}
+    result = run_workflow(doc, inputs, max_workers=4)
+    assert_equal(result['chain_out'], inputs['xs'])
+    spans = {(app_id.lstrip('#'), inp): span
+             for (app_id, inp), span in SleepTool.spans.items()}
+    # shards of 'second' don't wait for the slowest shard of 'first'
+    slow_first_end = spans[('first_tool', 3)][1]
+    fast_second_start = spans[('second_tool', 0)][0]
+    assert_true(fast_second_start < slow_first_end)
@@ -0,0 +1,54 @@
+import time
+
+from nose.tools import assert_equal
+
+from rabix.common.models import Job, process_builder
+from rabix.history import History
+from rabix.resources import ResourceManager
+from rabix.scheduling import CriticalPathPolicy
+from rabix.tests.test_executors.test_scheduler import SleepTool, \
+    make_context, step, execute_in_tmp_dir
+
+
+def chains_workflow():
+    """
+    Chains of length 1, 2 and 3, declared shortest first.
+    """
+    steps = [step('c1', 'x'),
+             step('b1', 'x'), step('b2', 'b1.out'),
+             step('a1', 'x'), step('a2', 'a1.out'), step('a3', 'a2.out')]
+    return {
+        'id': 'chains',
+        'class': 'Workflow',
+        'inputs': [{'id': 'x', 'type': 'int'}],
+        'outputs': [{'id': 'a_out', 'type': 'int', 'source': 'a3.out'},
+                    {'id': 'b_out', 'type': 'int', 'source': 'b2.out'},
+                    {'id': 'c_out', 'type': 'int', 'source': 'c1.out'}],
+        'steps': steps
+    }
+
+
+def test_critical_path_lengths():
+    context = make_context(1)
+    wf = process_builder(context, chains_workflow())
+    history = History(':memory:')
+    b1 = wf.step_graph.nodes[wf.step_graph.index['b1']].app
+    history.record(Job('b1', b1, {'inp': 0}, {}, context), time.time() - 10,
+                   {'exit_status': 0})
+    paths = CriticalPathPolicy(history).paths(wf)
+    assert_equal({k: round(v) for k, v in paths.items()},
+                  {'a1': 3, 'a2': 2, 'a3': 1, 'b1': 11, 'b2': 1, 'c1': 1})
+
+
+def test_longest_chain_starts_first():
+    SleepTool.reset()
+    context = make_context(1, ResourceManager(cpu=1, mem=1024))
+    context.executor.policy = CriticalPathPolicy(History(':memory:'))
+    app = process_builder(context, chains_workflow())
+    result = execute_in_tmp_dir(context, app, {'x': 0})
+    assert_equal(result, {'a_out': 0, 'b_out': 0, 'c_out': 0})
+
+    starts = {app_id.lstrip('#'): span[0]
+              for (app_id, _), span in SleepTool.spans.items()}
+    heads = sorted(['a1_tool', 'b1_tool', 'c1_tool'], key=starts.get)
+    assert_equal(heads, ['a1_tool', 'b1_tool', 'c1_tool'])
@@ -0,0 +1,65 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from nose.tools import assert_equal, assert_true
+
+from rabix.workdirs import WorkDirs, shard_dir, MARKER
+
+
+def test_shard_dir():
+    assert_equal(shard_dir('wf/step', 7, 10), 'wf/step_7')
+    assert_equal(shard_dir('wf/step', 2345, 5000, fanout=1000),
+                 'wf/step/2/step_2345')
+
+
+def test_allocate_concurrently():
+    root = tempfile.mkdtemp()
+    try:
+        work_dirs = WorkDirs(root)
+        allocated = []
+
+        def allocate():
+            for _ in range(20):
+                allocated.append(work_dirs.allocate('tool'))
+
+        threads = [threading.Thread(target=allocate) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_equal(len(set(allocated)), 100)
+        assert_true(all(os.path.isdir(p) for p in allocated))
+        assert_equal(len(os.listdir(root)), 1)
+        day = os.path.join(root, os.listdir(root)[0])
+        assert_true(os.path.exists(os.path.join(day, MARKER)))
+    finally:
+        shutil.rmtree(root)
+
+
+def test_cleanup():
+    root = tempfile.mkdtemp()
+    try:
+        for name in ('2026-01-01', '2026-01-09', '2026-01-10', 'other'):
+            os.mkdir(os.path.join(root, name))
+            open(os.path.join(root, name, MARKER), 'w').close()
+        # not created by rabix
+        os.mkdir(os.path.join(root, '2025-12-31'))
+        now = time.mktime((2026, 1, 10, 12, 0, 0, 0, 0, -1))
+        WorkDirs(root, retain_days=1).cleanup(now)
+        assert_equal(sorted(os.listdir(root)),
+                     ['2025-12-31', '2026-01-09', '2026-01-10', 'other'])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_allocate_dry_run():
+    root = tempfile.mkdtemp()
+    try:
+        path = WorkDirs(root, create=False).allocate('tool')
+        assert_true(path.startswith(root))
+        assert_equal(os.listdir(root), [])
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,46 @@
+from nose.tools import assert_equal
+
+from rabix.expressions.dependencies import references, prune, narrow
+
+JOB = {
+    'app': {'id': 'tool'},
+    'inputs': {'reads': {'path': '/r.fq', 'size': 3, 'metadata': {'s': 1}},
+               'bams': [{'path': '/a.bam'}], 'name': 'abc'},
+    'allocatedResources': {'cpu': 2}
+}
+
+
+def test_references():
+    assert_equal(references('$job.inputs.reads.path + $job["inputs"].name',
+                            '$job'),
+                 [('inputs', 'reads', 'path'), ('inputs', 'name')])
+    assert_equal(references('$job.inputs.name.toUpperCase()', '$job'),
+                 [('inputs', 'name')])
+    assert_equal(references('$job.inputs[k] + $job . inputs', '$job'),
+                 [('inputs',), ('inputs',)])
+    assert_equal(references('f($job) + my$job.x + $jobs', '$job'), [()])
+    assert_equal(references('$self.path', '$job'), [])
+
+
+def test_prune():
+    assert_equal(prune(JOB, [('inputs', 'reads', 'path'),
+                             ('allocatedResources',)]),
+                 {'inputs': {'reads': {'path': '/r.fq'}},
+                  'allocatedResources': {'cpu': 2}})
+    # a whole value wins over paths into it, in any order
+    for paths in ([('inputs', 'reads', 'path'), ('inputs', 'reads')],
+                  [('inputs', 'reads'), ('inputs', 'reads', 'path')]):
+        assert_equal(prune(JOB, paths),
+                     {'inputs': {'reads': JOB['inputs']['reads']}})
+    assert_equal(prune(JOB, [('inputs', 'bams', '0', 'path')]),
+                 {'inputs': {'bams': JOB['inputs']['bams']}})
+    assert_equal(prune(JOB, [('inputs', 'missing')]), {'inputs': {}})
+    assert_equal(prune(JOB, [()]), JOB)
+    assert_equal(prune(JOB, []), {})
+
+
+def test_narrow():
+    job, context = narrow('$job.inputs.name + $self.path', JOB,
+                          {'path': '/x', 'size': 1})
+    assert_equal((job, context),
+                 ({'inputs': {'name': 'abc'}}, {'path': '/x'}))
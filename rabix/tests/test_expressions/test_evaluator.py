@@ -0,0 +1,95 @@
+from nose.tools import assert_equal, assert_raises
+
+import rabix.expressions.evaluator
+
+from rabix.common.errors import RabixError
+from rabix.expressions.evaluator import Evaluator, ExpressionEngine
+
+
+def make_evaluator(calls, memo_size=2):
+    def evaluate(expression, job, context, engine_config, outdir, tmpdir):
+        calls.append(expression)
+        if expression == 'fail':
+            raise RabixError('failed')
+        return {'value': [expression, job['inputs']['x'], context]}
+
+    engine = ExpressionEngine(None, {'fake'}, evaluate, [])
+    return Evaluator(engines=[engine], memo_size=memo_size)
+
+
+def test_memo():
+    calls = []
+    evaluator = make_evaluator(calls)
+    job = {'inputs': {'x': 1}}
+
+    first = evaluator.evaluate('fake', 'a', job)
+    first['value'].append('changed')
+    assert_equal(evaluator.evaluate('fake', 'a', {'inputs': {'x': 1}}),
+                 {'value': ['a', 1, None]})
+    assert_equal(calls, ['a'])
+
+    evaluator.evaluate('fake', 'a', job, {'path': 'b'})
+    evaluator.evaluate('fake', 'a', {'inputs': {'x': 2}})
+    assert_equal(calls, ['a', 'a', 'a'])
+
+    # least recently used result dropped
+    evaluator.evaluate('fake', 'a', job)
+    assert_equal(len(calls), 4)
+
+    assert_raises(RabixError, evaluator.evaluate, 'fake', 'fail', job)
+    assert_raises(RabixError, evaluator.evaluate, 'fake', 'fail', job)
+    assert_equal(calls[-2:], ['fail', 'fail'])
+    assert_equal(evaluator.memo.info(), {'hits': 1, 'misses': 6, 'size': 2})
+
+
+def test_memo_disabled():
+    calls = []
+    evaluator = make_evaluator(calls, memo_size=0)
+    for _ in range(2):
+        evaluator.evaluate('fake', 'a', {'inputs': {'x': 1}})
+    assert_equal(len(calls), 2)
+
+
+def test_memo_keyed_by_references():
+    from rabix.expressions.dependencies import narrow
+    calls = []
+    evaluator = make_evaluator(calls)
+    evaluator.engines[0].narrow = \
+        lambda script, job, context, config: narrow(script, job, context)
+    for shard in range(3):
+        evaluator.evaluate('fake', '$job.inputs.x',
+                           {'inputs': {'x': 1, 'shard': shard}})
+    assert_equal(calls, ['$job.inputs.x'])
+
+
+def test_memo_skips_nondeterministic():
+    calls = []
+    evaluator = make_evaluator(calls)
+    for script in ('new Date().getTime()', 'Math.random()'):
+        for _ in range(2):
+            evaluator.evaluate('fake', script, {'inputs': {'x': 1}})
+    assert_equal(len(calls), 4)
+    assert_equal(evaluator.memo.info()['size'], 0)
+
+
+def test_job_digested_once():
+    digest = rabix.expressions.evaluator.payload_digest
+    digested = []
+
+    def counting_digest(payload):
+        digested.append(payload)
+        return digest(payload)
+
+    calls = []
+    evaluator = make_evaluator(calls, memo_size=10)
+    jobs = [{'inputs': {'x': i}} for i in range(3)]
+    rabix.expressions.evaluator.payload_digest = counting_digest
+    try:
+        # jobs evaluated concurrently interleave their expressions
+        for script in 'abc':
+            for job in jobs:
+                evaluator.evaluate('fake', script, job)
+    finally:
+        rabix.expressions.evaluator.payload_digest = digest
+    assert_equal(len(calls), 9)
+    assert_equal(sum(1 for p in digested if p in jobs), 3)
@@ -0,0 +1,40 @@
+from nose.tools import assert_equal, assert_is_none
+
+from rabix.expressions.native import compile_expression, evaluate_native
+
+JOB = {
+    'inputs': {'reads': {'class': 'File', 'path': '/data/r.fq', 'size': 10},
+               'n': 3, 'name': 'abc', 'arr': [1, 2.0, 'x'], 'flag': True},
+    'allocatedResources': {'cpu': 4, 'mem': 1024}
+}
+
+
+def check(script, expected, context=None):
+    native, result = evaluate_native(script, JOB, context)
+    assert_equal((native, result, type(result)),
+                 (True, expected, type(expected)))
+
+
+def test_evaluate_native():
+    check('$job.inputs.reads.path', '/data/r.fq')
+    check("$job['inputs']['name'] + '.txt'", 'abc.txt')
+    check('"out_" + $job.inputs.n + "_" + $job.inputs.flag', 'out_3_true')
+    check('$job.allocatedResources.mem / 4', 256)
+    check('$job.allocatedResources.mem / 3', 1024 / 3.0)
+    check('-$job.inputs.n % 2 + 2 * (1 + 1)', 3)
+    check('{ return $self.size + 1; }', 3, {'size': 2})
+    check('$job.inputs.arr', [1, 2, 'x'])
+    check('$job.inputs.arr.length + $job.inputs.name[1]', '3b')
+    check('$job.inputs.missing', None)
+
+
+def test_not_native():
+    for script in ['Math.max(1, 2)', '$job.inputs.name.toUpperCase()',
+                   '{var a = 1; return a;}', ' {return 1;}', '010',
+                   '$job.inputs.n // comment']:
+        assert_is_none(compile_expression(script))
+    # compiled, but JavaScript converts or fails differently
+    for script in ['$job.inputs.missing + 1', '$job.inputs.arr + "x"',
+                   '$job.inputs.n / 0', '"a" + 1e-7', '$job.inputs.name - 1',
+                   '$job.inputs.missing.path']:
+        assert_equal(evaluate_native(script, JOB, None), (False, None))
@@ -0,0 +1,89 @@
+from unittest import SkipTest
+
+from nose.tools import assert_equal, assert_raises
+
+from rabix.expressions.evaluator import evaluate_rabix_js, evaluate_cwl_js
+from rabix.expressions.node_pool import NodePool, ExpressionError, \
+    ExpressionTimeout, find_node
+
+if not find_node():
+    raise SkipTest('expression workers need Node.js')
+
+
+def test_evaluate():
+    job = {'inputs': {'x': 2}, 'allocatedResources': {'cpu': 1}}
+    # outside what evaluates natively
+    assert_equal(evaluate_rabix_js('Math.max($job.inputs.x, 3)', job), 3)
+    assert_equal(evaluate_rabix_js('{var y = $self.y; return y;}', job,
+                                   {'y': 'a'}), 'a')
+    assert_equal(evaluate_cwl_js('$job.x * k', job, None, ['var k = 3;']),
+                 6)
+    # the rabix engine has node globals, as with execjs
+    assert_equal(evaluate_rabix_js("require('path').basename('/a/b')", job),
+                 'b')
+    assert_equal(evaluate_cwl_js("typeof require", job), 'undefined')
+
+
+def test_workers_reused_and_restarted():
+    pool = NodePool(size=1, timeout=0.5)
+    try:
+        assert_equal(pool.evaluate('1 + 1', {}), 2)
+        worker = pool.idle[0]
+        assert_raises(ExpressionError, pool.evaluate, 'missing.x', {})
+        assert_equal(pool.idle, [worker])
+
+        assert_raises(ExpressionTimeout, pool.evaluate,
+                      '{while (true) {}}', {})
+        assert_equal((pool.started, pool.idle), (0, []))
+
+        assert_equal(pool.evaluate('2 + 2', {}), 4)
+        worker = pool.idle[0]
+        worker.process.kill()
+        worker.process.wait()
+        assert_equal(pool.evaluate('3 + 3', {}), 6)
+        assert_equal(pool.started, 1)
+    finally:
+        pool.close()
+
+
+def test_batch_scopes_isolated():
+    pool = NodePool(size=1)
+    try:
+        results = pool.evaluate_batch(
+            [('{leaked = 1; counter += 1; Math = null; return counter;}',
+              None),
+             ('typeof leaked', None),
+             ('{counter += 1; return Math.max(counter, 0);}', None)],
+            {}, ['var counter = 0;'])
+        assert_equal(results, [1, 'undefined', 1])
+    finally:
+        pool.close()
+
+
+def test_partial_line_times_out():
+    pool = NodePool(size=1, timeout=0.5)
+    try:
+        assert_raises(ExpressionTimeout, pool.evaluate,
+                      '{process.stdout.write(\'{"result"\'); while (true) {}}',
+                      {}, node_globals=True)
+        assert_equal(pool.started, 0)
+    finally:
+        pool.close()
+
+
+def test_scope_reused_across_requests():
+    pool = NodePool(size=1)
+    try:
+        config = ['var counter = 0;']
+        for x in range(3):
+            assert_equal(pool.evaluate('{leaked = $job.x; counter += 1;'
+                                       ' return counter + $job.x;}',
+                                       {'x': x}, None, config), 1 + x)
+            assert_equal(pool.evaluate('typeof leaked', {}, None, config),
+                         'undefined')
+        assert_equal(pool.evaluate('typeof counter', {}), 'undefined')
+        assert_equal(pool.evaluate('typeof require', {}), 'undefined')
+        assert_equal(pool.evaluate('typeof require', {}, node_globals=True),
+                     'function')
+    finally:
+        pool.close()
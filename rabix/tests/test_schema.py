@@ -3,7 +3,8 @@ import six
 
 from nose.tools import *
 
-from rabix.common.models import make_avro
+from rabix.common.models import make_avro, compile_schema, validate, \
+    File, InputParameter, AVRO_IGNORES_EXTRA_FIELDS
 
 
 def test_simple_avro_schema():
@@ -25,5 +26,76 @@ def test_simple_avro_schema():
         assert_equal(to_dict[k], v)
 
 
+def test_make_avro_cached():
+    region = {'type': 'record', 'name': 'Region',
+              'fields': [{'name': 'start', 'type': 'int'}]}
+    wide = {'type': 'record', 'name': 'Region',
+            'fields': [{'name': 'start', 'type': 'long'}]}
+    schema = {'type': 'array', 'items': 'Region'}
+
+    first = make_avro(schema, [region])
+    assert_is(make_avro(dict(schema), [dict(region)]), first)
+    other = make_avro(schema, [wide])
+    assert_is_not(other, first)
+    assert_equal(other.schemas[0].items.fields[0].type.type, 'long')
+
+
+def test_compiled_schema_matches_avro():
+    region = {'type': 'record', 'name': 'Region',
+              'fields': [{'name': 'start', 'type': 'int'},
+                         {'name': 'tags', 'type': {'type': 'map',
+                                                   'values': 'string'}}]}
+    schema = make_avro({'type': 'array',
+                        'items': ['null', 'File', 'Region', 'int']},
+                       [region]).schemas[0]
+    values = [
+        [], [None, 1, 2], [True], [2 ** 40], ['a'], [{'path': 'a'}],
+        [{'path': 'a', 'secondaryFiles': [{'path': 'b'}]}],
+        [{'path': 'a', 'secondaryFiles': [{'size': 1}]}],
+        [{'path': 'a', 'class': 'File'}],
+        [{'start': 1, 'tags': {}}, {'start': 1, 'tags': {'a': 1}}],
+        [{'start': 1, 'tags': {}, 'class': 'Region'}],
+        None, {'path': 'a'}
+    ]
+    compiled = compile_schema(schema)
+    for value in values:
+        assert_equal(compiled.validate(value), validate(schema, value))
+
+
+def test_compiled_schema_constructs_files():
+    schema = make_avro({'type': 'array', 'items': ['null', 'File', 'string']},
+                       []).schemas[0]
+    constructed = compile_schema(schema).construct(
+        [{'path': 'a', 'secondaryFiles': [{'path': 'b'}]}, 'c', None])
+    assert_is_instance(constructed[0], File)
+    assert_equal(constructed[0].secondary_files[0].path, 'b')
+    assert_equal(constructed[1:], ['c', None])
+
+    homogeneous = compile_schema(schema).construct(
+        [{'path': 'a'}, {'path': 'b'}, {'path': 'c', 'class': 'File'}])
+    assert_equal([f.path for f in homogeneous[:2]], ['a', 'b'])
+    # a File only if avro takes it for one
+    assert_equal(isinstance(homogeneous[2], File), AVRO_IGNORES_EXTRA_FIELDS)
+
+
+def test_parameter_validate():
+    param = InputParameter.from_dict(None, {
+        'id': 'bams',
+        'type': make_avro([{'type': 'array', 'items': 'File'}, 'null'], [])})
+    assert_true(param.validate(None))
+    assert_true(param.validate([{'path': 'a'}]))
+    assert_false(param.validate({'path': 'a'}))
+    assert_false(param.validate([{'size': 1}]))
+
+
 if __name__ == '__main__':
     nose.run()
+
+
+def test_record_with_class():
+    schema = make_avro({'type': 'array', 'items': ['null', 'File']},
+                       []).schemas[0]
+    value = [{'path': 'a', 'class': 'File'}]
+    compiled = compile_schema(schema)
+    assert_equal(compiled.validate(value), validate(schema, value))
+    assert_equal(compiled.validate(value), AVRO_IGNORES_EXTRA_FIELDS)
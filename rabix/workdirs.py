@@ -0,0 +1,109 @@
+import os
+import re
+import time
+import errno
+import shutil
+import logging
+import datetime
+
+import six
+
+log = logging.getLogger(__name__)
+
+# most shard work dirs a single directory holds
+SHARD_FANOUT = 1000
+
+DAY_FORMAT = '%Y-%m-%d'
+DAY_DIR = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# marks day dirs created by WorkDirs, the only ones cleanup() removes
+MARKER = '.rabix-workdirs'
+
+
+def shard_dir(job_id, index, count, fanout=None):
+    """
+    Work dir of shard index out of count shards of job_id. Shards of small
+    scatters go next to the job's work dir, shards of large ones into
+    groups of fanout (default SHARD_FANOUT) inside it.
+    """
+    fanout = fanout or SHARD_FANOUT
+    name = '%s_%s' % (job_id, index)
+    if count <= fanout:
+        return name
+    return os.path.join(six.text_type(job_id),
+                        six.text_type(index // fanout),
+                        os.path.basename(name))
+
+
+def make_dirs(path):
+    """
+    Create path and its missing parents, if it doesn't exist already.
+    Safe against others creating them at the same time.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class WorkDirs(object):
+    """
+    Allocates work dirs for jobs that weren't given one, as
+    <root>/<day>/<name>_<time>. Dirs are created on allocation, so
+    concurrent allocations, in this process or another one, never get
+    the same dir. Without create, dirs are only named, for dry runs.
+
+    With retain_days, cleanup() removes day dirs older than that. Only
+    day dirs created by WorkDirs are removed, they hold a MARKER file.
+    """
+
+    def __init__(self, root='.', retain_days=None, create=True):
+        self.root = root
+        self.retain_days = retain_days
+        self.create = create
+
+    def allocate(self, name):
+        now = datetime.datetime.now()
+        parent = os.path.join(self.root, now.strftime(DAY_FORMAT))
+        base = os.path.join(parent, '_'.join([name, now.strftime('%H%M%S')]))
+        if not self.create:
+            return base
+
+        try:
+            os.makedirs(parent)
+            # day dirs that existed before aren't ours to remove
+            open(os.path.join(parent, MARKER), 'a').close()
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        path = base
+        num = 0
+        while True:
+            try:
+                os.mkdir(path)
+                return path
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            path = '_'.join([base, six.text_type(num)])
+            num += 1
+
+    def cleanup(self, now=None):
+        if self.retain_days is None or not os.path.isdir(self.root):
+            return
+        now = now or time.time()
+        cutoff = datetime.date.fromtimestamp(now) - datetime.timedelta(
+            days=self.retain_days)
+        for name in os.listdir(self.root):
+            if not DAY_DIR.match(name):
+                continue
+            try:
+                day = datetime.datetime.strptime(name, DAY_FORMAT).date()
+            except ValueError:
+                continue
+            path = os.path.join(self.root, name)
+            if day < cutoff and os.path.exists(os.path.join(path, MARKER)):
+                log.info('Removing work dirs from %s', name)
+                shutil.rmtree(path, ignore_errors=True)
@@ -1,11 +1,18 @@
+import os
 import six
 import logging
 
 from copy import deepcopy
-from collections import namedtuple, defaultdict
+from functools import partial
+from collections import namedtuple, defaultdict, deque
+from six.moves import queue
 from altgraph.Graph import Graph
 
 from rabix.common.errors import ValidationError, RabixError
+from rabix.gc import OutputRefs
+from rabix.journal import Journal, run_digest
+from rabix.workdirs import shard_dir
+from rabix.scatter import Scatter, SCATTER_METHODS
 from rabix.common.util import wrap_in_list
 from rabix.common.models import (
     Process, Parameter, Job, InputParameter, OutputParameter,
@@ -14,7 +21,8 @@ from rabix.common.models import (
 
 log = logging.getLogger(__name__)
 
-AppNode = namedtuple('AppNode', ['app', 'inputs'])
+AppNode = namedtuple('AppNode', ['app', 'inputs', 'scatter',
+                                 'scatter_method', 'scatter_chunk_size'])
 
 Relation = namedtuple('Relation', ['source', 'destination', 'position'])
 InputRelation = namedtuple('InputRelation', ['destination', 'position'])
@@ -23,8 +31,70 @@ OutputRelation = namedtuple('OutputRelation', ['source', 'position'])
 Relation.to_dict = Relation._asdict
 
 
+class StepGraph(object):
+    """
+    Compact view of dependencies between workflow steps, built once per
+    workflow. Steps are numbered in the order they are declared and all
+    per-step data is kept in lists indexed by that number:
+
+    links[i]: (consumer index, output port, input port) for step outputs
+    feeding other steps
+    inputs[i]: (workflow input, input port) for workflow inputs of step
+    outputs[i]: (output port, workflow output) for workflow outputs
+    input_counts[i]: number of incoming links per input port
+
+    order holds step numbers sorted topologically.
+    """
+
+    def __init__(self, nodes, relations):
+        """
+        nodes is a list of (step id, AppNode) and relations a list of
+        (source, destination, relation) as added to the workflow graph.
+        """
+        self.ids = [node_id for node_id, _ in nodes]
+        self.nodes = [node for _, node in nodes]
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+        self.links = [[] for _ in nodes]
+        self.inputs = [[] for _ in nodes]
+        self.outputs = [[] for _ in nodes]
+        self.input_counts = [defaultdict(int) for _ in nodes]
+        indegree = [0] * len(nodes)
+
+        index = self.index
+        for src, dst, rel in relations:
+            if isinstance(rel, Relation):
+                dst_index = index[dst]
+                self.links[index[src]].append(
+                    (dst_index, rel.source, rel.destination))
+                self.input_counts[dst_index][rel.destination] += 1
+                indegree[dst_index] += 1
+            elif isinstance(rel, InputRelation):
+                dst_index = index[dst]
+                self.inputs[dst_index].append((src, rel.destination))
+                self.input_counts[dst_index][rel.destination] += 1
+            elif isinstance(rel, OutputRelation):
+                self.outputs[index[src]].append((rel.source, dst))
+
+        # Kahn's algorithm, steps without dependencies keep their order
+        self.order = [i for i, d in enumerate(indegree) if d == 0]
+        for i in self.order:
+            for dst_index, _, _ in self.links[i]:
+                indegree[dst_index] -= 1
+                if indegree[dst_index] == 0:
+                    self.order.append(dst_index)
+        if len(self.order) < len(nodes):
+            cyclic = [self.ids[i] for i, d in enumerate(indegree) if d > 0]
+            raise ValidationError(
+                'Workflow steps form a cycle: %s' % ', '.join(cyclic))
+
+    def __len__(self):
+        return len(self.ids)
+
+
 class WorkflowStepInput(InputParameter):
 
+    __slots__ = ('source', 'value')
+
     def __init__(self, id, validator=None, required=False, label=None,
                  description=None, depth=0, input_binding=None, source=None,
                  value=None):
@@ -54,7 +124,8 @@ class Step(Process):
 
     def __init__(
             self, process_id, inputs, outputs, requirements, hints,
-            label, description, app, scatter
+            label, description, app, scatter=None, scatter_method=None,
+            scatter_chunk_size=None
     ):
         super(Step, self).__init__(
             process_id, inputs, outputs,
@@ -64,11 +135,29 @@ class Step(Process):
             description=description
         )
         self.app = app
-        self.scatter = scatter
+        self.scatter = wrap_in_list(scatter) if scatter else []
+        self.scatter_method = scatter_method
+        if scatter_method and scatter_method not in SCATTER_METHODS:
+            raise ValidationError(
+                "Step %s: unknown scatter method '%s'" %
+                (process_id, scatter_method))
+        self.scatter_chunk_size = scatter_chunk_size
+        if scatter_chunk_size is not None and (
+                not isinstance(scatter_chunk_size, six.integer_types) or
+                scatter_chunk_size < 1):
+            raise ValidationError(
+                "Step %s: scatter chunk size must be a positive integer" %
+                process_id)
 
     def to_dict(self, context):
         d = super(Step, self).to_dict(context)
         d['run'] = context.to_primitive(self.app)
+        if self.scatter:
+            d['scatter'] = self.scatter
+        if self.scatter_method:
+            d['scatterMethod'] = self.scatter_method
+        if self.scatter_chunk_size:
+            d['scatterChunkSize'] = self.scatter_chunk_size
         return d
 
     def run(self, job):
@@ -104,13 +193,17 @@ class Step(Process):
                        for inp in converted.get('inputs', [])],
             'outputs': [OutputParameter.from_dict(context, inp)
                         for inp in converted.get('outputs', [])],
-            'scatter': converted.get('scatter')
+            'scatter': converted.get('scatter'),
+            'scatter_method': converted.get('scatterMethod'),
+            'scatter_chunk_size': converted.get('scatterChunkSize')
         })
         return cls(**kwargs)
 
 
 class WorkflowOutput(OutputParameter):
 
+    __slots__ = ('source',)
+
     def __init__(self, id, validator=None, required=False, label=None,
                  description=None, depth=0, output_binding=None, source=None):
         super(WorkflowOutput, self).__init__(
@@ -145,10 +238,14 @@ class Workflow(Process):
         self.data_links = data_links or []
         self.context = context
         self.port_step_index = {}
+        nodes = []
+        relations = []
 
         for step in steps:
-            node = AppNode(step.app, {})
+            node = AppNode(step.app, {}, step.scatter, step.scatter_method,
+                           step.scatter_chunk_size)
             self.add_node(step.id, node)
+            nodes.append((step.id, node))
             for inp in step.inputs:
                 self.port_step_index[inp.id] = step.id
                 self.move_connect_to_datalink(inp)
@@ -187,10 +284,9 @@ class Workflow(Process):
                 raise RabixError("invalid data link %s" % dl)
 
             self.graph.add_edge(src, dst, rel)
+            relations.append((src, dst, rel))
 
-        if not self.graph.connected():
-            pass
-            # raise ValidationError('Graph is not connected')
+        self.step_graph = StepGraph(nodes, relations)
 
     def move_connect_to_datalink(self, port):
         for src in port.source:
@@ -204,11 +300,7 @@ class Workflow(Process):
         self.graph.add_node(node_id, node)
 
     def run(self, job):
-        eg = ExecutionGraph(self, job)
-        while eg.has_next():
-            next_id, next = eg.next_job()
-            self.executor.execute(next, eg.job_done, next_id)
-        return eg.outputs
+        return WorkflowRun(self, job).run()
 
     def to_dict(self, context):
         d = super(Workflow, self).to_dict(context)
@@ -266,30 +358,38 @@ def init(context):
 
 class PartialJob(object):
 
-    def __init__(self, node_id, app, inputs, input_counts, outputs, context):
+    __slots__ = ('result', 'status', 'node_id', 'app', 'inputs',
+                 'input_counts', 'waiting', 'outputs', 'context', 'scatter',
+                 'scatter_method', 'scatter_chunk_size', 'running',
+                 'resources')
+
+    def __init__(self, node_id, app, inputs, input_counts, outputs, context,
+                 scatter=None, scatter_method=None, scatter_chunk_size=None):
         self.result = None
         self.status = 'WAITING'
         self.node_id = node_id
         self.app = app
         self.inputs = inputs
         self.input_counts = input_counts
+        self.waiting = sum(six.itervalues(input_counts))
         self.outputs = {parameter_name(k): v for k, v in six.iteritems(outputs)}
         self.context = context
+        self.scatter = [parameter_name(s) for s in scatter or []]
+        self.scatter_method = scatter_method
+        self.scatter_chunk_size = scatter_chunk_size
         self.running = []
         self.resources = None
 
     @property
     def resolved(self):
-        for name, cnt in six.iteritems(self.input_counts):
-            if cnt > 0:
-                return False
-        return True
+        return self.waiting == 0
 
     def resolve_input(self, input_port, results):
         input_count = self.input_counts[input_port]
         if input_count <= 0:
             raise RabixError("Input already satisfied")
         self.input_counts[input_port] = input_count - 1
+        self.waiting -= 1
 
         prev_result = self.inputs.get(input_port)
         if prev_result is None:
@@ -300,69 +400,97 @@ class PartialJob(object):
             self.inputs[input_port] = [prev_result, results]
         return self.resolved
 
+    def skip_input(self, input_port):
+        self.input_counts[input_port] -= 1
+        self.waiting -= 1
+
     def propagate_result(self, result):
+        """
+        Pass result on to consumers, returns those that became resolved.
+        """
         self.result = result
+        resolved = []
         for k, v in six.iteritems(result):
-            if self.outputs.get(k):
-                for out in self.outputs[k]:
-                    out.resolve_input(v)
+            for out in self.outputs.get(k) or []:
+                if out.resolve_input(v):
+                    resolved.append(out.node)
+        return resolved
 
-    def job(self):
-        return Job(None, self.app, self.inputs, {}, self.context)
+    def job(self, job_id=None):
+        return Job(job_id, self.app, self.inputs, {}, self.context,
+                   self.scatter, self.scatter_method,
+                   self.scatter_chunk_size)
 
 
 class ExecRelation(object):
 
+    __slots__ = ('node', 'input_port')
+
     def __init__(self, node, input_port):
         self.node = node
         self.input_port = input_port
 
     def resolve_input(self, result):
-        self.node.resolve_input(self.input_port, result)
+        return self.node.resolve_input(self.input_port, result)
 
 
 class OutRelation(object):
 
+    __slots__ = ('graph', 'name')
+
     def __init__(self, graph, name):
         self.name = name
         self.graph = graph
 
     def resolve_input(self, result):
         self.graph.outputs[self.name] = result
+        return False
 
 
 class ExecutionGraph(object):
+    """
+    State of a single workflow run: partial jobs for all steps, wired
+    according to workflow.step_graph, and a queue of steps whose inputs
+    are all resolved.
+    """
 
     def __init__(self, workflow, job):
         self.workflow = workflow
         self.executables = {}
-        self.ready = {}
+        self.ready = deque()
         self.job = job
         self.outputs = {}
 
-        for node_id in workflow.graph.back_topo_sort()[1]:
-            executable = self.make_executable(node_id)
-            if executable:
-                self.executables[node_id] = executable
-
-        self.order = self.calc_order()
-
-    def calc_order(self):
-        params = []
-        for node_id in self.graph.node_list():
-            node = self.graph.node_data(node_id)
-            if isinstance(node, Parameter):
-                params.append(node_id)
-
-        for p in params:
-            self.graph.hide_node(p)
-
-        order = self.graph.back_topo_sort()[1]
-
-        for p in params:
-            self.graph.restore_node(p)
-
-        return order
+        topology = workflow.step_graph
+        executables = [
+            PartialJob(
+                node_id, node.app,
+                deepcopy(node.inputs) if node.inputs else {},
+                defaultdict(int, counts), {}, workflow.context,
+                node.scatter, node.scatter_method, node.scatter_chunk_size
+            )
+            for node_id, node, counts in six.moves.zip(
+                topology.ids, topology.nodes, topology.input_counts)
+        ]
+
+        for i in topology.order:
+            executable = executables[i]
+            for dst, src_port, dst_port in topology.links[i]:
+                self.add_output(executable.outputs, parameter_name(src_port),
+                                ExecRelation(executables[dst], dst_port))
+            for src_port, name in topology.outputs[i]:
+                self.add_output(executable.outputs, parameter_name(src_port),
+                                OutRelation(self, name))
+            for name, dst_port in topology.inputs[i]:
+                if name in job.inputs:
+                    executable.resolve_input(dst_port, job.inputs[name])
+                else:
+                    executable.skip_input(dst_port)
+            if executable.resolved:
+                self.ready.append(executable)
+            self.executables[executable.node_id] = executable
+
+        self.waiting = set(self.executables)
 
     def add_output(self, outputs, port, relation):
         if not outputs.get(port):
@@ -370,68 +498,300 @@ class ExecutionGraph(object):
         else:
             outputs[port].append(relation)
 
-    def make_executable(self, node_id):
-        node = self.graph.node_data(node_id)
-        if isinstance(node, Parameter):
-            return None
-
-        out_edges = self.graph.out_edges(node_id)
-        in_edges = self.graph.inc_edges(node_id)
-
-        outputs = {}
-        input_counts = ExecutionGraph.count_inputs(self.graph, in_edges)
-        for out_edge in out_edges:
-            rel = self.graph.edge_data(out_edge)
-            if isinstance(rel, Relation):
-                tail = self.executables[self.graph.tail(out_edge)]
-                self.add_output(outputs, rel.source, ExecRelation(
-                    tail, rel.destination))
-            elif isinstance(rel, OutputRelation):
-                tail = self.graph.tail(out_edge)
-                self.add_output(outputs, rel.source, OutRelation(
-                    self, tail))
-
-        executable = PartialJob(
-            node_id, node.app, deepcopy(node.inputs),
-            input_counts, outputs, self.workflow.context
-        )
-
-        for in_edge in in_edges:
-            rel = self.graph.edge_data(in_edge)
-            head = self.graph.head(in_edge)
-            if (isinstance(rel, InputRelation) and
-                    head in self.job.inputs):
-                executable.resolve_input(
-                    rel.destination, self.job.inputs[head]
-                )
-
-        return executable
-
-    @staticmethod
-    def count_inputs(graph, in_edges):
-        input_counts = defaultdict(lambda: 0)
-        for edge in in_edges:
-            relation = graph.edge_data(edge)
-            input_count = input_counts[relation.destination]
-            input_counts[relation.destination] = input_count + 1
-        return input_counts
-
     def job_done(self, node_id, results):
         ex = self.executables[node_id]
-        ex.propagate_result(results)
+        ex.status = 'DONE'
+        self.ready.extend(ex.propagate_result(results))
+
+    def ready_jobs(self):
+        """
+        Pop all waiting nodes whose inputs are resolved.
+        """
+        ready = []
+        while self.ready:
+            executable = self.ready.popleft()
+            if executable.node_id not in self.waiting:
+                continue
+            self.waiting.remove(executable.node_id)
+            executable.status = 'READY'
+            ready.append((executable.node_id,
+                          executable.job(self.job_dir(executable.node_id))))
+        return ready
+
+    def unresolved(self):
+        """
+        Waiting nodes, in topological order.
+        """
+        index = self.workflow.step_graph.index
+        return sorted(self.waiting, key=index.get)
+
+    def job_dir(self, node_id):
+        """
+        Steps get work dirs named after them inside the workflow's, so a
+        resumed run finds the same layout.
+        """
+        name = node_id.lstrip('#').replace('/', '_')
+        return os.path.join(six.text_type(self.job.id), name)
+
+    def take(self, node_id):
+        """
+        Remove a waiting node from the schedule, its execution is managed
+        by the caller.
+        """
+        self.waiting.remove(node_id)
+        executable = self.executables[node_id]
+        executable.status = 'STREAMING'
+        return executable
 
-    def next_job(self):
-        if not self.order:
-            return None
-        next = self.order.pop()
-        return next, self.executables[next].job()
+    def pipelinable(self, node_id):
+        """
+        Yield (consumer, output, input port) for waiting steps whose only
+        unresolved input is a single link from output of node_id, and
+        which would scatter over that input and nothing else, one shard
+        at a time.
+        Results of node_id shards must combine into flat lists.
+        """
+        source = self.executables[node_id]
+        depth = self.workflow.executor.depth
+        for port, relations in six.iteritems(source.outputs):
+            out = source.app.get_output(port)
+            for rel in relations:
+                if not isinstance(rel, ExecRelation):
+                    continue
+                consumer = rel.node
+                if (consumer.node_id not in self.waiting or
+                        (consumer.scatter_chunk_size or 1) > 1):
+                    continue
+                counts = consumer.input_counts
+                waiting = {k: c for k, c in six.iteritems(counts) if c > 0}
+                if (waiting != {rel.input_port: 1} or
+                        rel.input_port in consumer.inputs):
+                    continue
+
+                app = consumer.app
+                name = parameter_name(rel.input_port)
+                inp = app.get_input(name)
+                if out is None or inp is None or inp.depth != out.depth:
+                    continue
+                if consumer.scatter:
+                    if consumer.scatter != [name]:
+                        continue
+                else:
+                    resolved = [(app.get_input(parameter_name(k)), v)
+                                for k, v in six.iteritems(consumer.inputs)]
+                    if any(i is None or depth(v) != i.depth
+                           for i, v in resolved):
+                        continue
+                yield consumer.node_id, port, rel.input_port
+
+    def restore(self, state):
+        """
+        Replay steps completed in a previous run of this workflow.
+        """
+        for node_id, results in state.done:
+            if node_id not in self.waiting:
+                continue
+            log.info('Step %s already done, skipping.', node_id)
+            self.waiting.remove(node_id)
+            self.job_done(node_id, results)
 
     def has_next(self):
-        return len(self.order) > 0
+        return len(self.waiting) > 0
+
+
+class Stream(object):
+    """
+    A step scattered over an output of an upstream scatter. Its shards are
+    started one by one as the matching upstream shards finish.
+    """
+
+    def __init__(self, node_id, executable, job_id, source_id, source_port,
+                 input_port, count):
+        self.node_id = node_id
+        self.executable = executable
+        self.source_id = source_id
+        self.job_id = job_id
+        self.source_port = source_port
+        self.input_port = input_port
+        # number of shards of the source, one for each of them
+        self.count = count
+        self.started = set()
+        self.results = {}
+        self.expected = None
+        self.priority = 0
 
     @property
-    def graph(self):
-        return self.workflow.graph
+    def finished(self):
+        return (self.expected is not None and
+                len(self.results) == self.expected)
+
+    def shard_job(self, index, source_result):
+        ex = self.executable
+        inputs = dict(ex.inputs)
+        inputs[self.input_port] = source_result[self.source_port]
+        job = Job(shard_dir(self.job_id, index, self.count), ex.app, inputs,
+                  {}, ex.context)
+        job.priority = self.priority
+        return job
+
+
+class WorkflowRun(object):
+    """
+    Drives a single execution of a workflow. Steps are handed to the
+    executor as soon as their inputs are resolved, and completion events
+    are processed one at a time on the calling thread.
+    """
+
+    def __init__(self, workflow, job):
+        self.workflow = workflow
+        self.job = job
+        self.executor = workflow.executor
+        self.graph = ExecutionGraph(workflow, job)
+        self.journal = Journal(job.id, workflow.context,
+                               self.executor.resume,
+                               run_digest(workflow, job),
+                               self.graph.executables)
+        self.graph.restore(self.journal.state)
+        self.refs = None
+        if self.executor.gc is not None:
+            self.refs = OutputRefs(workflow, job, self.executor.gc)
+            self.refs.restore(self.graph)
+        self.events = queue.Queue()
+        self.running = 0
+        self.shard_counts = defaultdict(int)
+        self.streams = {}
+
+    def run(self):
+        try:
+            while self.graph.has_next() or self.running:
+                ready = self.graph.ready_jobs()
+                if self.executor.policy is not None:
+                    ready.sort(key=lambda r: -self.priority(r[0]))
+                for node_id, job in ready:
+                    self.dispatch(node_id, job)
+
+                if not self.running:
+                    raise RabixError(
+                        "Unable to resolve inputs for steps: %s" %
+                        ', '.join(self.graph.unresolved())
+                    )
+
+                self.handle(*self.events.get())
+        finally:
+            self.journal.close()
+        return self.graph.outputs
+
+    def post(self, event, *args):
+        self.events.put((event,) + args)
+
+    def post_result(self, node_id, index, future):
+        if future.exception():
+            self.post('failed', node_id, future.exception())
+        elif index is None:
+            self.post('done', node_id, future.result())
+        else:
+            self.post('shard', node_id, index, future.result(), True)
+
+    def priority(self, node_id):
+        policy = self.executor.policy
+        base = self.job.priority
+        if policy is None:
+            return base
+        if base:
+            # steps of a nested workflow continue on the path of the step
+            # that runs it
+            base -= policy.runtime(self.workflow)
+        return base + policy.priority(self.workflow, node_id)
+
+    def dispatch(self, node_id, job):
+        self.running += 1
+        job.priority = self.priority(node_id)
+        split = self.executor.split_job(job)
+        if not isinstance(split, Scatter):
+            future = self.executor.execute_async(job)
+        else:
+            done_shards = self.journal.state.shards_for(node_id)
+            for index, result in six.iteritems(done_shards):
+                self.post('shard', node_id, index, result, False)
+            future = self.executor.scatter_async(
+                split,
+                lambda index, result:
+                    self.post('shard', node_id, index, result, True),
+                done_shards
+            )
+            if split.flat:
+                self.pipeline(node_id, len(split))
+        future.add_done_callback(partial(self.post_result, node_id, None))
+
+    def pipeline(self, node_id, count):
+        """
+        Turn steps that would scatter over an output of node_id into
+        streams fed shard by shard, and do the same for their consumers.
+        """
+        for consumer_id, source_port, input_port in \
+                self.graph.pipelinable(node_id):
+            executable = self.graph.take(consumer_id)
+            stream = Stream(consumer_id, executable,
+                            self.graph.job_dir(consumer_id),
+                            node_id, source_port, input_port, count)
+            stream.priority = self.priority(consumer_id)
+            self.streams[consumer_id] = stream
+            self.running += 1
+            log.debug('Step %s pipelined on %s', consumer_id, node_id)
+
+            for index, result in six.iteritems(
+                    self.journal.state.shards_for(consumer_id)):
+                stream.started.add(index)
+                self.post('shard', consumer_id, index, result, False)
+            self.pipeline(consumer_id, count)
+
+    def handle(self, event, node_id, *args):
+        if event == 'failed':
+            raise args[0]
+        elif event == 'done':
+            self.node_done(node_id, args[0])
+        elif event == 'shard':
+            self.shard_done(node_id, *args)
+
+    def node_done(self, node_id, result):
+        self.running -= 1
+        self.journal.job_done(node_id, result)
+        self.graph.job_done(node_id, result)
+        if self.refs is not None:
+            self.refs.step_done(node_id, result)
+        for stream in self.consumers(node_id):
+            stream.expected = self.shard_counts[node_id]
+            self.check_stream(stream)
+
+    def shard_done(self, node_id, index, result, record):
+        if record:
+            self.journal.shard_done(node_id, index, result)
+        self.shard_counts[node_id] += 1
+
+        stream = self.streams.get(node_id)
+        if stream:
+            stream.results[index] = result
+            self.check_stream(stream)
+
+        for consumer in self.consumers(node_id):
+            if index in consumer.started:
+                continue
+            consumer.started.add(index)
+            future = self.executor.execute_async(
+                consumer.shard_job(index, result))
+            future.add_done_callback(
+                partial(self.post_result, consumer.node_id, index))
+
+    def consumers(self, node_id):
+        return [stream for stream in six.itervalues(self.streams)
+                if stream.source_id == node_id]
+
+    def check_stream(self, stream):
+        if not stream.finished:
+            return
+        del self.streams[stream.node_id]
+        results = [stream.results[i] for i in range(stream.expected)]
+        self.node_done(stream.node_id, self.executor.combine(results))
 
 
 # Smoke test
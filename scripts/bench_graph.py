@@ -0,0 +1,71 @@
+"""
+Measures setup time of large generated workflows: building the Workflow
+(including its step graph) and the ExecutionGraph of a run, and time
+spent tracking ready steps while all steps complete one by one.
+
+Usage: python scripts/bench_graph.py [steps ...]
+"""
+
+import sys
+import time
+
+from rabix.common.context import Context
+from rabix.common.models import Process, InputParameter, OutputParameter, Job
+from rabix.executor import Executor
+from rabix.workflows import (
+    Workflow, Step, WorkflowStepInput, WorkflowOutput, ExecutionGraph
+)
+
+WIDTH = 100
+
+
+def make_workflow(context, n):
+    """
+    Layered workflow of n steps, each step takes outputs of two steps
+    from the previous layer.
+    """
+    app = Process('noop', [InputParameter('inp', depth=1)],
+                  [OutputParameter('out')], None, None, None, None)
+    steps = []
+    for i in range(n):
+        if i < WIDTH:
+            sources = ['x']
+        else:
+            prev = i - WIDTH
+            sources = ['s%d.out' % prev,
+                       's%d.out' % (prev - prev % WIDTH + (prev + 1) % WIDTH)]
+        step_id = 's%d' % i
+        steps.append(Step(
+            step_id,
+            [WorkflowStepInput(step_id + '.inp', source=sources)],
+            [OutputParameter(step_id + '.out')],
+            None, None, None, None, app
+        ))
+    return Workflow(
+        'bench', [InputParameter('x')],
+        [WorkflowOutput('result', source='s%d.out' % (n - 1))],
+        None, None, None, None, steps, context
+    )
+
+
+def bench(n):
+    context = Context(Executor())
+
+    start = time.time()
+    wf = make_workflow(context, n)
+    built = time.time()
+    graph = ExecutionGraph(wf, Job('bench', wf, {'x': 1}, {}, context))
+    done = time.time()
+    while graph.has_next():
+        for node_id, _ in graph.ready_jobs():
+            graph.job_done(node_id, {'out': 1})
+    drained = time.time()
+
+    print('%7d steps: workflow %6.2fs, execution graph %6.2fs, '
+          'scheduling %6.2fs' %
+          (n, built - start, done - built, drained - done))
+
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or [10000, 100000]:
+        bench(n)
@@ -0,0 +1,56 @@
+"""
+Measures validating and constructing large File array inputs, as read
+from a job document: get_inputs and Process.validate_inputs on a tool
+with an array of File input and an array of optional File or string
+input.
+
+Usage: python scripts/bench_inputs.py [files ...]
+"""
+
+import sys
+import time
+
+from rabix.common.models import Process, InputParameter, OutputParameter, \
+    make_avro, get_inputs
+
+
+def make_process():
+    inputs = [
+        InputParameter.from_dict(None, {
+            'id': 'bams',
+            'type': make_avro({'type': 'array', 'items': 'File'}, [])}),
+        InputParameter.from_dict(None, {
+            'id': 'extras',
+            'type': make_avro({'type': 'array',
+                               'items': ['null', 'File', 'string']}, [])})
+    ]
+    return Process('tool', inputs, [OutputParameter('out')],
+                   [], [], None, None)
+
+
+def file_dict(i):
+    return {'path': '/data/sample_%d.bam' % i, 'size': 1024 * i,
+            'secondaryFiles': [{'path': '/data/sample_%d.bai' % i}]}
+
+
+def timed(fn):
+    start = time.time()
+    result = fn()
+    return result, time.time() - start
+
+
+def bench(n):
+    process = make_process()
+    args = {'bams': [file_dict(i) for i in range(n)],
+            'extras': [file_dict(i) for i in range(n)]}
+    inputs, construct_time = timed(
+        lambda: get_inputs(args, process.inputs, '/'))
+    valid, validate_time = timed(lambda: process.validate_inputs(args))
+    assert valid
+    print('%7d files: get_inputs %6.2fs, validate_inputs %6.2fs' %
+          (n, construct_time, validate_time))
+
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or [10000, 100000]:
+        bench(n)
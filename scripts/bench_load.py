@@ -0,0 +1,109 @@
+"""
+Measures load time of large generated workflow documents: process_builder
+on a workflow of nested sub-workflows, each step running a command line
+tool with file, array and record inputs.
+
+Usage: python scripts/bench_load.py [steps ...]
+"""
+
+import sys
+import copy
+import time
+
+import rabix.cli
+import rabix.common.models
+import rabix.workflows
+
+from rabix.common.context import Context
+from rabix.common.models import process_builder
+from rabix.executor import Executor
+
+SUBWORKFLOW_STEPS = 10
+
+REGION = {
+    'type': 'record',
+    'name': 'Region',
+    'fields': [{'name': 'chrom', 'type': 'string'},
+               {'name': 'start', 'type': 'int'},
+               {'name': 'end', 'type': 'int'}]
+}
+
+
+def tool(tool_id):
+    return {
+        'id': tool_id,
+        'class': 'CommandLineTool',
+        'inputs': [
+            {'id': 'bam', 'type': 'File', 'inputBinding': {'position': 1}},
+            {'id': 'refs', 'type': {'type': 'array', 'items': 'File'}},
+            {'id': 'region', 'type': ['null', 'Region']},
+            {'id': 'threads', 'type': ['null', 'int']}
+        ],
+        'outputs': [{'id': 'out', 'type': 'File',
+                     'outputBinding': {'glob': 'out.bam'}}],
+        'baseCommand': ['cat']
+    }
+
+
+def step(step_id, source, run):
+    return {
+        'id': step_id,
+        'run': run,
+        'inputs': [{'id': step_id + '.bam', 'source': source},
+                   {'id': step_id + '.refs', 'source': 'refs'}],
+        'outputs': [{'id': step_id + '.out'}]
+    }
+
+
+def workflow(wf_id, steps, make_run):
+    return {
+        'id': wf_id,
+        'class': 'Workflow',
+        'inputs': [{'id': 'bam', 'type': 'File'},
+                   {'id': 'refs', 'type': {'type': 'array',
+                                           'items': 'File'}}],
+        'outputs': [{'id': 'out', 'type': 'File',
+                     'source': 's%d.out' % (steps - 1)}],
+        'steps': [step('s%d' % i, 'bam' if i == 0 else 's%d.out' % (i - 1),
+                       make_run('%s_s%d' % (wf_id, i)))
+                  for i in range(steps)]
+    }
+
+
+def make_document(n):
+    """
+    Chain of sub-workflows of SUBWORKFLOW_STEPS tool steps each, n tool
+    steps in total.
+    """
+    doc = workflow(
+        'bench', max(n // SUBWORKFLOW_STEPS, 1),
+        lambda sub_id: workflow(sub_id, SUBWORKFLOW_STEPS, tool))
+    doc['requirements'] = [{'class': 'SchemaDefRequirement',
+                            'types': [REGION]}]
+    return doc
+
+
+def make_context(doc):
+    context = Context(Executor())
+    for module in (rabix.common.models, rabix.cli, rabix.workflows):
+        module.init(context)
+    context.build_from_document(doc)
+    return context
+
+
+def bench(n):
+    doc = make_document(n)
+    context = make_context(doc)
+    docs = [copy.deepcopy(doc) for _ in range(2)]
+    times = []
+    for d in docs:
+        start = time.time()
+        process_builder(context, d)
+        times.append(time.time() - start)
+    print('%7d steps: first load %6.2fs, second load %6.2fs' %
+          (n, times[0], times[1]))
+
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or [1000, 5000]:
+        bench(n)
@@ -0,0 +1,61 @@
+"""
+Measures memory taken by large file arrays flowing through a scatter:
+File objects with a secondary file each, as loaded from a job document,
+and shard jobs of a step scattered over them.
+
+Needs Python 3 (tracemalloc).
+
+Usage: python scripts/bench_memory.py [files ...]
+"""
+
+import sys
+import tracemalloc
+
+from rabix.common.context import Context
+from rabix.common.models import Process, InputParameter, OutputParameter, \
+    Job, File
+from rabix.executor import Executor
+from rabix.scatter import Scatter
+
+
+def measure(fn):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def load_files(n):
+    files = [File({'class': 'File', 'path': '/data/sample_%d.bam' % i,
+                   'size': 1024 * i,
+                   'secondaryFiles': [{'class': 'File',
+                                       'path': '/data/sample_%d.bai' % i}]})
+             for i in range(n)]
+    for f in files:
+        f.url.islocal()
+        f.secondary_files[0].url.islocal()
+    return files
+
+
+def bench(n):
+    context = Context(Executor())
+    app = Process('tool', [InputParameter('bam'), InputParameter('ref')],
+                  [OutputParameter('out')], None, None, None, None)
+
+    files, files_size = measure(lambda: load_files(n))
+    job = Job('bench', app, {'bam': files, 'ref': File('/data/ref.fa')},
+              {}, context)
+    shards, shards_size = measure(
+        lambda: list(Scatter(job, ['bam'])))
+
+    print('%7d files: files %7.1f MB (%4d B/file), shards %7.1f MB '
+          '(%4d B/shard)' %
+          (n, files_size / 2.0 ** 20, files_size // n,
+           shards_size / 2.0 ** 20, shards_size // n))
+
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or [10000, 100000]:
+        bench(n)
@@ -19,10 +19,11 @@ setup(
     packages=find_packages(),
     entry_points={
         'console_scripts': ['rabix = rabix.main:main',
-                            'rabix-tools = rabix.tools.cli:main'],
+                            'rabix-tools = rabix.tools.cli:main',
+                            'rabix-worker = rabix.distributed:main'],
     },
     install_requires=requires,
-    package_data={'': ['*.expr-plugin']},
+    package_data={'': ['*.expr-plugin', '*.js']},
     long_description=io.open('README.md').read(),
     description='Reproducible Analyses for Bioinformatics',
     zip_safe=False,